@@ -1,33 +1,121 @@
-from typing import Optional, Generator
+from typing import Optional, Generator, AsyncGenerator, Dict
+import asyncio
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Engine
+from sqlalchemy import create_engine, event, Engine
+from sqlalchemy.pool import NullPool, QueuePool
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from contextlib import contextmanager
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
+from contextlib import contextmanager, asynccontextmanager
 import logging
 from app.database.modelsDB import Base
+from app.database.migrations import run_migrations
 
 logger = logging.getLogger("app.database")
 
+# Motores soportados: MySQL (servidor) o SQLite (archivo local, gateways y pruebas)
+DB_BACKENDS = ("mysql", "sqlite")
+SQLITE_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
 class DatabaseConfig:
     """Clase para manejar la configuración de la base de datos."""
     def __init__(self):
         load_dotenv()
+        self.backend = os.getenv('DB_BACKEND', 'mysql').lower()
+        if self.backend not in DB_BACKENDS:
+            raise ValueError(f"DB_BACKEND inválido: {self.backend} (opciones: {', '.join(DB_BACKENDS)})")
+
         self.user = os.getenv('USERDB')
         self.password = os.getenv('PASSWORD')
         self.host = os.getenv('HOST')
         self.port = os.getenv('PORT')
         self.database = os.getenv('DATABASE')
         
-        if not all([self.user, self.password, self.host, self.port, self.database]):
+        if self.backend == "mysql" and not all([self.user, self.password, self.host, self.port, self.database]):
             raise ValueError("Faltan variables de entorno necesarias para la conexión a la base de datos")
+
+        # SQLite: archivo y pragmas de cada conexión
+        self.sqlite_path = os.getenv('SQLITE_PATH', 'iot_data.db')
+        self.sqlite_synchronous = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+        if self.sqlite_synchronous not in SQLITE_SYNCHRONOUS_MODES:
+            raise ValueError(f"SQLITE_SYNCHRONOUS inválido: {self.sqlite_synchronous}")
+        self.sqlite_mmap_size = int(os.getenv('SQLITE_MMAP_SIZE', '268435456'))
+        self.sqlite_cache_size_kb = int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))
+        self.sqlite_busy_timeout_ms = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+        # Configuración del pool (se aplica al motor síncrono y al asíncrono)
+        self.pool_size = int(os.getenv('DB_POOL_SIZE', '10'))
+        self.max_overflow = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+        self.pool_timeout = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+        self.pool_recycle = int(os.getenv('DB_POOL_RECYCLE', '3600'))
     
     @property
     def database_url(self) -> str:
         """Genera la URL de conexión a la base de datos."""
+        if self.backend == "sqlite":
+            return f"sqlite:///{self.sqlite_path}"
         return f"mysql+pymysql://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}"
 
+    @property
+    def async_database_url(self) -> str:
+        """Genera la URL de conexión asíncrona (driver aiomysql o aiosqlite)."""
+        if self.backend == "sqlite":
+            return f"sqlite+aiosqlite:///{self.sqlite_path}"
+        return f"mysql+aiomysql://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}"
+
+    @property
+    def sqlite_pragmas(self) -> Dict[str, str]:
+        """
+        Pragmas aplicados a cada conexión SQLite.
+
+        WAL permite leer mientras se escribe; con synchronous=NORMAL el commit
+        no espera fsync (solo los checkpoints), mmap_size y cache_size evitan
+        copias y lecturas de disco en las consultas del histórico.
+        """
+        return {
+            "journal_mode": "WAL",
+            "synchronous": self.sqlite_synchronous,
+            "mmap_size": str(self.sqlite_mmap_size),
+            # Negativo: tamaño en KiB en lugar de páginas
+            "cache_size": str(-self.sqlite_cache_size_kb),
+            "busy_timeout": str(self.sqlite_busy_timeout_ms),
+            "foreign_keys": "ON",
+            "temp_store": "MEMORY"
+        }
+
+    def engine_options(self, is_async: bool = False) -> Dict:
+        """Argumentos de ``create_engine``/``create_async_engine`` según el motor."""
+        options = {
+            "pool_size": self.pool_size,         # Número de conexiones en el pool
+            "max_overflow": self.max_overflow,   # Conexiones adicionales máximas
+            "pool_timeout": self.pool_timeout,   # Tiempo máximo de espera para conexión
+            "echo": False                        # No mostrar queries SQL en logs
+        }
+        if self.backend == "sqlite":
+            # Archivo local: no hay conexiones que verificar ni reciclar. El motor
+            # síncrono usa un pool para que cada conexión conserve su caché y mmap
+            # (se reparten entre hilos: run_sync, threadpool). El asíncrono usa
+            # NullPool: cada conexión aiosqlite tiene un hilo que no es daemon y,
+            # guardada en un pool, impediría terminar el proceso sin dispose_async()
+            if is_async:
+                options = {"poolclass": NullPool, "echo": False}
+            else:
+                options["poolclass"] = QueuePool
+            options["connect_args"] = {
+                "timeout": self.sqlite_busy_timeout_ms / 1000,
+                "check_same_thread": False
+            }
+        else:
+            options.update(
+                pool_pre_ping=True,                # Verifica la conexión antes de cada uso
+                pool_recycle=self.pool_recycle,    # Reciclar conexiones (segundos)
+                connect_args={
+                    'connect_timeout': 10          # Timeout de conexión en segundos
+                }
+            )
+        return options
+
 class Database:
     """
     Clase singleton para manejar la conexión a la base de datos.
@@ -36,6 +124,8 @@ class Database:
     _instance: Optional['Database'] = None
     _engine: Optional[Engine] = None
     _SessionFactory = None
+    _async_engine: Optional[AsyncEngine] = None
+    _AsyncSessionFactory = None
 
     def __new__(cls) -> 'Database':
         if cls._instance is None:
@@ -46,30 +136,46 @@ class Database:
         if not hasattr(self, '_initialized'):
             self._initialized = True
             self._config = DatabaseConfig()
+            # SQLite admite un solo escritor: las escrituras del proceso se encolan
+            self._write_lock = asyncio.Lock() if self._config.backend == "sqlite" else None
+            self.write_waiting = 0
+            self.writes = 0
             self._initialize_engine()
+            self._initialize_async_engine()
             self._setup_session_factory()
             self.initialize_database()
 
     def _initialize_engine(self) -> None:
         """Inicializa el motor de SQLAlchemy con configuración optimizada."""
         try:
-            self._engine = create_engine(
-                self._config.database_url,
-                pool_pre_ping=True,          # Verifica la conexión antes de cada uso
-                pool_size=10,                # Número de conexiones en el pool
-                max_overflow=20,             # Conexiones adicionales máximas
-                pool_timeout=30,             # Tiempo máximo de espera para conexión
-                pool_recycle=3600,           # Reciclar conexiones cada hora
-                echo=False,                  # No mostrar queries SQL en logs
-                connect_args={
-                    'connect_timeout': 10    # Timeout de conexión en segundos
-                }
-            )
+            self._engine = create_engine(self._config.database_url, **self._config.engine_options())
+            if self._config.backend == "sqlite":
+                event.listen(self._engine, "connect", self._apply_sqlite_pragmas)
             logger.info("Motor de base de datos inicializado correctamente")
         except Exception as e:
             logger.error(f"Error al inicializar el motor de base de datos: {e}")
             raise
 
+    def _initialize_async_engine(self) -> None:
+        """Inicializa el motor asíncrono usado por las rutas y el flush del buffer."""
+        try:
+            self._async_engine = create_async_engine(self._config.async_database_url, **self._config.engine_options(is_async=True))
+            if self._config.backend == "sqlite":
+                event.listen(self._async_engine.sync_engine, "connect", self._apply_sqlite_pragmas)
+            logger.info("Motor asíncrono de base de datos inicializado correctamente")
+        except Exception as e:
+            logger.error(f"Error al inicializar el motor asíncrono de base de datos: {e}")
+            raise
+
+    def _apply_sqlite_pragmas(self, dbapi_connection, connection_record) -> None:
+        """Configura cada conexión SQLite nueva (los pragmas no se guardan en el archivo, salvo WAL)."""
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self._config.sqlite_pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
     def _setup_session_factory(self) -> None:
         """Configura la fábrica de sesiones."""
         self._SessionFactory = sessionmaker(
@@ -78,6 +184,11 @@ class Database:
             autoflush=False,
             expire_on_commit=False
         )
+        self._AsyncSessionFactory = async_sessionmaker(
+            bind=self._async_engine,
+            autoflush=False,
+            expire_on_commit=False
+        )
 
     @contextmanager
     def session(self) -> Generator[Session, None, None]:
@@ -102,11 +213,64 @@ class Database:
         finally:
             session.close()
 
+    @asynccontextmanager
+    async def async_session(self) -> AsyncGenerator[AsyncSession, None]:
+        """
+        Equivalente asíncrono de ``session()``: no bloquea el event loop.
+
+        Example:
+            async with database.async_session() as session:
+                result = await session.execute(select(Model))
+        """
+        session: AsyncSession = self._AsyncSessionFactory()
+        try:
+            yield session
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Error en la sesión asíncrona de base de datos: {e}")
+            raise
+        finally:
+            await session.close()
+
+    @asynccontextmanager
+    async def write_session(self) -> AsyncGenerator[AsyncSession, None]:
+        """
+        Sesión asíncrona para las escrituras pesadas (flush del buffer, retención).
+
+        En SQLite se toma la cola de escritura del proceso: ``asyncio.Lock``
+        atiende en orden de llegada, así que los escritores esperan su turno
+        en el event loop en lugar de competir por el lock del archivo con los
+        reintentos de busy_timeout. Las escrituras cortas de las rutas y de
+        otros procesos siguen esperando con busy_timeout. En MySQL equivale a
+        ``async_session()``.
+        """
+        if self._write_lock is None:
+            async with self.async_session() as session:
+                yield session
+            self.writes += 1
+            return
+
+        self.write_waiting += 1
+        try:
+            await self._write_lock.acquire()
+        finally:
+            self.write_waiting -= 1
+        try:
+            async with self.async_session() as session:
+                yield session
+            self.writes += 1
+        finally:
+            self._write_lock.release()
+
     def initialize_database(self) -> None:
-        """Inicializa la base de datos creando todas las tablas necesarias."""
+        """Inicializa la base de datos creando las tablas y aplicando las migraciones pendientes."""
         try:
             Base.metadata.create_all(self._engine)
             logger.info("Tablas de base de datos creadas correctamente")
+            applied = run_migrations(self._engine)
+            if applied:
+                logger.info(f"Migraciones aplicadas: {applied}")
             self._create_default_data()
         except SQLAlchemyError as e:
             logger.error(f"Error al crear las tablas de la base de datos: {e}")
@@ -130,16 +294,59 @@ class Database:
             logger.error(f"Error al crear datos predeterminados: {e}")
             raise
 
+    @property
+    def backend(self) -> str:
+        """Retorna el motor configurado (mysql o sqlite)."""
+        return self._config.backend
+
     @property
     def engine(self) -> Engine:
         """Retorna el motor de base de datos."""
         return self._engine
 
+    @property
+    def async_engine(self) -> AsyncEngine:
+        """Retorna el motor asíncrono de base de datos."""
+        return self._async_engine
+
+    def pool_status(self) -> Dict[str, Dict[str, int]]:
+        """Métricas de los pools de conexiones (síncrono y asíncrono)."""
+        status = {}
+        for name, pool in (("sync", self._engine.pool), ("async", self._async_engine.pool)):
+            status[name] = {
+                "size": pool.size() if hasattr(pool, "size") else 0,
+                "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else 0,
+                "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else 0,
+                "overflow": pool.overflow() if hasattr(pool, "overflow") else 0
+            }
+        return status
+
+    def write_stats(self) -> Dict:
+        """Estado de la cola de escritura (solo se encola con SQLite)."""
+        return {
+            "backend": self._config.backend,
+            "queued": self._write_lock is not None,
+            "waiting": self.write_waiting,
+            "writes": self.writes
+        }
+
     def dispose(self) -> None:
         """Libera todos los recursos de la base de datos."""
         if self._engine:
             self._engine.dispose()
             logger.info("Recursos de la base de datos liberados")
 
+    async def dispose_async(self) -> None:
+        """
+        Libera las conexiones del motor asíncrono.
+
+        Los scripts que usan la base fuera de la app (benchmarks, pruebas de
+        carga) deben llamarlo antes de terminar su ``asyncio.run``: con MySQL
+        las conexiones de aiomysql quedan abiertas en el pool.
+        """
+        if self._async_engine:
+            await self._async_engine.dispose()
+            logger.info("Recursos asíncronos de la base de datos liberados")
+
 # Instancia singleton de la base de datos
 database = Database()
\ No newline at end of file
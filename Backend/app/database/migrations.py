@@ -0,0 +1,154 @@
+from sqlalchemy import Column, Connection, Engine, Index, Integer, MetaData, String, Table, func, insert, inspect, select, text
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+import argparse
+import logging
+
+from app.database.modelsDB import SensorReading, User, Usuario_Esp
+
+logger = logging.getLogger("app.migrations")
+
+# Versiones aplicadas; tabla propia para no mezclarla con los modelos
+migrations_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    migrations_metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", String(32), nullable=False)
+)
+
+# Lock con nombre de MySQL: con varios workers solo uno migra a la vez
+MIGRATION_LOCK = "schema_migrations"
+MIGRATION_LOCK_TIMEOUT_S = 60
+
+
+class MigrationError(RuntimeError):
+    """Una migración no se puede aplicar sin intervención manual."""
+    pass
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+def _model_index(model, name: str) -> Index:
+    for index in model.__table__.indexes:
+        if index.name == name:
+            return index
+    raise KeyError(f"Índice {name} no declarado en {model.__tablename__}")
+
+def _ensure_index(conn: Connection, model, name: str) -> None:
+    """
+    Crea un índice declarado en el modelo si la tabla aún no lo tiene.
+
+    Las bases nuevas ya lo reciben de ``create_all``; se compara por nombre
+    para que la migración sea idempotente.
+    """
+    table = model.__tablename__
+    existing = {index["name"] for index in inspect(conn).get_indexes(table)}
+    if name in existing:
+        return
+    _model_index(model, name).create(conn)
+    logger.info(f"Índice {name} creado en {table}")
+
+def _user_name_unique(conn: Connection) -> None:
+    duplicated = conn.execute(
+        select(User.name).group_by(User.name).having(func.count() > 1).limit(20)
+    ).scalars().all()
+    if duplicated:
+        # Son cuentas distintas con credenciales propias: no se borran automáticamente
+        raise MigrationError(
+            f"Nombres de usuario repetidos, se deben renombrar antes de migrar: {', '.join(duplicated)}"
+        )
+    _ensure_index(conn, User, "uq_user_name")
+
+def _usuario_esp_indexes(conn: Connection) -> None:
+    # Las asociaciones repetidas son equivalentes: se conserva la de menor id
+    removed = conn.execute(text(
+        "DELETE FROM usuario_esp WHERE id NOT IN ("
+        "SELECT id FROM (SELECT MIN(id) AS id FROM usuario_esp GROUP BY id_user, id_esp) AS keep_rows)"
+    )).rowcount
+    if removed:
+        logger.warning(f"{removed} asociaciones usuario-ESP repetidas eliminadas")
+    _ensure_index(conn, Usuario_Esp, "uq_usuario_esp_user_esp")
+    _ensure_index(conn, Usuario_Esp, "ix_usuario_esp_esp")
+
+def _sensor_reading_esp_ts(conn: Connection) -> None:
+    # Bases creadas antes de declarar el índice en el modelo
+    _ensure_index(conn, SensorReading, "ix_sensor_reading_esp_ts")
+
+
+# Migraciones en orden; una versión aplicada nunca se modifica, los cambios van en una nueva
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Índice único en user.name", _user_name_unique),
+    Migration(2, "Índices usuario_esp (id_user, id_esp) e id_esp", _usuario_esp_indexes),
+    Migration(3, "Índice sensor_reading (esp_id, ts)", _sensor_reading_esp_ts)
+]
+
+
+def applied_versions(conn: Connection) -> List[int]:
+    schema_version.create(conn, checkfirst=True)
+    versions = sorted(conn.execute(select(schema_version.c.version)).scalars())
+    conn.commit()
+    return versions
+
+def run_migrations(engine: Engine) -> List[int]:
+    """
+    Aplica las migraciones pendientes, cada una en su propia transacción.
+
+    Se llama después de ``create_all``: las tablas nuevas se crean
+    completas y las existentes reciben aquí los índices y restricciones
+    que ``create_all`` no agrega.
+
+    Returns:
+        Lista de versiones aplicadas en esta llamada
+
+    Raises:
+        MigrationError: Si una migración necesita intervención manual
+    """
+    applied = []
+    with engine.connect() as conn:
+        locked = conn.dialect.name == "mysql"
+        if locked and not conn.execute(
+            text("SELECT GET_LOCK(:name, :timeout)"), {"name": MIGRATION_LOCK, "timeout": MIGRATION_LOCK_TIMEOUT_S}
+        ).scalar():
+            raise MigrationError("No se obtuvo el lock de migraciones")
+        conn.commit()
+        try:
+            done = set(applied_versions(conn))
+            for migration in MIGRATIONS:
+                if migration.version in done:
+                    continue
+                logger.info(f"Aplicando migración {migration.version}: {migration.description}")
+                with conn.begin():
+                    migration.apply(conn)
+                    conn.execute(insert(schema_version).values(
+                        version=migration.version,
+                        description=migration.description,
+                        applied_at=datetime.now().isoformat()
+                    ))
+                applied.append(migration.version)
+        finally:
+            if locked:
+                conn.rollback()
+                conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MIGRATION_LOCK})
+                conn.commit()
+    return applied
+
+
+def main():
+    # Inicializar la base de datos ya aplica las migraciones pendientes
+    from app.database.database import database
+
+    argparse.ArgumentParser(description="Aplica las migraciones pendientes y muestra su estado").parse_args()
+    with database.engine.connect() as conn:
+        done = set(applied_versions(conn))
+    for migration in MIGRATIONS:
+        state = "aplicada" if migration.version in done else "pendiente"
+        print(f"{migration.version:>4}  {state:<9}  {migration.description}")
+
+if __name__ == "__main__":
+    main()
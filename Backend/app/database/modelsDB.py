@@ -1,11 +1,15 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, JSON, Float
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, JSON, Float, Index, PrimaryKeyConstraint
+from sqlalchemy.orm import relationship, declared_attr
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 class User(Base):
     __tablename__ = 'user'
+    __table_args__ = (
+        # Login, get_current_user y validate_ws_token buscan por nombre
+        Index('uq_user_name', 'name', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(50), nullable=False)
@@ -29,12 +33,20 @@ class Esp(Base):
 
     # Relación con Usuario
     usuarios = relationship("Usuario_Esp", back_populates="esp")
+    # Histórico de lecturas
+    lecturas = relationship("SensorReading", back_populates="esp", passive_deletes=True)
 
     def __repr__(self):
         return f"<Esp(id={self.id}, identification={self.identification})>"
 
 class Usuario_Esp(Base):
     __tablename__ = 'usuario_esp'
+    __table_args__ = (
+        # Un ESP se asocia una sola vez a cada usuario
+        Index('uq_usuario_esp_user_esp', 'id_user', 'id_esp', unique=True),
+        # Validación de acceso: join por id_esp
+        Index('ix_usuario_esp_esp', 'id_esp'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     id_user = Column(Integer, ForeignKey('user.id'), nullable=False)
@@ -46,3 +58,64 @@ class Usuario_Esp(Base):
 
     def __repr__(self):
         return f"<Usuario_Esp(id={self.id}, id_user={self.id_user}, id_esp={self.id_esp})>"
+
+class SensorReading(Base):
+    __tablename__ = 'sensor_reading'
+    __table_args__ = (
+        # Consultas por dispositivo y rango de tiempo
+        Index('ix_sensor_reading_esp_ts', 'esp_id', 'ts'),
+    )
+
+    # En SQLite solo INTEGER PRIMARY KEY es alias de rowid y se autoincrementa
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    esp_id = Column(Integer, ForeignKey('esp.id', ondelete='CASCADE'), nullable=False)
+    ts = Column(BigInteger, nullable=False)  # Epoch en milisegundos
+    temperature = Column(Float, nullable=True)
+    humidity = Column(Float, nullable=True)
+    extra = Column(JSON, nullable=True)  # Otros valores enviados por el sensor
+
+    # Relación con Esp
+    esp = relationship("Esp", back_populates="lecturas")
+
+    def __repr__(self):
+        return f"<SensorReading(id={self.id}, esp_id={self.esp_id}, ts={self.ts})>"
+
+class SensorRollupMixin:
+    """
+    Agregados de lecturas por dispositivo y bucket de tiempo.
+
+    Se guardan cantidad, suma, mínimo, máximo y último valor para poder
+    combinar buckets (el promedio es suma / cantidad).
+    """
+    # Clave (esp_id, bucket_ts): los rangos de un dispositivo se leen en orden
+    __table_args__ = (PrimaryKeyConstraint('esp_id', 'bucket_ts'),)
+
+    @declared_attr
+    def esp_id(cls):
+        return Column(Integer, ForeignKey('esp.id', ondelete='CASCADE'), primary_key=True)
+
+    bucket_ts = Column(BigInteger, primary_key=True)  # Inicio del bucket, epoch en ms
+    count = Column(Integer, nullable=False, default=0)
+    temperature_count = Column(Integer, nullable=False, default=0)
+    temperature_sum = Column(Float, nullable=False, default=0)
+    temperature_min = Column(Float, nullable=True)
+    temperature_max = Column(Float, nullable=True)
+    temperature_last = Column(Float, nullable=True)
+    humidity_count = Column(Integer, nullable=False, default=0)
+    humidity_sum = Column(Float, nullable=False, default=0)
+    humidity_min = Column(Float, nullable=True)
+    humidity_max = Column(Float, nullable=True)
+    humidity_last = Column(Float, nullable=True)
+    last_ts = Column(BigInteger, nullable=False)  # ts de la lectura más reciente del bucket
+
+    def __repr__(self):
+        return f"<{type(self).__name__}(esp_id={self.esp_id}, bucket_ts={self.bucket_ts}, count={self.count})>"
+
+class SensorRollupMinute(SensorRollupMixin, Base):
+    __tablename__ = 'sensor_rollup_1m'
+
+class SensorRollupHour(SensorRollupMixin, Base):
+    __tablename__ = 'sensor_rollup_1h'
+
+class SensorRollupDay(SensorRollupMixin, Base):
+    __tablename__ = 'sensor_rollup_1d'
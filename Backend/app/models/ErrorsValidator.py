@@ -12,4 +12,8 @@ class AuthenticationError(Exception):
 
 class DatabaseError(Exception):
     """Excepción personalizada para errores de base de datos"""
-    pass
\ No newline at end of file
+    pass
+
+class HashingOverloadedError(Exception):
+    """Excepción cuando el pool de hashing de contraseñas está saturado"""
+    pass
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, field_validator
-from typing import Dict
+from typing import Dict, List
 
 class EspData(BaseModel):
     identification: str = Field(..., min_length=1, max_length=50)
@@ -21,6 +21,27 @@ class EspData(BaseModel):
             }
         }
 
+class EspBulkRegisterRequest(BaseModel):
+    devices: List[EspData] = Field(..., min_length=1, max_length=5000)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "devices": [
+                    {
+                        "identification": "ESP32-ABC123",
+                        "user": 1,
+                        "sensors_data": {"temperature": 25.2, "humidity": 86}
+                    },
+                    {
+                        "identification": "ESP32-DEF456",
+                        "user": 1,
+                        "sensors_data": {"temperature": 24.8, "humidity": 80}
+                    }
+                ]
+            }
+        }
+
 class EspValidationExistRequest(BaseModel):
     identification: str
     
@@ -1,12 +1,20 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from typing import Dict, Any
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Any, Optional
 import logging
 from datetime import datetime
-from app.models.EspData import EspData, EspValidationExistRequest
-from app.utils.database_dependencies import get_transactional_db
-from app.database.modelsDB import Esp, User, Usuario_Esp
-from app.utils.esp_dependencies import EspValidationExists
+from app.models.EspData import EspData, EspBulkRegisterRequest, EspValidationExistRequest
+from app.utils.database_dependencies import get_async_db, get_async_transactional_db
+from app.utils.esp_dependencies import (
+    EspValidationExists, invalidate_esp_cache, register_esps,
+    REGISTER_CREATED, REGISTER_UPDATED, REGISTER_USER_NOT_FOUND
+)
+from app.utils.sensor_dependencies import resolve_esp_ids
+from app.utils.history_dependencies import (
+    FORMAT_NDJSON, MEDIA_TYPES, history_range, parse_resolution, history_plan, source_name, stream_history
+)
+from app.database.database import database
 
 logger = logging.getLogger("app.esp_routes")
 
@@ -54,14 +62,14 @@ esp_routes = APIRouter()
 )
 async def register_esp(
     sensor_data: EspData,
-    db: Session = Depends(get_transactional_db)
+    db: AsyncSession = Depends(get_async_transactional_db)
 ):
     """
     Registra o actualiza un dispositivo ESP y lo asocia con un usuario.
     
     Args:
         sensor_data: Datos del sensor y usuario
-        db: Sesión de base de datos con manejo de transacciones
+        db: Sesión asíncrona con commit al finalizar
     
     Returns:
         Dict con la información del registro/actualización
@@ -72,61 +80,29 @@ async def register_esp(
     start_time = datetime.now()
     
     try:
-        # Verificar si el usuario existe en una sola consulta
-        user = db.query(User).filter_by(id=sensor_data.user).first()
-        if not user:
+        # Mismo camino que el registro por lotes, con un solo dispositivo
+        result = (await db.run_sync(register_esps, [sensor_data]))[0]
+        if result["status"] == REGISTER_USER_NOT_FOUND:
             logger.warning(f"Intento de registro con usuario inexistente ID: {sensor_data.user}")
             raise HTTPException(
                 status_code=404,
                 detail=f"Usuario con ID {sensor_data.user} no encontrado"
             )
 
-        # Buscar o crear ESP en una sola operación
-        esp = (
-            db.query(Esp)
-            .filter_by(identification=sensor_data.identification)
-            .first()
-        )
-        
-        if esp:
-            # Actualizar ESP existente
-            esp.json_sensores = sensor_data.sensors_data
-            logger.info(f"Actualizando ESP existente: {sensor_data.identification}")
-        else:
-            # Crear nuevo ESP
-            esp = Esp(
-                identification=sensor_data.identification,
-                json_sensores=sensor_data.sensors_data
-            )
-            db.add(esp)
-            # Flush para obtener el ID del ESP pero mantener la transacción
-            db.flush()
-            logger.info(f"Registrando nuevo ESP: {sensor_data.identification}")
-
-        # Verificar la relación usuario-ESP existente
-        usuario_esp = (
-            db.query(Usuario_Esp)
-            .filter_by(id_user=sensor_data.user, id_esp=esp.id)
-            .first()
-        )
+        # Confirmar antes de invalidar la caché para que ninguna validación
+        # concurrente vuelva a guardar el estado anterior
+        await db.commit()
+        invalidate_esp_cache(sensor_data.identification)
 
-        if not usuario_esp:
-            # Crear nueva relación
-            usuario_esp = Usuario_Esp(
-                id_user=sensor_data.user,
-                id_esp=esp.id
-            )
-            db.add(usuario_esp)
-            logger.info(f"Creando nueva relación Usuario-ESP: User {sensor_data.user} - ESP {esp.id}")
-        
-        # El commit se maneja automáticamente por get_transactional_db
+        updated = result["status"] == REGISTER_UPDATED
+        logger.info(f"{'Actualizado' if updated else 'Registrado'} ESP {sensor_data.identification} para el usuario {sensor_data.user}")
         response_time = (datetime.now() - start_time).total_seconds()
         
         return {
             "status": "success",
-            "esp_id": esp.id,
+            "esp_id": result["esp_id"],
             "user_id": sensor_data.user,
-            "message": "ESP actualizado y asociado al usuario" if esp else "ESP registrado y asociado al usuario",
+            "message": "ESP actualizado y asociado al usuario" if updated else "ESP registrado y asociado al usuario",
             "response_time_seconds": response_time
         }
             
@@ -140,6 +116,50 @@ async def register_esp(
             detail="Error interno del servidor"
         )
 
+@esp_routes.post("/api/esp/register/bulk", response_model=Dict[str, Any])
+async def register_esp_bulk(
+    request: EspBulkRegisterRequest,
+    db: AsyncSession = Depends(get_async_transactional_db)
+):
+    """
+    Registra o actualiza varios ESP en una sola petición.
+
+    Las filas existentes se resuelven con consultas ``IN`` y los ESP,
+    asociaciones y lecturas se escriben con sentencias por conjunto, en una
+    sola transacción. Un usuario inexistente no detiene el lote: se informa
+    en el resultado de ese dispositivo.
+
+    Returns:
+        Dict con contadores y el resultado de cada dispositivo en el orden recibido
+    """
+    start_time = datetime.now()
+
+    try:
+        results = await db.run_sync(register_esps, request.devices)
+        await db.commit()
+        for identification in {device.identification for device in request.devices}:
+            invalidate_esp_cache(identification)
+    except Exception as e:
+        logger.error(f"Error en el registro por lotes de ESP: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="Error interno del servidor"
+        )
+
+    counts = {REGISTER_CREATED: 0, REGISTER_UPDATED: 0, REGISTER_USER_NOT_FOUND: 0}
+    for result in results:
+        counts[result["status"]] += 1
+    logger.info(f"Registro por lotes de {len(results)} ESP: {counts}")
+
+    return {
+        "status": "success",
+        "created": counts[REGISTER_CREATED],
+        "updated": counts[REGISTER_UPDATED],
+        "failed": counts[REGISTER_USER_NOT_FOUND],
+        "results": results,
+        "response_time_seconds": (datetime.now() - start_time).total_seconds()
+    }
+
 @esp_routes.post(
     "/api/esp/validate-association",
     response_model=Dict[str, Any],
@@ -195,7 +215,7 @@ async def register_esp(
 )
 async def validate_esp_association(
     validation_data: EspValidationExistRequest,
-    db: Session = Depends(get_transactional_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Endpoint para validar si un ESP está asociado a un usuario usando su identificador.
@@ -203,7 +223,7 @@ async def validate_esp_association(
     
     Args:
         validation_data: Datos de validación del ESP
-        db: Sesión de base de datos con manejo de transacciones
+        db: Sesión asíncrona de base de datos
     
     Returns:
         Dict con la información de la asociación
@@ -215,7 +235,9 @@ async def validate_esp_association(
         logger.info(f"Iniciando validación de asociación para ESP: {validation_data.identification}")
         
         # Utilizar la función de utilidad para la validación
-        result = EspValidationExists(validation_data.identification, db)
+        result = await db.run_sync(
+            lambda session: EspValidationExists(validation_data.identification, session)
+        )
         
         logger.info(f"Validación completada exitosamente para ESP: {validation_data.identification}")
         return result
@@ -225,4 +247,58 @@ async def validate_esp_association(
         raise HTTPException(
             status_code=500,
             detail="Error al consultar la base de datos"
-        )
\ No newline at end of file
+        )
+
+@esp_routes.get("/api/esp/{device_id}/history")
+async def get_esp_history(
+    device_id: str,
+    from_param: Optional[str] = Query(None, alias="from", description="Inicio (epoch ms o ISO 8601), por defecto 24 h antes de 'to'"),
+    to_param: Optional[str] = Query(None, alias="to", description="Fin exclusivo (epoch ms o ISO 8601), por defecto ahora"),
+    resolution: str = Query("auto", description="Tamaño del bucket: auto, 500ms, 30s, 5m, 1h, 1d"),
+    output_format: str = Query(FORMAT_NDJSON, alias="format", pattern="^(ndjson|json)$")
+):
+    """
+    Histórico de lecturas de un ESP agregado por buckets de tiempo.
+
+    La agregación (mínimo, máximo, promedio y último valor por bucket) se
+    hace en la base de datos, sobre el rollup más grueso que cumpla la
+    resolución (1m, 1h o 1d) o sobre las lecturas crudas para buckets de
+    menos de un minuto. La respuesta se envía por partes: NDJSON con
+    un bucket por línea, o un objeto JSON escrito de forma incremental. La
+    cantidad de buckets está acotada por HISTORY_MAX_BUCKETS.
+
+    Raises:
+        HTTPException: 400 si el rango o la resolución son inválidos, 404 si
+            el ESP no existe
+    """
+    try:
+        from_ms, to_ms = history_range(from_param, to_param)
+        bucket_ms, rollup = history_plan(from_ms, to_ms, parse_resolution(resolution))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async with database.async_session() as db:
+        esp_ids = await db.run_sync(resolve_esp_ids, {device_id})
+    esp_id = esp_ids.get(device_id)
+    if esp_id is None:
+        raise HTTPException(status_code=404, detail=f"ESP con identificador {device_id} no encontrado")
+
+    source = source_name(rollup)
+    header = {"device_id": device_id, "from": from_ms, "to": to_ms, "bucket_ms": bucket_ms, "source": source}
+
+    async def body():
+        # La sesión vive mientras se envía la respuesta
+        async with database.async_session() as db:
+            async for part in stream_history(db, header, esp_id, from_ms, to_ms, bucket_ms, rollup, output_format):
+                yield part
+
+    return StreamingResponse(
+        body(),
+        media_type=MEDIA_TYPES[output_format],
+        headers={
+            "X-Bucket-Ms": str(bucket_ms),
+            "X-Range-From": str(from_ms),
+            "X-Range-To": str(to_ms),
+            "X-History-Source": source
+        }
+    )
@@ -1,93 +1,139 @@
 # websocket_routes.py
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import Dict, Any
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query
+from starlette.websockets import WebSocketState
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Any, Optional
 from datetime import datetime
 import logging
+import os
 
 from app.utils.WsManager import websocket_manager
-from app.utils.database_dependencies import get_transactional_db
-from app.utils.esp_dependencies import EspValidationExists
+from app.utils.BufferManager import data_buffer
+from app.utils.database_dependencies import get_async_db
+from app.database.database import database
+from app.utils.esp_dependencies import EspValidationExists, user_has_device_access, user_device_ids
 from app.database.modelsDB import Esp, Usuario_Esp, User
 from app.models.EspData import ComandMotorsRequest
 from app.utils.JWT_Auth import validate_ws_token
+from app.utils.CommandTracker import command_tracker
+from app.utils.json_dependencies import decode_json
+from app.utils.Metrics import INGEST_MESSAGES, INGEST_SAMPLES
+from app.utils.telemetry_dependencies import (
+    FORMAT_BINARY_V1, TelemetryFrameError, negotiate_format, decode_frame, parse_batch, iter_sensor_data,
+    sequence_tracker, telemetry_stats
+)
 import json
+import time
 # Configurar logger
 logger = logging.getLogger("app.websocket_routes")
 
 esp_socket = APIRouter()
 
-async def validate_esp_connection(device_id: str, db: Session) -> bool:
+# SUBSCRIBE por lotes: modo para todos los dispositivos del usuario y límite de la lista
+SUBSCRIBE_ALL = "ALL"
+SUBSCRIBE_MAX_DEVICES = int(os.getenv("SUBSCRIBE_MAX_DEVICES", "1000"))
+
+# Contadores de ingesta por tipo de mensaje y formato (resueltos una vez)
+INGESTED_SENSOR_DATA = INGEST_MESSAGES.labels("sensor_data")
+INGESTED_SENSOR_BATCH = INGEST_MESSAGES.labels("sensor_batch")
+INGESTED_BINARY_FRAME = INGEST_MESSAGES.labels("binary_frame")
+INGESTED_MOTOR_STATUS = INGEST_MESSAGES.labels("motor_status")
+INGESTED_INVALID = INGEST_MESSAGES.labels("invalid")
+INGESTED_OTHER = INGEST_MESSAGES.labels("other")
+SAMPLES_JSON = INGEST_SAMPLES.labels("json")
+SAMPLES_BATCH = INGEST_SAMPLES.labels("batch")
+SAMPLES_BINARY = INGEST_SAMPLES.labels("binary")
+
+async def validate_esp_connection(device_id: str, db: AsyncSession) -> bool:
     """
     Valida si el ESP está registrado y asociado a un usuario
     
     Args:
         device_id: Identificador del ESP
-        db: Sesión de base de datos
+        db: Sesión asíncrona de base de datos
         
     Returns:
         bool: True si el ESP está validado, False en caso contrario
     """
     try:
-        result = EspValidationExists(device_id, db)
+        result = await db.run_sync(lambda session: EspValidationExists(device_id, session))
         return result.get("is_associated", False)
     except Exception as e:
         logger.error(f"Error validando ESP {device_id}: {str(e)}")
         return False
 
-async def update_esp_data(db: Session, esp_id: str, sensor_data: Dict):
-    """
-    Actualiza los datos del ESP en la base de datos
-    """
-    try:
-        esp = db.query(Esp).filter(Esp.identification == esp_id).first()
-        if esp:
-            esp.json_sensores = sensor_data
-            db.commit()
-            logger.info(f"Datos actualizados en BD para ESP {esp_id}")
-    except Exception as e:
-        logger.error(f"Error actualizando datos del ESP {esp_id}: {str(e)}")
-        db.rollback()
-
 @esp_socket.websocket("/ws/esp/{device_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
-    device_id: str,
-    db: Session = Depends(get_transactional_db)
+    device_id: str
 ):
     """Endpoint principal del WebSocket para comunicación con ESPs"""
     try:
-        # Validar la conexión del ESP
-        if not await validate_esp_connection(device_id, db):
+        # Validar la conexión del ESP; la sesión se libera antes de aceptar el socket
+        async with database.async_session() as db:
+            is_valid = await validate_esp_connection(device_id, db)
+
+        if not is_valid:
             logger.warning(f"ESP no validado o no asociado: {device_id}")
             await websocket.close(code=4000)
             return
             
-        # Aceptar la conexión WebSocket
-        await websocket_manager.connect_esp(websocket, device_id)
-        logger.info(f"Nueva conexión WebSocket establecida: {device_id}")
+        # Aceptar la conexión WebSocket con el formato de telemetría negociado
+        telemetry_format, subprotocol = negotiate_format(websocket)
+        await websocket_manager.connect_esp(websocket, device_id, subprotocol)
+        logger.info(f"Nueva conexión WebSocket establecida: {device_id} ({telemetry_format})")
         
         try:
             while True:
-                data = await websocket.receive_json()
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+
+                if message.get("bytes") is not None:
+                    if telemetry_format != FORMAT_BINARY_V1:
+                        # Un cliente JSON no puede enviar frames binarios
+                        await websocket.close(code=1003)
+                        break
+                    await handle_binary_frame(device_id, message["bytes"])
+                    continue
+
+                data = decode_json(message["text"])
+                telemetry_stats["json_messages"] += 1
                 
                 if "type" in data and data["type"] == "SENSOR_DATA":
+                    INGESTED_SENSOR_DATA.inc()
+                    SAMPLES_JSON.inc()
                     sensor_data = {
                         "temperature": data.get("temperature"),
                         "humidity": data.get("humidity"),
                         "timestamp": datetime.now().isoformat()
                     }
                     
+                    # Encolar para persistencia; según la política puede frenar la lectura
+                    await data_buffer.submit(device_id, sensor_data)
+
                     # Usar broadcast_esp_data en lugar de broadcast_to_frontends
                     await websocket_manager.broadcast_esp_data(device_id, sensor_data)
                     logger.info(f"Datos recibidos de {device_id}")
+
+                elif data.get("type") == "SENSOR_BATCH":
+                    # Varias muestras con marca de tiempo y secuencia del ESP
+                    await handle_sensor_batch(device_id, data)
+
+                elif data.get("type") == "MOTOR_STATUS":
+                    INGESTED_MOTOR_STATUS.inc()
+                    # Confirmación de comandos y cambios de estado del motor
+                    await websocket_manager.handle_motor_status(device_id, data)
+
+                else:
+                    INGESTED_OTHER.inc()
                     
         except WebSocketDisconnect:
             logger.info(f"Desconexión normal del cliente: {device_id}")
         except Exception as e:
             logger.error(f"Error procesando mensajes de {device_id}: {str(e)}")
         finally:
-            websocket_manager.disconnect_esp(device_id)
+            websocket_manager.disconnect_esp(device_id, websocket)
             
     except Exception as e:
         logger.error(f"Error en la conexión WebSocket de {device_id}: {str(e)}")
@@ -96,37 +142,101 @@ async def websocket_endpoint(
         except:
             pass
 
+async def ingest_samples(device_id: str, samples: list, boot_id: Optional[str] = None):
+    """
+    Ingresa un conjunto de muestras (frame binario o SENSOR_BATCH) como una unidad.
+
+    Se descartan las secuencias ya recibidas, el resto entra a la cola de
+    ingesta como un solo lote y los dashboards reciben un único mensaje.
+    """
+    samples, advanced = sequence_tracker.filter(device_id, samples, boot_id)
+    if not samples:
+        return
+
+    readings = list(iter_sensor_data(samples, int(time.time() * 1000)))
+    await data_buffer.submit_batch(device_id, readings)
+
+    # Un lote que solo llena huecos no reemplaza el estado más reciente
+    latest = readings[-1][1]
+    if not advanced:
+        latest = websocket_manager.esp_states.get(device_id, latest)
+    lot = [sensor_data for _, sensor_data in readings] if len(readings) > 1 else None
+    await websocket_manager.broadcast_esp_data(device_id, latest, lot)
+
+async def handle_binary_frame(device_id: str, frame: bytes):
+    """
+    Ingresa un frame binario de telemetría.
+
+    Un frame inválido se descarta sin cerrar la conexión.
+    """
+    try:
+        _, samples = decode_frame(frame)
+    except TelemetryFrameError as e:
+        telemetry_stats["invalid_frames"] += 1
+        INGESTED_INVALID.inc()
+        logger.warning(f"Frame binario inválido de {device_id}: {str(e)}")
+        return
+
+    telemetry_stats["binary_frames"] += 1
+    telemetry_stats["binary_samples"] += len(samples)
+    INGESTED_BINARY_FRAME.inc()
+    SAMPLES_BINARY.inc(len(samples))
+    await ingest_samples(device_id, samples)
+
+async def handle_sensor_batch(device_id: str, data: dict):
+    """Ingresa un mensaje SENSOR_BATCH; un lote inválido se descarta sin cerrar la conexión."""
+    try:
+        samples = parse_batch(data)
+    except TelemetryFrameError as e:
+        telemetry_stats["invalid_frames"] += 1
+        INGESTED_INVALID.inc()
+        logger.warning(f"SENSOR_BATCH inválido de {device_id}: {str(e)}")
+        return
+
+    telemetry_stats["batch_messages"] += 1
+    telemetry_stats["batch_samples"] += len(samples)
+    INGESTED_SENSOR_BATCH.inc()
+    SAMPLES_BATCH.inc(len(samples))
+    boot_id = data.get("boot_id")
+    await ingest_samples(device_id, samples, str(boot_id) if boot_id is not None else None)
+    logger.info(f"Lote de {len(samples)} muestras recibido de {device_id}")
+
 @esp_socket.post("/api/esp/{device_id}/motor")
-async def control_motor(device_id: str, command: ComandMotorsRequest, db: Session = Depends(get_transactional_db)):
+async def control_motor(
+    device_id: str,
+    command: ComandMotorsRequest,
+    wait_ack: bool = Query(False, description="Esperar la confirmación (MOTOR_STATUS) del ESP")
+):
     """
     Endpoint para controlar el motor de un ESP
     
     Args:
         device_id: Identificador del ESP
         command: Comando para el motor ("START_MOTOR" o "STOP_MOTOR")
-        db: Sesión de base de datos
+        wait_ack: Si es True responde cuando el ESP confirma el comando
+            (504 si no lo confirma tras los reintentos)
         
     Returns:
         dict: Resultado de la operación
     """
     try:
-        if not websocket_manager.is_connected_esp(device_id):
-            raise HTTPException(status_code=404, detail="ESP no conectado")
-        
         command_dict = {
             "type": "MOTOR_COMMAND",
             "action": command.action  # Ya está validado
         }
-            
-        success = await websocket_manager.send_command_to_esp(device_id, command_dict)
-        
-        if not success:
-            raise HTTPException(status_code=500, detail="Error al enviar comando")
-            
+
+        # Responde 404 si ningún worker tiene el ESP conectado
+        result = await websocket_manager.send_command_to_esp(device_id, command_dict, wait_ack)
+
         return {
             "status": "success",
-            "message": f"Comando {command.action} enviado exitosamente",
-            "device_id": device_id
+            "message": f"Comando {command.action} {'confirmado' if wait_ack else 'enviado'} exitosamente",
+            "device_id": device_id,
+            "command_id": result["command_id"],
+            "acknowledged": result["acknowledged"],
+            "motor_status": result.get("status"),
+            "attempts": result.get("attempts"),
+            "rtt_ms": result.get("rtt_ms")
         }
         
     except ValueError as e:
@@ -139,14 +249,25 @@ async def control_motor(device_id: str, command: ComandMotorsRequest, db: Sessio
         logger.error(f"Error en control de motor para {device_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@esp_socket.get("/api/esp/{device_id}/commands/latency")
+async def get_command_latency(device_id: str):
+    """
+    Histograma de latencia de ida y vuelta (envío → MOTOR_STATUS) de los
+    comandos de un ESP, medido en el worker que tiene su socket.
+    """
+    return {
+        "status": "success",
+        "data": command_tracker.device_stats(device_id)
+    }
+
 @esp_socket.get("/api/esp/{device_id}/state")
-async def get_esp_state(device_id: str, db: Session = Depends(get_transactional_db)):
+async def get_esp_state(device_id: str, db: AsyncSession = Depends(get_async_db)):
     """
     Endpoint para obtener el último estado conocido de un ESP
     
     Args:
         device_id: Identificador del ESP
-        db: Sesión de base de datos
+        db: Sesión asíncrona de base de datos
         
     Returns:
         dict: Estado actual del ESP
@@ -156,7 +277,7 @@ async def get_esp_state(device_id: str, db: Session = Depends(get_transactional_
         if not await validate_esp_connection(device_id, db):
             raise HTTPException(status_code=404, detail="ESP no encontrado")
         
-        state = websocket_manager.get_esp_state(device_id)
+        state = await websocket_manager.fetch_esp_state(device_id)
         if not state:
             raise HTTPException(
                 status_code=404,
@@ -174,9 +295,52 @@ async def get_esp_state(device_id: str, db: Session = Depends(get_transactional_
         logger.error(f"Error obteniendo estado de {device_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
     
+async def subscribe_devices(user_name: str, message: Dict[str, Any]) -> None:
+    """
+    SUBSCRIBE por lotes: ``device_ids`` con una lista de dispositivos o
+    ``mode: "ALL"`` para todos los del usuario.
+
+    Los permisos se resuelven en una sola consulta y los estados actuales
+    se envían juntos en un frame ESP_SNAPSHOT.
+    """
+    if message.get("mode") == SUBSCRIBE_ALL:
+        requested = None
+    else:
+        requested = message.get("device_ids")
+        if not isinstance(requested, list) or not all(isinstance(device_id, str) for device_id in requested):
+            websocket_manager.send_to_frontend(user_name, {
+                "type": "ERROR",
+                "message": "device_ids debe ser una lista de identificadores"
+            })
+            return
+        if len(requested) > SUBSCRIBE_MAX_DEVICES:
+            websocket_manager.send_to_frontend(user_name, {
+                "type": "ERROR",
+                "message": f"Máximo {SUBSCRIBE_MAX_DEVICES} dispositivos por SUBSCRIBE"
+            })
+            return
+
+    async with database.async_session() as db:
+        allowed = await db.run_sync(user_device_ids, user_name, requested)
+
+    if allowed:
+        websocket_manager.subscribe_to_devices(user_name, allowed, message.get("interval_ms"))
+    allowed_set = set(allowed)
+    websocket_manager.send_to_frontend(user_name, {
+        "type": "ESP_SNAPSHOT",
+        "devices": await websocket_manager.fetch_esp_states(allowed),
+        "subscribed": allowed,
+        "denied": [device_id for device_id in dict.fromkeys(requested or ()) if device_id not in allowed_set]
+    })
+
 @esp_socket.websocket("/ws/frontend")
-async def frontend_websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_transactional_db)):
-    """Endpoint WebSocket para clientes frontend."""
+async def frontend_websocket_endpoint(websocket: WebSocket):
+    """
+    Endpoint WebSocket para clientes frontend.
+
+    No mantiene una sesión de BD durante la vida del socket: cada validación
+    abre una sesión corta que devuelve la conexión al pool al terminar.
+    """
     user = None
     try:
         # 1. Validación del token
@@ -185,7 +349,8 @@ async def frontend_websocket_endpoint(websocket: WebSocket, db: Session = Depend
             await websocket.close(code=4001, reason="Token no proporcionado")
             return
 
-        user = await validate_ws_token(authorization_header, db)
+        async with database.async_session() as db:
+            user = await validate_ws_token(authorization_header, db)
         if not user:
             await websocket.close(code=4001, reason="Token inválido")
             return
@@ -204,37 +369,36 @@ async def frontend_websocket_endpoint(websocket: WebSocket, db: Session = Depend
                 if not isinstance(message, dict) or "type" not in message:
                     continue
 
+                if message["type"] == "SUBSCRIBE" and (
+                    message.get("mode") == SUBSCRIBE_ALL or "device_ids" in message
+                ):
+                    await subscribe_devices(user.name, message)
+                    continue
+
                 if message["type"] == "SUBSCRIBE":
                     device_id = message.get("device_id")
                     if not device_id:
                         continue
 
-                    # Verificar acceso al dispositivo
-                    usuario_esp = (
-                        db.query(Usuario_Esp)
-                        .join(Esp)
-                        .join(User)
-                        .filter(
-                            Esp.identification == device_id,
-                            User.name == user.name
-                        )
-                        .first()
-                    )
-
-                    if not usuario_esp:
-                        await websocket.send_json({
+                    # Verificar acceso al dispositivo (con caché por usuario y dispositivo)
+                    async with database.async_session() as db:
+                        allowed = await db.run_sync(user_has_device_access, user.name, device_id)
+                    if not allowed:
+                        websocket_manager.send_to_frontend(user.name, {
                             "type": "ERROR",
                             "message": "No tienes acceso a este dispositivo"
                         })
                         continue
 
-                    # Realizar suscripción
-                    websocket_manager.subscribe_to_device(user.name, device_id)
+                    # Realizar suscripción; "interval_ms" negocia la agrupación de ESP_DATA
+                    websocket_manager.subscribe_to_device(
+                        user.name, device_id, message.get("interval_ms")
+                    )
                     
                     # Enviar estado actual si existe
-                    current_state = websocket_manager.get_esp_state(device_id)
+                    current_state = await websocket_manager.fetch_esp_state(device_id)
                     if current_state:
-                        await websocket.send_json({
+                        websocket_manager.send_to_frontend(user.name, {
                             "type": "ESP_DATA",
                             "device_id": device_id,
                             "data": current_state
@@ -253,4 +417,4 @@ async def frontend_websocket_endpoint(websocket: WebSocket, db: Session = Depend
             await websocket.close(code=1011)
     finally:
         if user and hasattr(user, 'name'):
-            websocket_manager.disconnect_frontend(user.name)
\ No newline at end of file
+            websocket_manager.disconnect_frontend(user.name, websocket)
\ No newline at end of file
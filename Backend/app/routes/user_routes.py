@@ -1,20 +1,29 @@
 import logging
 import os 
 from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
-from app.utils.crypt_dependencies import crypt_password, crypt_verify_password
+from app.utils.crypt_dependencies import crypt_password, crypt_verify_password, crypt_needs_rehash
 from app.database.modelsDB import User
-from app.utils.database_dependencies import get_transactional_db, get_db
+from app.utils.database_dependencies import get_async_transactional_db, get_async_db
 from app.models.UserValidator import UserCreate, LoginData, Token
-from app.utils.JWT_Auth import create_access_token, get_current_user
-from app.models.ErrorsValidator import DatabaseError
+from app.utils.JWT_Auth import create_access_token, get_current_user, invalidate_user_cache
+from app.models.ErrorsValidator import DatabaseError, HashingOverloadedError
 
 logger = logging.getLogger("app.esp_routes")
 
 user_routers = APIRouter()
 
+def hashing_unavailable() -> HTTPException:
+    """Respuesta 503 cuando el pool de bcrypt no admite más operaciones."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Servicio temporalmente saturado, intente de nuevo",
+        headers={"Retry-After": "1"}
+    )
+
 @user_routers.post("/users/", 
                    response_model=dict,
                    responses={
@@ -36,15 +45,18 @@ user_routers = APIRouter()
                                     "message": "Error interno en el servidor"
                                 }
                             }
+                        },
+                       503: {
+                           "description": "Servicio de hashing saturado, reintentar más tarde"
                         }
                    })
-async def create_user(user: UserCreate, db: Session = Depends(get_transactional_db)):
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_async_transactional_db)):
     """
     Registrar Nuevo Usuario.
     
     Args:
         user: UserCreate,
-        db: Session, la sesión de la base de datos
+        db: AsyncSession, la sesión asíncrona de la base de datos
     
     Returns:
         Dict con la información del registro
@@ -56,7 +68,8 @@ async def create_user(user: UserCreate, db: Session = Depends(get_transactional_
         logger.info(f"Inicio de solicitud de crear nuevo usuario, name: {user.name}, location: {user.location}, longitude: {user.longitud}, latitude: {user.latitud}")
         # Verificar si el usuario ya existe
         try:
-            existing_user = db.query(User).filter(User.name == user.name).first()
+            result = await db.execute(select(User).where(User.name == user.name))
+            existing_user = result.scalars().first()
         except SQLAlchemyError as db_error:
             raise DatabaseError("Error al buscar el usuario: %s" % db_error)
         
@@ -67,8 +80,8 @@ async def create_user(user: UserCreate, db: Session = Depends(get_transactional_
                 detail="El nombre de usuario ya está registrado"
             )
 
-        # Crear el nuevo usuario
-        hashed_password = crypt_password(user.password)
+        # Crear el nuevo usuario (bcrypt corre en su pool, fuera del event loop)
+        hashed_password = await crypt_password(user.password)
         logger.info(f"Hasheando clave para: {user.name}")
         
         try:
@@ -83,9 +96,22 @@ async def create_user(user: UserCreate, db: Session = Depends(get_transactional_
 
             # Guardar en la base de datos
             db.add(db_user)
-            db.commit()
-            db.refresh(db_user)
+            await db.commit()
+            await db.refresh(db_user)
+            invalidate_user_cache(db_user.name)
             logger.info(f"Nuevo usuario creado exitosamente: {user.name}")
+        except IntegrityError as integrity_error:
+            await db.rollback()
+            # Otro registro con el mismo nombre ganó la carrera (índice uq_user_name);
+            # cualquier otra restricción violada es un error de datos
+            result = await db.execute(select(User.id).where(User.name == user.name))
+            if result.first() is None:
+                raise DatabaseError(f"Error al guardar el usuario {user.name}: {integrity_error}") from integrity_error
+            logger.warning(f"Intento de registro de un usuario existente name: {user.name}")
+            raise HTTPException(
+                status_code=400,
+                detail="El nombre de usuario ya está registrado"
+            )
         except SQLAlchemyError as db_error:
              # Extraer información relevante de `db_user`
             user_info = f"id={db_user.id}, name={db_user.name}" if db_user else "N/A"
@@ -99,6 +125,13 @@ async def create_user(user: UserCreate, db: Session = Depends(get_transactional_
             "user_id": db_user.id
         }
 
+    except HTTPException:
+        raise
+
+    except HashingOverloadedError as e:
+        logger.warning(f"Registro rechazado por saturación del hashing: {str(e)}")
+        raise hashing_unavailable()
+
     except DatabaseError as db_error:
         logger.error(f"Error al crear nuevo usuario: {str(db_error)}", exc_info=True)
         raise HTTPException(
@@ -117,27 +150,35 @@ async def create_user(user: UserCreate, db: Session = Depends(get_transactional_
         )
     except Exception as e:
         logger.error(f"Error general en el registro de nuevo usuario: {str(e)}", exc_info=True)
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al crear el usuario: {str(e)}"
         )
         
 @user_routers.post("/login", response_model=Token)
-async def login(login_data: LoginData, db: Session = Depends(get_db)):
+async def login(login_data: LoginData, db: AsyncSession = Depends(get_async_db)):
     try:
         logger.info(f"User trying to login: {login_data.username}")
         # Buscar usuario en la base de datos
-        user = db.query(User).filter(User.name == login_data.username).first()
+        result = await db.execute(select(User).where(User.name == login_data.username))
+        user = result.scalars().first()
         
         # Verificar si el usuario existe y la contraseña es correcta
-        if not user or not crypt_verify_password(login_data.password, user.password):
+        if not user or not await crypt_verify_password(login_data.password, user.password):
             logger.warning(f"Intento de inicio de sesión fallido, Nombre de usuario o contraseña incorrectos: {login_data.username}")
             raise HTTPException(
                 status_code=401,
                 detail="Nombre de usuario o contraseña incorrectos"
             )
         
+        # Actualizar el hash si fue creado con otro factor de costo
+        if crypt_needs_rehash(user.password):
+            user.password = await crypt_password(login_data.password)
+            await db.commit()
+            invalidate_user_cache(user.name)
+            logger.info(f"Hash de contraseña actualizado al costo configurado: {user.name}")
+
         # Crear el token con un tiempo de expiración
         access_token = create_access_token(
             data={"sub": user.name}
@@ -157,7 +198,12 @@ async def login(login_data: LoginData, db: Session = Depends(get_db)):
             "token_type": "bearer",
             "user_data": user_data
         }
-    
+
+    except HTTPException:
+        raise
+    except HashingOverloadedError as e:
+        logger.warning(f"Inicio de sesión rechazado por saturación del hashing: {str(e)}")
+        raise hashing_unavailable()
     except Exception as e:
         logger.error(f"Error general en el inicio de sesión: {str(e)}", exc_info=True)
         raise HTTPException(
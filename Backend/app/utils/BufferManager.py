@@ -1,24 +1,59 @@
-from fastapi import Depends
 import json
 from datetime import datetime
 import os
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 import asyncio
 import logging
+import time
+from dotenv import load_dotenv
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
 
-from app.database.modelsDB import Esp
 from app.database.database import database
+from app.utils.sensor_dependencies import (
+    reading_row, resolve_esp_ids, insert_readings, update_current_state
+)
+from app.utils.rollup_dependencies import upsert_rollups
+from app.utils.WriteAheadLog import WriteAheadLog, FSYNC_GROUP
+from app.utils.Metrics import FLUSH_DURATION, FLUSH_ROWS, FLUSH_ERRORS, FLUSH_QUARANTINED
 
+load_dotenv()
 logger = logging.getLogger("app.data_buffer")
 
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_BLOCK = "block"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE, OVERFLOW_BLOCK)
+
 class DataBufferManager:
     _instance = None
+    # Archivo JSON del buffer anterior, se migra al WAL si existe
     BUFFER_FILE = "sensor_data_buffer.json"
     BATCH_SIZE = 50
     FLUSH_INTERVAL = 300
 
+    # Configuración del log de escritura anticipada (WAL)
+    WAL_DIRECTORY = os.getenv("WAL_DIRECTORY", "sensor_data_wal")
+    WAL_FSYNC_POLICY = os.getenv("WAL_FSYNC_POLICY", FSYNC_GROUP)
+    WAL_FSYNC_INTERVAL_MS = int(os.getenv("WAL_FSYNC_INTERVAL_MS", "200"))
+    WAL_SEGMENT_MAX_BYTES = int(os.getenv("WAL_SEGMENT_MAX_BYTES", str(16 * 1024 * 1024)))
+
+    # Cola de ingesta entre los sockets de los ESP y el escritor único
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+    INGEST_OVERFLOW_POLICY = os.getenv("INGEST_OVERFLOW_POLICY", "drop_oldest")
+    # Lecturas en memoria mientras la BD no responde; al llegar al límite el
+    # escritor deja de consumir la cola y se aplica la política de desbordamiento
+    INGEST_BUFFER_MAX_SIZE = int(os.getenv("INGEST_BUFFER_MAX_SIZE", "100000"))
+
+    # Espera entre reintentos de un flush fallido (se duplica hasta el máximo)
+    FLUSH_RETRY_MIN_S = float(os.getenv("FLUSH_RETRY_MIN_S", "1"))
+    FLUSH_RETRY_MAX_S = float(os.getenv("FLUSH_RETRY_MAX_S", "60"))
+    # Tras estos intentos fallidos, si la BD responde, el lote se divide para
+    # aislar las lecturas que fallan solas y moverlas a la cuarentena
+    FLUSH_MAX_ATTEMPTS = int(os.getenv("FLUSH_MAX_ATTEMPTS", "5"))
+    QUARANTINE_FILE = os.getenv("INGEST_QUARANTINE_FILE", "sensor_data_quarantine.jsonl")
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(DataBufferManager, cls).__new__(cls)
@@ -28,103 +63,375 @@ class DataBufferManager:
     def initialize(self):
         self.buffer: List[Dict] = []
         self.last_flush = datetime.now()
-        
-        if os.path.exists(self.BUFFER_FILE):
-            try:
-                with open(self.BUFFER_FILE, 'r') as f:
-                    self.buffer = json.load(f)
-            except json.JSONDecodeError:
-                self.buffer = []
-                logger.error("Error leyendo archivo buffer, iniciando vacío")
-        
-        # Iniciar tarea de procesamiento periódico
-        asyncio.create_task(self.periodic_flush())
-
-    async def add_data(self, device_id: str, sensor_data: dict) -> dict:
-        try:
-            timestamp = datetime.now().isoformat()
-            data_entry = {
-                "device_id": device_id,
-                "data": sensor_data,
-                "timestamp": timestamp
-            }
-            
-            self.buffer.append(data_entry)
-            await self.save_to_file()
-            
-            if len(self.buffer) >= self.BATCH_SIZE:
-                asyncio.create_task(self.process_batch())
-            
-            return {
-                "type": "SENSOR_UPDATE",
-                "device_id": device_id,
-                "data": {**sensor_data, "timestamp": timestamp}
-            }
-            
-        except Exception as e:
-            logger.error(f"Error añadiendo datos al buffer: {str(e)}")
-            return None
+        self._flush_lock = asyncio.Lock()
+
+        if self.INGEST_OVERFLOW_POLICY not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de desbordamiento inválida: {self.INGEST_OVERFLOW_POLICY}")
+        self.overflow_policy = self.INGEST_OVERFLOW_POLICY
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=self.INGEST_QUEUE_SIZE)
+        # Última lectura por dispositivo cuando la cola está llena (política "coalesce")
+        self._coalesced: Dict[str, Dict] = {}
+        self._tasks: List[asyncio.Task] = []
+        # Lecturas recibidas; las descartadas o reemplazadas por la política se
+        # cuentan aparte y no llegan al WAL
+        self.received_count = 0
+        self.dropped_count = 0
+        self.coalesced_count = 0
 
-    async def save_to_file(self):
+        # Lote cuyo flush falló y el segmento del WAL que lo cierra; se
+        # reintenta solo con espera creciente, sin volver a rotar el WAL
+        self._failed_batch: List[Dict] = []
+        self._failed_checkpoint: Optional[int] = None
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+        self._failed_attempts = 0
+        self.quarantined_count = 0
+        self._retry_task: Optional[asyncio.Task] = None
+        self._flush_healthy = asyncio.Event()
+        self._flush_healthy.set()
+
+        self.wal = WriteAheadLog(
+            self.WAL_DIRECTORY,
+            fsync_policy=self.WAL_FSYNC_POLICY,
+            fsync_interval_ms=self.WAL_FSYNC_INTERVAL_MS,
+            segment_max_bytes=self.WAL_SEGMENT_MAX_BYTES
+        )
+        # Recuperar lo que quedó pendiente antes de un reinicio o caída
+        self.buffer.extend(self.wal.replay())
+        self._migrate_legacy_buffer()
+
+    async def start(self):
+        """Inicia el escritor de la cola y las tareas periódicas (llamar desde el lifespan)."""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._writer()),
+            asyncio.create_task(self.periodic_flush())
+        ]
+        if self.wal.fsync_policy == FSYNC_GROUP:
+            self._tasks.append(asyncio.create_task(self.wal.periodic_sync()))
+        logger.info(
+            f"Pipeline de ingesta iniciado (cola={self.INGEST_QUEUE_SIZE}, política={self.overflow_policy})"
+        )
+
+    async def stop(self):
+        """Detiene las tareas, escribe lo que quede en la cola y hace un último flush."""
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            self._retry_task = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        while not self._queue.empty():
+            self._append_many(self._queue.get_nowait())
+            self._queue.task_done()
+        self._drain_coalesced()
+
+        await self.process_batch(force=True)
+        self.wal.close()
+        logger.info("Pipeline de ingesta detenido")
+
+    def _migrate_legacy_buffer(self):
+        """Mueve al WAL los datos del archivo JSON usado por versiones anteriores."""
+        if not os.path.exists(self.BUFFER_FILE):
+            return
         try:
-            # Usar aiofiles para operaciones de archivo asíncronas
-            with open(self.BUFFER_FILE, 'w') as f:
-                json.dump(self.buffer, f)
-        except Exception as e:
-            logger.error(f"Error guardando en archivo: {str(e)}")
+            with open(self.BUFFER_FILE, 'r') as f:
+                legacy = json.load(f)
+            for entry in legacy:
+                self.wal.append(entry)
+                self.buffer.append(entry)
+            self.wal.sync()
+            os.remove(self.BUFFER_FILE)
+            logger.info(f"Migrados {len(legacy)} registros del buffer JSON al WAL")
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error migrando archivo buffer: {str(e)}")
+
+    def _make_entry(self, device_id: str, sensor_data: dict, ts: Optional[int] = None) -> Dict:
+        return {
+            "device_id": device_id,
+            "data": sensor_data,
+            "ts": ts if ts is not None else int(time.time() * 1000)
+        }
+
+    def _append(self, data_entry: Dict) -> None:
+        self._append_many([data_entry])
+
+    def _append_many(self, entries: List[Dict]) -> None:
+        # Escritura O(1) por registro: solo se agregan los registros nuevos al WAL
+        self.wal.append_many(entries)
+        crossed = len(self.buffer) < self.BATCH_SIZE <= len(self.buffer) + len(entries)
+        self.buffer.extend(entries)
 
-    async def process_batch(self):
-        """Procesa un lote de datos y los guarda en la base de datos"""
-        if not self.buffer:
+        # Un flush por cruce del umbral, no uno por lectura
+        if crossed:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        # Con un flush en curso o un lote fallido esperando su reintento, ese
+        # flush (o el reintento) se encarga de lo acumulado
+        if self._flush_lock.locked() or self._failed_batch:
+            return
+        asyncio.create_task(self.process_batch())
+
+    def _drain_coalesced(self) -> None:
+        if not self._coalesced:
             return
-            
+        pending, self._coalesced = self._coalesced, {}
+        for data_entry in pending.values():
+            self._append(data_entry)
+
+    async def submit(self, device_id: str, sensor_data: dict, ts: Optional[int] = None) -> bool:
+        """
+        Encola una lectura para el escritor único.
+
+        ``ts`` es la marca de tiempo de la lectura en epoch ms (la del
+        dispositivo, si la envía); por defecto se usa la hora de recepción.
+
+        Con la cola llena se aplica la política configurada:
+        - drop_oldest: se descarta el elemento más antiguo de la cola
+        - coalesce: se guarda solo la última lectura pendiente por dispositivo
+        - block: se espera a que haya espacio, frenando la lectura del socket
+
+        Returns:
+            bool: True si la lectura fue aceptada sin descartar otra
+        """
+        return await self._enqueue(device_id, [self._make_entry(device_id, sensor_data, ts)])
+
+    async def submit_batch(self, device_id: str, readings: List[Tuple[int, dict]]) -> bool:
+        """
+        Encola un lote de lecturas (epoch ms, datos) de un mismo ESP.
+
+        El lote ocupa un solo lugar en la cola y el escritor lo agrega al WAL
+        con una sola escritura. Con la política ``coalesce`` solo se conserva
+        la última lectura del lote.
+
+        Returns:
+            bool: True si el lote fue aceptado sin descartar otra lectura
+        """
+        if not readings:
+            return True
+        return await self._enqueue(
+            device_id, [self._make_entry(device_id, sensor_data, ts) for ts, sensor_data in readings]
+        )
+
+    async def _enqueue(self, device_id: str, entries: List[Dict]) -> bool:
+        self.received_count += len(entries)
+
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            await self._queue.put(entries)
+            return True
+
         try:
-            # Crear una nueva sesión
-            Session = database._SessionFactory
-            db = Session()
-            
-            try:
-                # Procesar datos en lote
-                processed_data = {}
-                for entry in self.buffer:
-                    device_id = entry["device_id"]
-                    if device_id not in processed_data:
-                        processed_data[device_id] = {
-                            "latest_data": entry["data"],
-                            "timestamp": entry["timestamp"],
-                            "data_points": []
-                        }
-                    processed_data[device_id]["data_points"].append({
-                        "data": entry["data"],
-                        "timestamp": entry["timestamp"]
-                    })
-
-                # Actualizar la base de datos
-                for device_id, data in processed_data.items():
-                    esp = db.query(Esp).filter(Esp.identification == device_id).first()
-                    if esp:
-                        esp.json_sensores = {
-                            "current": data["latest_data"],
-                            "history": data["data_points"][-10:]
-                        }
-
-                # Commit de los cambios
-                db.commit()
-                logger.info(f"Procesado lote de {len(self.buffer)} registros")
-                
-                # Limpiar buffer
-                self.buffer = []
-                await self.save_to_file()
+            self._queue.put_nowait(entries)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == OVERFLOW_COALESCE:
+            self.coalesced_count += len(entries) - 1
+            if device_id in self._coalesced:
+                self.coalesced_count += 1
+            self._coalesced[device_id] = entries[-1]
+            return False
+
+        # drop_oldest
+        try:
+            dropped = self._queue.get_nowait()
+            self._queue.task_done()
+            self.dropped_count += len(dropped)
+        except asyncio.QueueEmpty:
+            pass
+        self._queue.put_nowait(entries)
+        return False
 
+    async def _writer(self):
+        """Escritor único: consume la cola (lecturas o lotes) y escribe en el WAL y el buffer."""
+        while True:
+            if len(self.buffer) >= self.INGEST_BUFFER_MAX_SIZE and not self._flush_healthy.is_set():
+                # BD caída con el buffer lleno: la cola se llena y aplica su política
+                logger.warning(f"Buffer lleno ({len(self.buffer)} lecturas), ingesta en espera del flush")
+                await self._flush_healthy.wait()
+            entries = await self._queue.get()
+            try:
+                self._append_many(entries)
+                self._drain_coalesced()
+                # Con fsync "always" se espera el disco antes de tomar lo siguiente
+                await self.wal.commit()
             except Exception as e:
-                db.rollback()
-                logger.error(f"Error procesando lote: {str(e)}")
-                raise
+                logger.error(f"Error escribiendo lecturas de {entries[0].get('device_id')}: {str(e)}")
             finally:
-                db.close()
+                self._queue.task_done()
+
+    def stats(self) -> Dict:
+        """Estado de la cola de ingesta y contadores de descarte."""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_max_size": self._queue.maxsize,
+            "overflow_policy": self.overflow_policy,
+            "coalesced_pending": len(self._coalesced),
+            "received": self.received_count,
+            "accepted": self.received_count - self.dropped_count - self.coalesced_count,
+            "dropped": self.dropped_count,
+            "coalesced": self.coalesced_count,
+            "buffered": len(self.buffer),
+            "failed_batch": len(self._failed_batch),
+            "failed_attempts": self._failed_attempts,
+            "quarantined": self.quarantined_count,
+            "flush_retry_delay_s": self._retry_delay
+        }
 
+    @asynccontextmanager
+    async def flush_paused(self):
+        """
+        Impide que empiece un flush mientras dura el contexto (p. ej. un
+        bloque de borrado de la retención); si hay uno en curso, lo espera.
+        """
+        async with self._flush_lock:
+            yield
+
+    async def process_batch(self, force: bool = False):
+        """
+        Procesa un lote de datos y los guarda en la base de datos.
+
+        Si un flush anterior falló, primero se reintenta ese lote (sin rotar
+        el WAL: sus segmentos ya están cerrados) y solo cuando vence la espera
+        del reintento, salvo con ``force`` (p. ej. al detener la aplicación).
+        """
+        async with self._flush_lock:
+            if self._failed_batch:
+                if not force and time.monotonic() < self._retry_at:
+                    return
+                if not await self._flush(self._failed_batch, self._failed_checkpoint):
+                    return
+                self._failed_batch, self._failed_checkpoint = [], None
+                self._flush_healthy.set()
+
+            if not self.buffer:
+                return
+
+            # Cerrar el segmento actual: todo lo que contiene pertenece a este lote
+            checkpoint = self.wal.rotate()
+            batch, self.buffer = self.buffer, []
+            if not await self._flush(batch, checkpoint):
+                # Conservar el lote para el reintento; sigue en el WAL
+                self._failed_batch, self._failed_checkpoint = batch, checkpoint
+                self._flush_healthy.clear()
+                return
+
+        # Lo que llegó durante el flush ya superó el umbral sin programar otro
+        if len(self.buffer) >= self.BATCH_SIZE:
+            self._schedule_flush()
+
+    async def _flush(self, batch: List[Dict], checkpoint: int) -> bool:
+        """Escribe un lote y libera sus segmentos del WAL; si falla programa el reintento."""
+        start = time.perf_counter()
+        try:
+            if self._failed_attempts >= self.FLUSH_MAX_ATTEMPTS:
+                await self._write_isolating(batch)
+            else:
+                await self._write(batch)
         except Exception as e:
-            logger.error(f"Error en proceso de lote: {str(e)}")
+            FLUSH_ERRORS.inc()
+            self._failed_attempts += 1
+            self._retry_delay = min(max(self._retry_delay * 2, self.FLUSH_RETRY_MIN_S), self.FLUSH_RETRY_MAX_S)
+            self._retry_at = time.monotonic() + self._retry_delay
+            if self._retry_task is None:
+                self._retry_task = asyncio.create_task(self._retry_later(self._retry_delay))
+            logger.error(f"Error en proceso de lote ({len(batch)} registros), reintento en {self._retry_delay:.0f}s: {str(e)}")
+            return False
+
+        FLUSH_DURATION.observe((time.perf_counter() - start) * 1000)
+        FLUSH_ROWS.inc(len(batch))
+        logger.info(f"Procesado lote de {len(batch)} registros")
+        self.last_flush = datetime.now()
+        self._retry_delay = 0.0
+        self._failed_attempts = 0
+
+        # El lote ya está en la BD (o en la cuarentena): liberar sus segmentos del WAL
+        self.wal.truncate(checkpoint)
+        return True
+
+    async def _write(self, batch: List[Dict]) -> None:
+        # Sesión asíncrona: la escritura no bloquea el event loop
+        async with database.write_session() as db:
+            await db.run_sync(self._write_batch, batch)
+
+    async def _write_isolating(self, batch: List[Dict]) -> None:
+        """
+        Escribe un lote que ya falló FLUSH_MAX_ATTEMPTS veces.
+
+        Si la BD no responde se trata como una caída y el lote sigue
+        esperando. Si responde, el lote se divide en mitades (cada una en su
+        transacción) hasta aislar las lecturas que fallan solas; esas pasan a
+        la cuarentena y el resto queda escrito.
+        """
+        await self._ping()
+
+        quarantined: List[Dict] = []
+        pending = [batch]
+        while pending:
+            part = pending.pop()
+            try:
+                await self._write(part)
+            except Exception as e:
+                if len(part) == 1:
+                    quarantined.append({"entry": part[0], "error": str(e)})
+                    continue
+                middle = len(part) // 2
+                pending += [part[middle:], part[:middle]]
+
+        if quarantined:
+            await asyncio.to_thread(self._write_quarantine, quarantined)
+            self.quarantined_count += len(quarantined)
+            FLUSH_QUARANTINED.inc(len(quarantined))
+            logger.error(f"{len(quarantined)} lecturas movidas a la cuarentena ({self.QUARANTINE_FILE})")
+
+    async def _ping(self) -> None:
+        """Consulta mínima para distinguir una BD caída de un lote inválido."""
+        async with database.write_session() as db:
+            await db.execute(text("SELECT 1"))
+
+    def _write_quarantine(self, records: List[Dict]) -> None:
+        """Agrega las lecturas que no se pudieron escribir al archivo de cuarentena (JSON por línea)."""
+        quarantined_at = datetime.now().isoformat()
+        with open(self.QUARANTINE_FILE, "a") as f:
+            for record in records:
+                f.write(json.dumps({**record, "quarantined_at": quarantined_at}, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _retry_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._retry_task = None
+        await self.process_batch()
+
+    def _write_batch(self, db: Session, batch: List[Dict]) -> None:
+        """Escribe un lote en la BD (se ejecuta con ``AsyncSession.run_sync``)."""
+        # Resolver los IDs de todos los ESP del lote en una sola consulta
+        esp_ids = resolve_esp_ids(db, {entry["device_id"] for entry in batch})
+
+        rows = []
+        current = {}
+        skipped = 0
+        for entry in batch:
+            esp_id = esp_ids.get(entry["device_id"])
+            if esp_id is None:
+                skipped += 1
+                continue
+            # Las entradas del buffer JSON anterior usan "timestamp"
+            rows.append(reading_row(esp_id, entry["data"], entry.get("ts", entry.get("timestamp"))))
+            current[esp_id] = entry["data"]
+
+        if skipped:
+            logger.warning(f"Descartadas {skipped} lecturas de ESP no registrados")
+
+        # Inserción multi-fila del histórico, sus rollups y estado actual por dispositivo
+        insert_readings(db, rows)
+        upsert_rollups(db, rows)
+        update_current_state(db, current)
 
     async def periodic_flush(self):
         """Procesa el buffer periódicamente"""
@@ -137,4 +444,4 @@ class DataBufferManager:
                 logger.error(f"Error en flush periódico: {str(e)}")
 
 # Exportar instancia única
-data_buffer = DataBufferManager()
\ No newline at end of file
+data_buffer = DataBufferManager()
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from typing import Dict, Optional
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+from app.utils.Metrics import LatencyHistogram, COMMAND_RTT
+
+logger = logging.getLogger("app.command_tracker")
+
+# Espera del MOTOR_STATUS que confirma un comando, por intento
+COMMAND_ACK_TIMEOUT_S = float(os.getenv("COMMAND_ACK_TIMEOUT_S", "3"))
+# Reenvíos del mismo comando (mismo command_id) si no llega la confirmación
+COMMAND_MAX_RETRIES = int(os.getenv("COMMAND_MAX_RETRIES", "2"))
+
+# Estado que confirma cada acción cuando el firmware no devuelve el command_id
+EXPECTED_STATUS = {
+    "START_MOTOR": ("RUNNING", "COMPLETED"),
+    "STOP_MOTOR": ("STOPPED",)
+}
+
+
+class PendingCommand:
+    def __init__(self, device_id: str, command: Dict):
+        self.command_id = uuid.uuid4().hex
+        self.device_id = device_id
+        self.command = {**command, "command_id": self.command_id}
+        self.action = command.get("action")
+        self.attempts = 0
+        self.sent_at = 0.0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class CommandTracker:
+    """
+    Tabla de comandos enviados a los ESP pendientes de confirmación.
+
+    Cada comando lleva un ``command_id``; el MOTOR_STATUS que lo trae resuelve
+    el futuro del comando. Para firmware que no devuelve el ID se confirma el
+    comando pendiente más antiguo cuya acción corresponde al estado recibido.
+    El futuro siempre se resuelve con un resultado (nunca con excepción), así
+    que no importa si nadie lo está esperando.
+    """
+
+    def __init__(self):
+        self.pending: Dict[str, PendingCommand] = {}
+        self._by_device: Dict[str, "OrderedDict[str, PendingCommand]"] = {}
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.acked = 0
+        self.timeouts = 0
+        self.retries = 0
+
+    def track(self, device_id: str, command: Dict) -> PendingCommand:
+        """Registra un comando nuevo y le asigna su command_id."""
+        pending = PendingCommand(device_id, command)
+        self.pending[pending.command_id] = pending
+        self._by_device.setdefault(device_id, OrderedDict())[pending.command_id] = pending
+        return pending
+
+    def mark_sent(self, pending: PendingCommand) -> None:
+        """Registra un envío; la latencia se mide desde el último intento."""
+        pending.attempts += 1
+        if pending.attempts > 1:
+            self.retries += 1
+        pending.sent_at = time.perf_counter()
+
+    def _match(self, device_id: str, status: Dict) -> Optional[PendingCommand]:
+        command_id = status.get("command_id")
+        if command_id:
+            pending = self.pending.get(command_id)
+            return pending if pending is not None and pending.device_id == device_id else None
+
+        for pending in self._by_device.get(device_id, {}).values():
+            if status.get("status") in EXPECTED_STATUS.get(pending.action, ()):
+                return pending
+        return None
+
+    def acknowledge(self, device_id: str, status: Dict) -> Optional[PendingCommand]:
+        """
+        Resuelve el comando que confirma un MOTOR_STATUS.
+
+        Returns:
+            PendingCommand confirmado, o None si el estado no confirma ninguno
+        """
+        pending = self._match(device_id, status)
+        if pending is None:
+            return None
+
+        rtt_ms = (time.perf_counter() - pending.sent_at) * 1000
+        self.histograms.setdefault(device_id, LatencyHistogram()).observe(rtt_ms)
+        COMMAND_RTT.observe(rtt_ms)
+        self.acked += 1
+        self._finish(pending, {
+            "command_id": pending.command_id,
+            "acknowledged": True,
+            "status": status.get("status"),
+            "attempts": pending.attempts,
+            "rtt_ms": round(rtt_ms, 3)
+        })
+        return pending
+
+    def expire(self, pending: PendingCommand, reason: str = "TIMEOUT") -> None:
+        """Da por perdido un comando sin confirmación."""
+        if pending.future.done():
+            return
+        if reason == "TIMEOUT":
+            self.timeouts += 1
+        logger.warning(
+            f"Comando {pending.command_id} para {pending.device_id} sin confirmación "
+            f"tras {pending.attempts} intentos ({reason})"
+        )
+        self._finish(pending, {
+            "command_id": pending.command_id,
+            "acknowledged": False,
+            "status": reason,
+            "attempts": pending.attempts,
+            "rtt_ms": None
+        })
+
+    def cancel_device(self, device_id: str) -> None:
+        """Cierra los comandos pendientes de un ESP que se desconectó."""
+        for pending in list(self._by_device.get(device_id, {}).values()):
+            self.expire(pending, "DISCONNECTED")
+
+    def _finish(self, pending: PendingCommand, result: Dict) -> None:
+        self.pending.pop(pending.command_id, None)
+        device_pending = self._by_device.get(pending.device_id)
+        if device_pending is not None:
+            device_pending.pop(pending.command_id, None)
+            if not device_pending:
+                del self._by_device[pending.device_id]
+        if not pending.future.done():
+            pending.future.set_result(result)
+
+    def device_stats(self, device_id: str) -> Dict:
+        histogram = self.histograms.get(device_id, LatencyHistogram())
+        return {
+            "device_id": device_id,
+            "pending": len(self._by_device.get(device_id, {})),
+            "rtt": histogram.to_dict()
+        }
+
+    def stats(self) -> Dict:
+        overall = LatencyHistogram()
+        for histogram in self.histograms.values():
+            overall.counts = [a + b for a, b in zip(overall.counts, histogram.counts)]
+            overall.count += histogram.count
+            overall.sum += histogram.sum
+        return {
+            "pending": len(self.pending),
+            "acked": self.acked,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "ack_timeout_s": COMMAND_ACK_TIMEOUT_S,
+            "max_retries": COMMAND_MAX_RETRIES,
+            "rtt": overall.to_dict()
+        }
+
+# Instancia única
+command_tracker = CommandTracker()
@@ -0,0 +1,114 @@
+from typing import Callable, Dict, Iterable, Optional
+import asyncio
+import logging
+import os
+
+from app.utils.PubSubBroker import Broker, NODE_ID
+
+logger = logging.getLogger("app.device_registry")
+
+# Duración del lease de propiedad de un ESP y frecuencia de renovación
+DEVICE_LEASE_MS = int(os.getenv("DEVICE_LEASE_MS", "15000"))
+DEVICE_HEARTBEAT_MS = int(os.getenv("DEVICE_HEARTBEAT_MS", "5000"))
+# Renovaciones enviadas en paralelo (en pipeline) por ciclo
+DEVICE_HEARTBEAT_BATCH = 500
+
+OWNER_KEY = "esp_owner:"
+
+
+class DeviceRegistry:
+    """
+    Registro de qué worker tiene abierto el socket de cada ESP.
+
+    Cada ESP conectado se anuncia con un lease (``esp_owner:<id>`` = NODE_ID)
+    que el worker renueva periódicamente. Si el worker muere el lease expira
+    solo; si el ESP se reconecta a otro worker, ese worker toma el lease y el
+    anterior, al no poder renovarlo, cierra su socket obsoleto mediante
+    ``on_lost``.
+    """
+
+    def __init__(
+        self,
+        broker: Broker,
+        node_id: str = NODE_ID,
+        lease_ms: int = DEVICE_LEASE_MS,
+        heartbeat_ms: int = DEVICE_HEARTBEAT_MS
+    ):
+        self.broker = broker
+        self.node_id = node_id
+        self.lease_ms = lease_ms
+        self.heartbeat_ms = heartbeat_ms
+        self._on_lost: Optional[Callable[[str], None]] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.renewals = 0
+        self.lost = 0
+
+    def start(self, owned: Callable[[], Iterable[str]], on_lost: Callable[[str], None]) -> None:
+        """
+        Inicia los heartbeats.
+
+        Args:
+            owned: Retorna los ESP conectados actualmente a este worker
+            on_lost: Se llama con el ID de un ESP cuyo lease tomó otro worker
+        """
+        self._on_lost = on_lost
+        self._heartbeat_task = asyncio.create_task(self._heartbeat(owned))
+
+    async def stop(self, owned: Iterable[str] = ()) -> None:
+        """Detiene los heartbeats y libera los leases de este worker."""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        for device_id in list(owned):
+            try:
+                await self.release(device_id)
+            except Exception as e:
+                logger.warning(f"No se pudo liberar el lease de {device_id}: {str(e)}")
+
+    async def acquire(self, device_id: str) -> None:
+        """Toma la propiedad del ESP; la conexión más reciente siempre gana."""
+        await self.broker.set(OWNER_KEY + device_id, self.node_id, self.lease_ms)
+
+    async def release(self, device_id: str) -> None:
+        """Libera el lease si sigue siendo de este worker."""
+        await self.broker.delete_if_equal(OWNER_KEY + device_id, self.node_id)
+
+    async def owner(self, device_id: str) -> Optional[str]:
+        """Worker dueño del socket del ESP, o None si no está conectado en ninguno."""
+        return await self.broker.get(OWNER_KEY + device_id)
+
+    async def _renew(self, device_id: str) -> None:
+        if await self.broker.renew_if_equal(OWNER_KEY + device_id, self.node_id, self.lease_ms):
+            self.renewals += 1
+            return
+        if await self.owner(device_id) is None:
+            # El lease expiró (p. ej. el broker no respondió a tiempo) sin otro dueño
+            await self.acquire(device_id)
+            return
+        self.lost += 1
+        logger.warning(f"Lease de {device_id} tomado por otro worker, cerrando socket local")
+        if self._on_lost is not None:
+            self._on_lost(device_id)
+
+    async def _heartbeat(self, owned: Callable[[], Iterable[str]]):
+        interval = self.heartbeat_ms / 1000
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                device_ids = list(owned())
+                for start in range(0, len(device_ids), DEVICE_HEARTBEAT_BATCH):
+                    batch = device_ids[start:start + DEVICE_HEARTBEAT_BATCH]
+                    await asyncio.gather(*(self._renew(device_id) for device_id in batch))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error renovando leases de dispositivos: {str(e)}")
+
+    def stats(self) -> Dict:
+        return {
+            "node_id": self.node_id,
+            "lease_ms": self.lease_ms,
+            "heartbeat_ms": self.heartbeat_ms,
+            "renewals": self.renewals,
+            "lost": self.lost
+        }
@@ -0,0 +1,178 @@
+from fastapi import WebSocket
+from typing import Callable, Dict, Optional, Union
+import asyncio
+import logging
+import os
+
+from app.utils.json_dependencies import encode_json
+
+logger = logging.getLogger("app.frontend_connection")
+
+# Frames pendientes por cliente antes de considerarlo lento
+FRONTEND_SEND_QUEUE_SIZE = int(os.getenv("FRONTEND_SEND_QUEUE_SIZE", "256"))
+# Tiempo máximo de un envío antes de cerrar la conexión por lenta
+FRONTEND_SEND_TIMEOUT_S = float(os.getenv("FRONTEND_SEND_TIMEOUT_S", "5"))
+# Código de cierre para clientes que no consumen a tiempo ("Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class FrontendConnection:
+    """
+    Conexión de un cliente frontend con cola de salida propia.
+
+    Quien publica solo encola (nunca espera un envío de red); una tarea
+    escritora por conexión vacía la cola hacia el WebSocket. Si la cola se
+    llena se compacta dejando el último frame por dispositivo y, si aun así
+    no hay espacio o un envío excede el tiempo límite, la conexión se cierra.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        on_close: Callable[[str, WebSocket], None],
+        queue_size: int = FRONTEND_SEND_QUEUE_SIZE,
+        send_timeout: float = FRONTEND_SEND_TIMEOUT_S
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.send_timeout = send_timeout
+        self._on_close = on_close
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._writer_task: Optional[asyncio.Task] = None
+        self.closed = False
+        # Cierre por cliente lento ya programado: no se encola nada más
+        self._closing = False
+        self.dropped_count = 0
+
+        # Agrupación de ESP_DATA por dispositivo (0 = desactivada)
+        self.interval = 0.0
+        self._pending: Dict[str, str] = {}
+        self._last_sent: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+    def start(self) -> None:
+        """Inicia la tarea escritora de la conexión."""
+        self._writer_task = asyncio.create_task(self._writer())
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def send(self, message: Union[dict, str], device_id: Optional[str] = None) -> bool:
+        """
+        Encola un mensaje para el cliente sin esperar el envío.
+
+        Args:
+            message: Mensaje a enviar, ya serializado (str) o como dict
+            device_id: Dispositivo al que pertenece el mensaje; permite agrupar
+                y compactar los frames del mismo dispositivo
+
+        Returns:
+            bool: False si la conexión está cerrada o el mensaje fue descartado
+        """
+        if self.closed or self._closing:
+            return False
+        if not isinstance(message, str):
+            message = encode_json(message)
+        if device_id is None or not self.interval:
+            return self._enqueue(message, device_id)
+
+        if device_id in self._timers:
+            # Dentro del intervalo: reemplazar el pendiente por el último estado
+            self._pending[device_id] = message
+            return True
+
+        loop = asyncio.get_running_loop()
+        elapsed = loop.time() - self._last_sent.get(device_id, float("-inf"))
+        if elapsed >= self.interval:
+            self._last_sent[device_id] = loop.time()
+            return self._enqueue(message, device_id)
+
+        self._pending[device_id] = message
+        self._timers[device_id] = loop.call_later(self.interval - elapsed, self._release, device_id)
+        return True
+
+    def _release(self, device_id: str) -> None:
+        """Encola el último mensaje pendiente de un dispositivo al vencer su intervalo."""
+        self._timers.pop(device_id, None)
+        message = self._pending.pop(device_id, None)
+        if message is not None and not self.closed and not self._closing:
+            self._last_sent[device_id] = asyncio.get_running_loop().time()
+            self._enqueue(message, device_id)
+
+    def _enqueue(self, message: str, device_id: Optional[str]) -> bool:
+        try:
+            self._queue.put_nowait((device_id, message))
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        # Cliente lento: conservar solo el último frame de cada dispositivo
+        self._compact()
+        try:
+            self._queue.put_nowait((device_id, message))
+            logger.warning(f"Cliente {self.user_id} lento, cola compactada")
+            return True
+        except asyncio.QueueFull:
+            self.dropped_count += 1
+            if not self._closing:
+                self._closing = True
+                logger.warning(f"Cliente {self.user_id} no consume sus mensajes, cerrando conexión")
+                asyncio.create_task(self.close(SLOW_CONSUMER_CLOSE_CODE))
+            return False
+
+    def _compact(self) -> None:
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+            self._queue.task_done()
+
+        latest: Dict[str, int] = {}
+        for index, (device_id, _) in enumerate(items):
+            if device_id is not None:
+                latest[device_id] = index
+
+        for index, (device_id, message) in enumerate(items):
+            if device_id is not None and latest[device_id] != index:
+                self.dropped_count += 1
+                continue
+            self._queue.put_nowait((device_id, message))
+
+    async def _writer(self):
+        """Vacía la cola hacia el WebSocket con un tiempo límite por envío."""
+        while True:
+            _, message = await self._queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(message), self.send_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Envío a {self.user_id} excedió {self.send_timeout}s, cerrando conexión")
+                await self.close(SLOW_CONSUMER_CLOSE_CODE)
+                return
+            except Exception as e:
+                logger.info(f"Error enviando datos a {self.user_id}: {str(e)}")
+                await self.close()
+                return
+            finally:
+                self._queue.task_done()
+
+    def stop(self) -> None:
+        """Libera la tarea escritora y los temporizadores sin cerrar el socket."""
+        self.closed = True
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._pending.clear()
+        if self._writer_task is not None and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+
+    async def close(self, code: int = 1011) -> None:
+        """Cierra la conexión y la retira del ConnectionManager."""
+        if self.closed:
+            return
+        self.stop()
+        self._on_close(self.user_id, self.websocket)
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass
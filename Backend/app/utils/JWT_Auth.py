@@ -1,15 +1,18 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 import jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
+import time
 from dotenv import load_dotenv
 import logging
 
 from app.database.modelsDB import User
-from app.utils.database_dependencies import get_db
+from app.utils.database_dependencies import get_async_db
+from app.utils.TTLCache import TTLCache
 
 load_dotenv()
 logger = logging.getLogger("app.auth")
@@ -19,8 +22,70 @@ SECRET_KEY = os.getenv("SECRET_KEY", "tu_clave_secreta_por_defecto")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Caché de tokens verificados (expiran con el "exp" del token) y de usuarios
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL_S = float(os.getenv("USER_CACHE_TTL_S", "300"))
+
+token_cache = TTLCache(AUTH_CACHE_MAX_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60, name="jwt_claims")
+user_cache = TTLCache(AUTH_CACHE_MAX_SIZE, USER_CACHE_TTL_S, name="user_profile")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+def invalidate_user_cache(username: str) -> None:
+    """Invalida el usuario en caché (p. ej. al crearlo o modificarlo)."""
+    user_cache.invalidate(username)
+
+def auth_cache_stats() -> Dict:
+    """Estadísticas de aciertos y fallos de las cachés de autenticación."""
+    return {
+        "jwt_claims": token_cache.stats(),
+        "user_profile": user_cache.stats()
+    }
+
+def decode_token(token: str) -> Dict:
+    """
+    Decodifica y verifica un token JWT, reutilizando el resultado si ya fue verificado.
+
+    La entrada en caché vive hasta el "exp" del token, así que un token
+    expirado nunca se acepta desde la caché.
+
+    Raises:
+        jwt.ExpiredSignatureError: Si el token expiró
+        jwt.InvalidTokenError: Si el token no es válido
+    """
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    payload = jwt.decode(
+        token,
+        SECRET_KEY,
+        algorithms=[ALGORITHM],
+        options={"verify_exp": True}  # Verificar expiración automáticamente
+    )
+
+    exp = payload.get("exp")
+    if exp is not None:
+        token_cache.set(token, payload, ttl=exp - time.time())
+    return payload
+
+async def get_user_by_name(db: AsyncSession, username: str) -> Optional[User]:
+    """
+    Retorna el usuario por nombre, consultando la base de datos solo si no está en caché.
+
+    El objeto en caché queda desasociado de la sesión: solo deben leerse sus
+    columnas, no relaciones perezosas.
+    """
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+
+    result = await db.execute(select(User).where(User.name == username))
+    user = result.scalars().first()
+    if user is not None:
+        user_cache.set(username, user)
+    return user
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Crea un token JWT usando PyJWT.
@@ -56,7 +121,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         logger.error(f"Error creando token: {str(e)}")
         raise
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     """
     Valida el token JWT y retorna el usuario actual.
     """
@@ -67,13 +132,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     )
     
     try:
-        # Decodificar el token con PyJWT
-        payload = jwt.decode(
-            token,
-            SECRET_KEY,
-            algorithms=[ALGORITHM],
-            options={"verify_exp": True}  # Verificar expiración automáticamente
-        )
+        # Decodificar el token con PyJWT (o tomarlo de la caché)
+        payload = decode_token(token)
         
         username: str = payload.get("sub")
         if username is None:
@@ -93,15 +153,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         logger.error(f"Error inesperado validando token: {str(e)}")
         raise credentials_exception
 
-    # Buscar usuario en la base de datos
-    user = db.query(User).filter(User.name == username).first()
+    # Buscar usuario en la caché o en la base de datos
+    user = await get_user_by_name(db, username)
     if user is None:
         logger.warning(f"Usuario no encontrado: {username}")
         raise credentials_exception
         
     return user
 
-async def validate_ws_token(token: str, db: Session) -> Optional[User]:
+async def validate_ws_token(token: str, db: AsyncSession) -> Optional[User]:
     """
     Valida un token para conexiones WebSocket.
     """
@@ -111,20 +171,14 @@ async def validate_ws_token(token: str, db: Session) -> Optional[User]:
             token = token.split(" ")[1]
             
         # Decodificar el token
-        payload = jwt.decode(
-            token,
-            SECRET_KEY,
-            algorithms=[ALGORITHM],
-            options={"verify_exp": True}
-        )
+        payload = decode_token(token)
         
         username: str = payload.get("sub")
         if not username:
             return None
             
-        # Verificar usuario en la base de datos
-        user = db.query(User).filter(User.name == username).first()
-        return user
+        # Verificar usuario en la caché o en la base de datos
+        return await get_user_by_name(db, username)
         
     except jwt.ExpiredSignatureError:
         logger.error("Token WS expirado")
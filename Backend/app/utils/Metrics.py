@@ -0,0 +1,337 @@
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+import math
+import time
+
+# Formato de exposición de texto de Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Límites superiores (ms) de los buckets del histograma de latencias
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Buckets (ms) para operaciones en memoria del camino caliente
+FAST_BUCKETS_MS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 100)
+# Buckets de cantidad de suscriptores por broadcast
+SUBSCRIBER_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+LabelValues = Tuple[str, ...]
+# Valor de una métrica calculada al exportar: un número o un dict por etiquetas
+CallbackValue = Union[float, Dict[LabelValues, float]]
+
+
+class LatencyHistogram:
+    """Histograma de latencias con buckets fijos (acumulables como en Prometheus)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # el último bucket es +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, pct: float) -> Optional[Union[float, str]]:
+        """Límite superior del bucket que contiene el percentil indicado ("+Inf" si excede el último)."""
+        if not self.count:
+            return None
+        target = pct / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts[:-1]):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets[index]
+        return "+Inf"
+
+    def to_dict(self) -> Dict:
+        cumulative, buckets = 0, {}
+        for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum, 3),
+            "mean_ms": round(self.sum / self.count, 3) if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": buckets
+        }
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class CounterChild:
+    """Contador de una combinación de etiquetas; ``inc`` es una suma en memoria."""
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+
+class Metric:
+    """
+    Métrica con etiquetas. Cada combinación de valores es un hijo que se
+    crea una vez; el código del camino caliente guarda el hijo (``labels``)
+    en una constante y solo llama a ``inc``/``observe``.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._children: Dict[LabelValues, object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in self._children.items()
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+
+class Histogram(Metric):
+    """
+    Histograma con buckets fijos sobre ``LatencyHistogram``.
+
+    Los valores se observan en la unidad de los buckets (ms para
+    latencias) y se exportan multiplicados por ``scale`` (0.001 para
+    exponer segundos, la unidad de Prometheus).
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS_MS, scale: float = 1.0):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        self.scale = scale
+
+    def _new_child(self):
+        return LatencyHistogram(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        bounds = [_format_value(bound * self.scale) for bound in self.buckets] + ["+Inf"]
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, child.counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, values, ("le", bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum * self.scale)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    """Métrica leída al exportar (colas, pools, conexiones): no cuesta nada en el camino caliente."""
+
+    def __init__(self, name: str, help: str, kind: str, callback: Callable[[], CallbackValue],
+                 labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self) -> List[str]:
+        value = self.callback()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(sample)}"
+            for values, sample in value.items()
+        ]
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas expuesto en /metrics.
+
+    Las métricas son contadores e histogramas en memoria del worker, sin
+    locks (todo corre en el event loop); con varios workers Prometheus
+    debe leer cada uno.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(MetricsRegistry, cls).__new__(cls)
+            cls._instance.initialize()
+        return cls._instance
+
+    def initialize(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica {metric.name} ya registrada")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS_MS, scale: float = 1.0) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets, scale))
+
+    def callback(self, name: str, help: str, kind: str, callback: Callable[[], CallbackValue],
+                 labelnames: Tuple[str, ...] = ()) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, kind, callback, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+# Instancia única
+metrics = MetricsRegistry()
+
+
+# ----------------------------------------------------------------------
+# Métricas del camino caliente (los hijos con etiquetas se resuelven aquí)
+# ----------------------------------------------------------------------
+INGEST_MESSAGES = metrics.counter(
+    "esp_ingest_messages_total", "Mensajes recibidos de los ESP por tipo", ("type",)
+)
+INGEST_SAMPLES = metrics.counter(
+    "esp_ingest_samples_total", "Lecturas recibidas de los ESP por formato", ("format",)
+)
+BROADCAST_DURATION = metrics.histogram(
+    "esp_broadcast_duration_seconds", "Duración de broadcast_esp_data (serialización y encolado)",
+    buckets=FAST_BUCKETS_MS, scale=0.001
+)
+BROADCAST_SUBSCRIBERS = metrics.histogram(
+    "esp_broadcast_subscribers", "Suscriptores locales por broadcast de ESP_DATA", buckets=SUBSCRIBER_BUCKETS
+)
+FLUSH_DURATION = metrics.histogram(
+    "ingest_flush_duration_seconds", "Duración de cada flush del buffer a la base de datos", scale=0.001
+)
+FLUSH_ROWS = metrics.counter(
+    "ingest_flush_rows_total", "Lecturas escritas en la base de datos por los flush"
+)
+FLUSH_ERRORS = metrics.counter(
+    "ingest_flush_errors_total", "Flush fallidos (el lote se reintenta)"
+)
+FLUSH_QUARANTINED = metrics.counter(
+    "ingest_flush_quarantined_total", "Lecturas que fallaban solas y se movieron a la cuarentena"
+)
+COMMAND_RTT = metrics.histogram(
+    "command_rtt_seconds", "Ida y vuelta de los comandos de motor (envío a MOTOR_STATUS)", scale=0.001
+)
+HTTP_DURATION = metrics.histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta",
+    ("method", "route", "status"), scale=0.001
+)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que mide la latencia HTTP por ruta.
+
+    Se etiqueta con la plantilla de la ruta (``/api/esp/{device_id}/state``)
+    para no crear una serie por dispositivo; los WebSocket no se miden aquí.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_DURATION.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status[0])
+            ).observe((time.perf_counter() - start) * 1000)
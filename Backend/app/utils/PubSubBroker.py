@@ -0,0 +1,390 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+import asyncio
+import logging
+import os
+import socket
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger("app.pubsub_broker")
+
+# "memory://" (un solo proceso) o "redis://host:puerto/db" (varios workers o nodos)
+BROKER_URL = os.getenv("BROKER_URL", "memory://")
+# Identificador de este worker; permite ignorar los mensajes publicados por él mismo
+NODE_ID = os.getenv("NODE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+# Segundos entre intentos de reconexión al broker
+BROKER_RECONNECT_DELAY_S = float(os.getenv("BROKER_RECONNECT_DELAY_S", "1"))
+
+# Scripts atómicos para leases: solo el dueño actual puede renovar o liberar
+RENEW_IF_EQUAL_SCRIPT = (
+    "if redis.call('GET', KEYS[1]) == ARGV[1] then "
+    "return redis.call('PEXPIRE', KEYS[1], ARGV[2]) else return 0 end"
+)
+DELETE_IF_EQUAL_SCRIPT = (
+    "if redis.call('GET', KEYS[1]) == ARGV[1] then "
+    "return redis.call('DEL', KEYS[1]) else return 0 end"
+)
+
+# Manejador de mensajes: recibe (canal, mensaje). Se llama desde el event loop
+# y no debe bloquear; el trabajo asíncrono se agenda con asyncio.create_task.
+MessageHandler = Callable[[str, str], None]
+
+
+class BrokerError(Exception):
+    """Error de comunicación con el broker."""
+    pass
+
+
+class Broker(ABC):
+    """
+    Interfaz de publicación/suscripción y estado compartido entre workers.
+
+    ``distributed`` indica si los mensajes salen del proceso; con un broker
+    local el ConnectionManager no necesita publicar nada.
+    """
+
+    distributed = False
+
+    def __init__(self):
+        self._handlers: Dict[str, MessageHandler] = {}
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str) -> int:
+        """Publica un mensaje. Retorna la cantidad de suscriptores que lo recibieron."""
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        """Registra el manejador de un canal (uno por canal)."""
+        self._handlers[channel] = handler
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._handlers.pop(channel, None)
+
+    def is_subscribed(self, channel: str) -> bool:
+        return channel in self._handlers
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl_ms: Optional[int] = None) -> None:
+        """Guarda un valor compartido, opcionalmente con expiración."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """Obtiene un valor compartido o None si no existe."""
+
+    async def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        """Obtiene varios valores compartidos, en el orden de ``keys``."""
+        return [await self.get(key) for key in keys]
+
+    @abstractmethod
+    async def renew_if_equal(self, key: str, value: str, ttl_ms: int) -> bool:
+        """Extiende la expiración de ``key`` solo si su valor sigue siendo ``value``."""
+
+    @abstractmethod
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        """Elimina ``key`` solo si su valor sigue siendo ``value``."""
+
+    def _dispatch(self, channel: str, message: str) -> int:
+        handler = self._handlers.get(channel)
+        if handler is None:
+            return 0
+        try:
+            handler(channel, message)
+        except Exception as e:
+            logger.error(f"Error en manejador del canal {channel}: {str(e)}")
+        return 1
+
+    def stats(self) -> Dict:
+        return {
+            "backend": type(self).__name__,
+            "node_id": NODE_ID,
+            "channels": len(self._handlers)
+        }
+
+
+class InProcessBroker(Broker):
+    """Broker en memoria para un único worker (comportamiento por defecto)."""
+
+    def __init__(self):
+        super().__init__()
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+
+    async def publish(self, channel: str, message: str) -> int:
+        return self._dispatch(channel, message)
+
+    async def set(self, key: str, value: str, ttl_ms: Optional[int] = None) -> None:
+        expires_at = None
+        if ttl_ms is not None:
+            expires_at = asyncio.get_running_loop().time() + ttl_ms / 1000
+        self._values[key] = (value, expires_at)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= asyncio.get_running_loop().time():
+            del self._values[key]
+            return None
+        return value
+
+    async def renew_if_equal(self, key: str, value: str, ttl_ms: int) -> bool:
+        if await self.get(key) != value:
+            return False
+        await self.set(key, value, ttl_ms)
+        return True
+
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        if await self.get(key) != value:
+            return False
+        del self._values[key]
+        return True
+
+
+# ----------------------------------------------------------------------
+# Protocolo RESP (Redis)
+# ----------------------------------------------------------------------
+def encode_command(*args) -> bytes:
+    """Codifica un comando como arreglo RESP de bulk strings."""
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(f"${len(arg)}\r\n".encode())
+        parts.append(arg)
+        parts.append(b"\r\n")
+    return b"".join(parts)
+
+async def read_reply(reader: asyncio.StreamReader):
+    """
+    Lee una respuesta RESP completa.
+
+    Los errores ("-ERR ...") se retornan como BrokerError en lugar de lanzarse
+    para no desalinear las respuestas pendientes de la conexión.
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Conexión cerrada por el broker")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode()
+    if prefix == b"-":
+        return BrokerError(body.decode())
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2].decode("utf-8")
+    if prefix == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise BrokerError(f"Respuesta RESP inválida: {line!r}")
+
+
+class RespBroker(Broker):
+    """
+    Broker sobre Redis (o cualquier servidor compatible con RESP).
+
+    Usa dos conexiones: una para comandos, con pipelining (las respuestas se
+    emparejan en orden con futuros pendientes, así que publicar no espera un
+    viaje de ida y vuelta antes de enviar el siguiente comando), y otra en modo
+    suscripción que recibe los mensajes y los entrega a los manejadores. Si
+    una conexión se pierde se reintenta y se restauran las suscripciones.
+    """
+
+    distributed = True
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, password: Optional[str] = None):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Deque[asyncio.Future] = deque()
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+
+        self._sub_writer: Optional[asyncio.StreamWriter] = None
+        self._sub_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @classmethod
+    def from_url(cls, url: str) -> "RespBroker":
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password)
+
+    async def start(self) -> None:
+        self._stopping = False
+        await self._ensure_connection()
+        self._sub_task = asyncio.create_task(self._subscriber_loop())
+        logger.info(f"Broker RESP conectado a {self.host}:{self.port} como {NODE_ID}")
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in (self._reader_task, self._sub_task):
+            if task is not None:
+                task.cancel()
+        for writer in (self._writer, self._sub_writer):
+            if writer is not None:
+                writer.close()
+        self._fail_pending(ConnectionError("Broker detenido"))
+        self._writer = self._sub_writer = None
+
+    # ------------------------------------------------------------------
+    # Conexión de comandos
+    # ------------------------------------------------------------------
+    async def _open(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        handshake = []
+        if self.password:
+            handshake.append(("AUTH", self.password))
+        if self.db:
+            handshake.append(("SELECT", self.db))
+        for command in handshake:
+            writer.write(encode_command(*command))
+            reply = await read_reply(reader)
+            if isinstance(reply, BrokerError):
+                writer.close()
+                raise reply
+        return reader, writer
+
+    async def _ensure_connection(self) -> asyncio.StreamWriter:
+        if self._writer is not None and not self._writer.is_closing():
+            return self._writer
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                reader, self._writer = await self._open()
+                self._reader_task = asyncio.create_task(self._read_replies(reader))
+        return self._writer
+
+    async def _read_replies(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                reply = await read_reply(reader)
+                if self._pending:
+                    future = self._pending.popleft()
+                    if not future.done():
+                        future.set_result(reply)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not self._stopping:
+                logger.error(f"Conexión de comandos con el broker perdida: {str(e)}")
+            if self._writer is not None:
+                self._writer.close()
+            self._writer = None
+            self._fail_pending(ConnectionError(str(e)))
+
+    def _fail_pending(self, error: Exception) -> None:
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def execute(self, *args):
+        """Envía un comando y espera su respuesta (otros comandos pueden ir en paralelo)."""
+        writer = await self._ensure_connection()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(future)
+        writer.write(encode_command(*args))
+        reply = await future
+        if isinstance(reply, BrokerError):
+            raise reply
+        return reply
+
+    async def publish(self, channel: str, message: str) -> int:
+        return await self.execute("PUBLISH", channel, message)
+
+    async def set(self, key: str, value: str, ttl_ms: Optional[int] = None) -> None:
+        if ttl_ms is None:
+            await self.execute("SET", key, value)
+        else:
+            await self.execute("SET", key, value, "PX", int(ttl_ms))
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.execute("GET", key)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        if not keys:
+            return []
+        return await self.execute("MGET", *keys)
+
+    async def renew_if_equal(self, key: str, value: str, ttl_ms: int) -> bool:
+        return bool(await self.execute("EVAL", RENEW_IF_EQUAL_SCRIPT, 1, key, value, int(ttl_ms)))
+
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        return bool(await self.execute("EVAL", DELETE_IF_EQUAL_SCRIPT, 1, key, value))
+
+    # ------------------------------------------------------------------
+    # Conexión de suscripción
+    # ------------------------------------------------------------------
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        already = channel in self._handlers
+        await super().subscribe(channel, handler)
+        if not already and self._sub_writer is not None:
+            self._sub_writer.write(encode_command("SUBSCRIBE", channel))
+
+    async def unsubscribe(self, channel: str) -> None:
+        if channel in self._handlers:
+            await super().unsubscribe(channel)
+            if self._sub_writer is not None:
+                self._sub_writer.write(encode_command("UNSUBSCRIBE", channel))
+
+    async def _subscriber_loop(self):
+        """Mantiene la conexión de suscripción y despacha los mensajes recibidos."""
+        while not self._stopping:
+            try:
+                reader, self._sub_writer = await self._open()
+                # Restaurar las suscripciones registradas antes de (re)conectar
+                channels: List[str] = list(self._handlers)
+                if channels:
+                    self._sub_writer.write(encode_command("SUBSCRIBE", *channels))
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == "message":
+                        self._dispatch(reply[1], reply[2])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self._stopping:
+                    return
+                logger.error(f"Conexión de suscripción con el broker perdida: {str(e)}")
+                self._sub_writer = None
+                await asyncio.sleep(BROKER_RECONNECT_DELAY_S)
+
+    def stats(self) -> Dict:
+        return {
+            **super().stats(),
+            "url": f"redis://{self.host}:{self.port}/{self.db}",
+            "connected": self._writer is not None and self._sub_writer is not None,
+            "pending_replies": len(self._pending)
+        }
+
+
+def create_broker(url: str = BROKER_URL) -> Broker:
+    """Crea el broker indicado por la URL (memory:// o redis://)."""
+    scheme = urlparse(url).scheme
+    if scheme in ("", "memory"):
+        return InProcessBroker()
+    if scheme == "redis":
+        return RespBroker.from_url(url)
+    raise ValueError(f"BROKER_URL no soportada: {url}")
+
+# Instancia única
+broker = create_broker()
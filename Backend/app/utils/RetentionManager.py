@@ -0,0 +1,220 @@
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Type
+import asyncio
+import logging
+import os
+import time
+
+from app.database.database import database
+from app.database.modelsDB import SensorReading, SensorRollupMixin
+from app.utils.BufferManager import data_buffer
+from app.utils.rollup_dependencies import ROLLUP_NAMES, ROLLUP_TABLES, MINUTE_MS, HOUR_MS, DAY_MS
+
+logger = logging.getLogger("app.retention")
+
+DAY_S = 24 * 3600
+
+
+class RetentionManager:
+    """
+    Borra la telemetría que superó su periodo de retención.
+
+    Las lecturas crudas se borran por ESP en bloques de RETENTION_CHUNK_ROWS
+    filas con ts vencido, y los rollups por rangos de (esp_id, bucket_ts);
+    cada bloque es una transacción corta. Entre bloques se
+    espera RETENTION_PAUSE_MS y ningún bloque corre a la vez que el flush
+    del buffer de ingesta.
+    """
+    _instance = None
+
+    # Días que se conserva cada tabla (0 = sin límite)
+    RETENTION_RAW_DAYS = float(os.getenv("RETENTION_RAW_DAYS", "7"))
+    RETENTION_ROLLUP_DAYS = {
+        MINUTE_MS: float(os.getenv("RETENTION_ROLLUP_1M_DAYS", "30")),
+        HOUR_MS: float(os.getenv("RETENTION_ROLLUP_1H_DAYS", "365")),
+        DAY_MS: float(os.getenv("RETENTION_ROLLUP_1D_DAYS", "0"))
+    }
+    # Frecuencia de las pasadas, filas por bloque y pausa entre bloques
+    RETENTION_INTERVAL_S = float(os.getenv("RETENTION_INTERVAL_S", "3600"))
+    RETENTION_CHUNK_ROWS = int(os.getenv("RETENTION_CHUNK_ROWS", "5000"))
+    RETENTION_PAUSE_MS = int(os.getenv("RETENTION_PAUSE_MS", "200"))
+    # Con varios workers basta con habilitarla en uno
+    RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(RetentionManager, cls).__new__(cls)
+            cls._instance.initialize()
+        return cls._instance
+
+    def initialize(self):
+        self._task: Optional[asyncio.Task] = None
+        self.running = False
+        self.runs = 0
+        self.chunks = 0
+        self.deleted: Dict[str, int] = {"raw": 0, **{name: 0 for name in ROLLUP_NAMES.values()}}
+        self.last_run: Optional[str] = None
+        self.last_run_seconds: Optional[float] = None
+
+    async def start(self):
+        """Inicia las pasadas periódicas (llamar desde el lifespan)."""
+        if not self.RETENTION_ENABLED or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._periodic())
+        logger.info(
+            f"Retención iniciada (crudas={self.RETENTION_RAW_DAYS}d, cada {self.RETENTION_INTERVAL_S}s)"
+        )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _periodic(self):
+        while True:
+            try:
+                await self.run_once()
+                await asyncio.sleep(self.RETENTION_INTERVAL_S)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en la pasada de retención: {str(e)}")
+                await asyncio.sleep(self.RETENTION_INTERVAL_S)
+
+    @staticmethod
+    def _cutoff_ms(days: float) -> Optional[int]:
+        if days <= 0:
+            return None
+        return int((time.time() - days * DAY_S) * 1000)
+
+    async def _run_chunk(self, operation, *args):
+        """Ejecuta un bloque de borrado en su propia transacción, sin solaparse con el flush."""
+        async with data_buffer.flush_paused():
+            async with database.write_session() as db:
+                result = await db.run_sync(operation, *args)
+        self.chunks += 1
+        await asyncio.sleep(self.RETENTION_PAUSE_MS / 1000)
+        return result
+
+    async def run_once(self) -> Dict[str, int]:
+        """
+        Ejecuta una pasada completa de retención.
+
+        Returns:
+            Dict con las filas borradas por tabla en esta pasada
+        """
+        started = time.perf_counter()
+        self.running = True
+        deleted = {}
+        try:
+            cutoff = self._cutoff_ms(self.RETENTION_RAW_DAYS)
+            if cutoff is not None:
+                deleted["raw"] = await self._purge_raw(cutoff)
+
+            for granularity, model in ROLLUP_TABLES:
+                cutoff = self._cutoff_ms(self.RETENTION_ROLLUP_DAYS[granularity])
+                if cutoff is not None:
+                    deleted[ROLLUP_NAMES[granularity]] = await self._purge_rollup(model, granularity, cutoff)
+        finally:
+            self.running = False
+
+        for name, count in deleted.items():
+            self.deleted[name] += count
+        self.runs += 1
+        self.last_run = datetime.now().isoformat()
+        self.last_run_seconds = round(time.perf_counter() - started, 3)
+        if any(deleted.values()):
+            logger.info(f"Retención: {deleted} filas borradas en {self.last_run_seconds}s")
+        return deleted
+
+    # ------------------------------------------------------------------
+    # Lecturas crudas: por ESP y ts, sobre el índice (esp_id, ts)
+    # ------------------------------------------------------------------
+    def _raw_devices(self, db: Session, cutoff: int) -> List[int]:
+        """ESP con lecturas vencidas."""
+        return list(db.scalars(
+            select(SensorReading.esp_id).where(SensorReading.ts < cutoff).distinct()
+        ))
+
+    def _purge_raw_chunk(self, db: Session, esp_id: int, cutoff: int) -> int:
+        """
+        Borra hasta RETENTION_CHUNK_ROWS lecturas vencidas de un ESP.
+
+        Se filtra por ts y no por ventanas de id: una lectura vieja insertada
+        tarde (p. ej. recuperada del WAL o con la hora del sensor) tiene un id
+        alto y también debe borrarse. Los ids se eligen primero porque MySQL
+        no admite LIMIT dentro de un IN y SQLite no tiene DELETE ... LIMIT.
+        """
+        ids = list(db.scalars(
+            select(SensorReading.id)
+            .where(SensorReading.esp_id == esp_id, SensorReading.ts < cutoff)
+            .order_by(SensorReading.ts)
+            .limit(self.RETENTION_CHUNK_ROWS)
+        ))
+        if not ids:
+            return 0
+        return db.execute(delete(SensorReading).where(SensorReading.id.in_(ids))).rowcount
+
+    async def _purge_raw(self, cutoff: int) -> int:
+        async with database.async_session() as db:
+            devices = await db.run_sync(self._raw_devices, cutoff)
+
+        total = 0
+        for esp_id in devices:
+            while True:
+                deleted = await self._run_chunk(self._purge_raw_chunk, esp_id, cutoff)
+                total += deleted
+                if deleted < self.RETENTION_CHUNK_ROWS:
+                    break
+        return total
+
+    # ------------------------------------------------------------------
+    # Rollups: rangos de (esp_id, bucket_ts)
+    # ------------------------------------------------------------------
+    def _rollup_devices(self, db: Session, model: Type[SensorRollupMixin], cutoff: int) -> List[Tuple[int, int]]:
+        """ESP con rollups vencidos y el bucket más antiguo de cada uno."""
+        return [
+            (esp_id, oldest) for esp_id, oldest in db.execute(
+                select(model.esp_id, func.min(model.bucket_ts))
+                .where(model.bucket_ts < cutoff)
+                .group_by(model.esp_id)
+            )
+        ]
+
+    def _purge_rollup_range(self, db: Session, model: Type[SensorRollupMixin], esp_id: int, upper: int) -> int:
+        return db.execute(
+            delete(model).where(model.esp_id == esp_id, model.bucket_ts < upper)
+        ).rowcount
+
+    async def _purge_rollup(self, model: Type[SensorRollupMixin], granularity: int, cutoff: int) -> int:
+        async with database.async_session() as db:
+            devices = await db.run_sync(self._rollup_devices, model, cutoff)
+
+        total = 0
+        step = self.RETENTION_CHUNK_ROWS * granularity
+        for esp_id, oldest in devices:
+            upper = oldest
+            while upper < cutoff:
+                # Cada bloque cubre como máximo RETENTION_CHUNK_ROWS buckets del ESP
+                upper = min(cutoff, upper + step)
+                total += await self._run_chunk(self._purge_rollup_range, model, esp_id, upper)
+        return total
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.RETENTION_ENABLED,
+            "running": self.running,
+            "raw_days": self.RETENTION_RAW_DAYS,
+            "rollup_days": {ROLLUP_NAMES[granularity]: days for granularity, days in self.RETENTION_ROLLUP_DAYS.items()},
+            "runs": self.runs,
+            "chunks": self.chunks,
+            "deleted": dict(self.deleted),
+            "last_run": self.last_run,
+            "last_run_seconds": self.last_run_seconds
+        }
+
+# Instancia única
+retention_manager = RetentionManager()
@@ -0,0 +1,284 @@
+import os
+import json
+import struct
+import zlib
+import asyncio
+import logging
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger("app.write_ahead_log")
+
+# Cabecera de cada registro: longitud del payload y CRC32 (little endian)
+RECORD_HEADER = struct.Struct("<II")
+
+FSYNC_ALWAYS = "always"   # fsync después de cada escritura (en un hilo, con commit())
+FSYNC_GROUP = "group"     # fsync agrupado cada FSYNC_INTERVAL_MS
+FSYNC_OS = "os"           # el sistema operativo decide cuándo escribir a disco
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_GROUP, FSYNC_OS)
+
+SEGMENT_SUFFIX = ".wal"
+
+
+class WriteAheadLog:
+    """
+    Log de solo escritura (append-only) segmentado en disco.
+
+    Cada registro se guarda como ``<longitud><crc32><payload json>``, por lo que
+    agregar un registro cuesta O(1) sin importar cuántos estén pendientes.
+    Los segmentos se rotan al alcanzar ``segment_max_bytes`` o al llamar a
+    ``rotate()``; una vez que los datos de un segmento están confirmados en la
+    base de datos se eliminan con ``truncate()``.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fsync_policy: str = FSYNC_GROUP,
+        fsync_interval_ms: int = 200,
+        segment_max_bytes: int = 16 * 1024 * 1024
+    ):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Política de fsync inválida: {fsync_policy}")
+
+        self.directory = directory
+        self.fsync_policy = fsync_policy
+        self.fsync_interval_ms = fsync_interval_ms
+        self.segment_max_bytes = segment_max_bytes
+
+        self._file = None
+        self._segment_id = 0
+        self._segment_size = 0
+        self._dirty = False
+        # Copias de los descriptores de segmentos rotados cuyo fsync aún no se hizo
+        self._unsynced_fds: List[int] = []
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Segmentos
+    # ------------------------------------------------------------------
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.directory, f"{segment_id:012d}{SEGMENT_SUFFIX}")
+
+    def _segment_ids(self) -> List[int]:
+        ids = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    ids.append(int(name[:-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    logger.warning(f"Archivo ignorado en el WAL: {name}")
+        return sorted(ids)
+
+    def _open_segment(self, segment_id: int) -> None:
+        self._segment_id = segment_id
+        self._file = open(self._segment_path(segment_id), "ab")
+        self._segment_size = self._file.tell()
+
+    def _close_segment(self) -> None:
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync_policy != FSYNC_OS:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        self._dirty = False
+
+    @property
+    def segment_id(self) -> int:
+        """Identificador del segmento activo."""
+        return self._segment_id
+
+    # ------------------------------------------------------------------
+    # Recuperación
+    # ------------------------------------------------------------------
+    def _read_segment(self, segment_id: int) -> Tuple[List[Dict], int]:
+        """
+        Lee los registros válidos de un segmento.
+
+        Returns:
+            Tuple con los registros y la cantidad de bytes válidos. Un registro
+            incompleto o con CRC inválido (escritura interrumpida) marca el fin.
+        """
+        records: List[Dict] = []
+        with open(self._segment_path(segment_id), "rb") as f:
+            data = f.read()
+
+        view = memoryview(data)
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(view, offset)
+            start = offset + RECORD_HEADER.size
+            end = start + length
+            if end > len(data) or zlib.crc32(view[start:end]) != crc:
+                logger.warning(
+                    f"Registro corrupto o incompleto en segmento {segment_id} (offset {offset}), "
+                    f"descartando {len(data) - offset} bytes"
+                )
+                break
+            try:
+                records.append(json.loads(bytes(view[start:end])))
+            except ValueError:
+                logger.error(f"Registro ilegible en segmento {segment_id} (offset {offset})")
+            offset = end
+        return records, offset
+
+    def replay(self) -> Iterator[Dict]:
+        """
+        Recupera los registros pendientes y abre un segmento nuevo para escribir.
+
+        Los bytes sobrantes de una escritura interrumpida se truncan para que
+        el siguiente registro quede alineado.
+        """
+        self._close_segment()
+        segment_ids = self._segment_ids()
+        recovered: List[Dict] = []
+
+        for segment_id in segment_ids:
+            records, valid_bytes = self._read_segment(segment_id)
+            path = self._segment_path(segment_id)
+            if valid_bytes < os.path.getsize(path):
+                with open(path, "r+b") as f:
+                    f.truncate(valid_bytes)
+            recovered.extend(records)
+
+        if recovered:
+            logger.info(f"Recuperados {len(recovered)} registros del WAL ({len(segment_ids)} segmentos)")
+
+        next_id = segment_ids[-1] + 1 if segment_ids else 1
+        self._open_segment(next_id)
+        return iter(recovered)
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+    def append(self, record: Dict) -> int:
+        """
+        Agrega un registro al segmento activo.
+
+        Returns:
+            int: Identificador del segmento en el que quedó el registro
+        """
+        return self.append_many((record,))
+
+    def append_many(self, records: Iterable[Dict]) -> int:
+        """
+        Agrega varios registros con una sola escritura, p. ej. un lote de
+        muestras de un ESP. No hace fsync: con la política ``always`` quien
+        escribe debe esperar ``commit()``.
+
+        Returns:
+            int: Identificador del segmento en el que quedaron los registros
+        """
+        if self._file is None:
+            self._open_segment(self._segment_id + 1)
+
+        chunks = []
+        for record in records:
+            payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+            chunks.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+            chunks.append(payload)
+        data = b"".join(chunks)
+        self._file.write(data)
+        self._file.flush()
+        self._segment_size += len(data)
+        self._dirty = True
+
+        segment_id = self._segment_id
+        if self._segment_size >= self.segment_max_bytes:
+            self.rotate()
+        return segment_id
+
+    def rotate(self) -> int:
+        """
+        Cierra el segmento activo y abre uno nuevo.
+
+        No hace fsync: el segmento cerrado queda pendiente para el siguiente
+        ``sync_async()`` (fsync agrupado o ``commit()``), que corre en un hilo.
+
+        Returns:
+            int: Identificador del nuevo segmento. Todo lo escrito antes de la
+            rotación vive en segmentos con identificador menor.
+        """
+        if self._file is not None and self._segment_size == 0:
+            return self._segment_id
+        if self._file is not None:
+            self._file.flush()
+            if self.fsync_policy != FSYNC_OS and self._dirty:
+                self._unsynced_fds.append(os.dup(self._file.fileno()))
+            self._file.close()
+            self._file = None
+            self._dirty = False
+        self._open_segment(self._segment_id + 1)
+        return self._segment_id
+
+    def truncate(self, before_segment_id: int) -> None:
+        """Elimina los segmentos anteriores a ``before_segment_id`` (ya confirmados en la BD)."""
+        for segment_id in self._segment_ids():
+            if segment_id >= before_segment_id or segment_id == self._segment_id:
+                continue
+            try:
+                os.remove(self._segment_path(segment_id))
+            except OSError as e:
+                logger.error(f"No se pudo eliminar el segmento {segment_id}: {str(e)}")
+
+    def _take_unsynced(self) -> List[int]:
+        """Descriptores (copias) de todo lo escrito sin fsync: segmentos rotados y el activo."""
+        fds, self._unsynced_fds = self._unsynced_fds, []
+        if self._file is not None and self._dirty:
+            fds.append(os.dup(self._file.fileno()))
+            self._dirty = False
+        return fds
+
+    @staticmethod
+    def _fsync_all(fds: List[int]) -> None:
+        try:
+            for fd in fds:
+                os.fsync(fd)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def sync(self) -> None:
+        """Fuerza la escritura a disco de los registros pendientes (bloquea; fuera del event loop)."""
+        self._fsync_all(self._take_unsynced())
+
+    async def sync_async(self) -> None:
+        """
+        Igual que ``sync()`` pero el fsync corre en un hilo.
+
+        Se trabaja sobre copias de los descriptores, así que una rotación
+        mientras dura el fsync no los cierra.
+        """
+        fds = self._take_unsynced()
+        if fds:
+            await asyncio.to_thread(self._fsync_all, fds)
+
+    async def commit(self) -> None:
+        """Política ``always``: confirma en disco lo escrito hasta ahora. Con las otras no hace nada."""
+        if self.fsync_policy == FSYNC_ALWAYS:
+            await self.sync_async()
+
+    async def periodic_sync(self):
+        """fsync agrupado: confirma en disco los registros acumulados cada intervalo."""
+        interval = self.fsync_interval_ms / 1000
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                await self.sync_async()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en fsync agrupado del WAL: {str(e)}")
+
+    def close(self) -> None:
+        """Cierra el segmento activo asegurando su escritura a disco (y la de los rotados)."""
+        self._fsync_all(self._unsynced_fds)
+        self._unsynced_fds = []
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._dirty = False
@@ -1,15 +1,44 @@
 from fastapi import WebSocket, WebSocketDisconnect, HTTPException
 from datetime import datetime
+from typing import Dict, List, Optional, Union
+import asyncio
+import json
 import logging
+import os
+import time
+import uuid
 
-# Se pretende manejar el buffer de datos
-# este guardaria los datos que se envian a los clientes
-# en un archivo .log para su posterior análisis o backup en db
-
-# from app.utils.BufferManager import data_buffer 
+from app.utils.FrontendConnection import FrontendConnection
+from app.utils.json_dependencies import encode_json
+from app.utils.PubSubBroker import broker, NODE_ID
+from app.utils.DeviceRegistry import DeviceRegistry
+from app.utils.CommandTracker import command_tracker, COMMAND_ACK_TIMEOUT_S, COMMAND_MAX_RETRIES
+from app.utils.Metrics import BROADCAST_DURATION, BROADCAST_SUBSCRIBERS
 
 logger = logging.getLogger("app.connection_manager")
 
+# Intervalo mínimo entre frames ESP_DATA por dispositivo y suscriptor (0 = sin agrupar)
+FRONTEND_COALESCE_INTERVAL_MS = int(os.getenv("FRONTEND_COALESCE_INTERVAL_MS", "0"))
+# Límite superior aceptado al negociar el intervalo en SUBSCRIBE
+FRONTEND_COALESCE_MAX_INTERVAL_MS = 60000
+
+# Canales y llaves del broker compartidos entre workers
+ESP_DATA_CHANNEL = "esp_data:"
+ESP_STATE_KEY = "esp_state:"
+# Canales propios de cada worker para reenviar comandos y recibir sus resultados
+NODE_COMMAND_CHANNEL = "node_cmd:"
+NODE_REPLY_CHANNEL = "node_reply:"
+# Tiempo máximo de espera del resultado de un comando reenviado a otro worker
+COMMAND_FORWARD_TIMEOUT_S = float(os.getenv("COMMAND_FORWARD_TIMEOUT_S", "5"))
+# Código de cierre del socket de un ESP que se reconectó en otro worker
+ESP_REPLACED_CLOSE_CODE = 4002
+# Tiempo que se conserva el último estado publicado de un ESP
+ESP_STATE_TTL_MS = int(os.getenv("ESP_STATE_TTL_MS", "86400000"))
+
+# Histogramas del broadcast (hijos sin etiquetas resueltos una vez)
+BROADCAST_SECONDS = BROADCAST_DURATION.labels()
+BROADCAST_FAN_OUT = BROADCAST_SUBSCRIBERS.labels()
+
 class ConnectionManager:
     def __new__(cls):
         if not hasattr(cls, '_instance'):
@@ -19,71 +48,183 @@ class ConnectionManager:
             cls._instance.esp_states = {}
             cls._instance.user_devices = {}
             cls._instance.device_subscribers = {}
+            cls._instance.broker = broker
+            cls._instance.registry = DeviceRegistry(broker)
+            cls._instance.forwarded_commands = {}
         return cls._instance
 
+    async def start(self):
+        """Anuncia este worker en el broker (solo con un broker distribuido)."""
+        if not self.broker.distributed:
+            return
+        await self.broker.subscribe(NODE_COMMAND_CHANNEL + NODE_ID, self._on_forwarded_command)
+        await self.broker.subscribe(NODE_REPLY_CHANNEL + NODE_ID, self._on_forward_reply)
+        self.registry.start(lambda: list(self.esp_connections), self._close_replaced_esp)
+
+    async def stop(self):
+        """Libera los leases de los ESP conectados a este worker."""
+        if self.broker.distributed:
+            await self.registry.stop(list(self.esp_connections))
+
+    def _broker_task(self, coro) -> None:
+        """Ejecuta una operación del broker en segundo plano registrando los errores."""
+        task = asyncio.create_task(coro)
+        task.add_done_callback(self._log_broker_error)
+
+    @staticmethod
+    def _log_broker_error(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error en operación del broker: {str(task.exception())}")
+
     def is_connected_esp(self, device_id: str) -> bool:
         """Verifica si un ESP está conectado"""
         return device_id in self.esp_connections and self.esp_connections[device_id] is not None
 
-    async def connect_esp(self, websocket: WebSocket, device_id: str):
-        """Conecta un ESP"""
-        await websocket.accept()
+    async def connect_esp(self, websocket: WebSocket, device_id: str, subprotocol: Optional[str] = None):
+        """Conecta un ESP, aceptando el subprotocolo de telemetría negociado"""
+        await websocket.accept(subprotocol=subprotocol)
         self.esp_connections[device_id] = websocket
+        if self.broker.distributed:
+            # Registrar este worker como dueño del socket del ESP
+            await self.registry.acquire(device_id)
         logger.info(f"ESP conectado: {device_id}")
 
-    def disconnect_esp(self, device_id: str):
-        """Desconecta un ESP"""
-        if device_id in self.esp_connections:
-            del self.esp_connections[device_id]
+    def disconnect_esp(self, device_id: str, websocket: Optional[WebSocket] = None):
+        """
+        Desconecta un ESP
+
+        Si se indica el websocket, solo se desconecta cuando sigue siendo la
+        conexión registrada (evita retirar una reconexión más reciente).
+        """
+        current = self.esp_connections.get(device_id)
+        if current is None or (websocket is not None and current is not websocket):
+            return
+        del self.esp_connections[device_id]
+        command_tracker.cancel_device(device_id)
+        if self.broker.distributed:
+            self._broker_task(self.registry.release(device_id))
         logger.info(f"ESP desconectado: {device_id}")
 
+    def _close_replaced_esp(self, device_id: str):
+        """Cierra el socket local de un ESP que ahora está conectado a otro worker."""
+        websocket = self.esp_connections.pop(device_id, None)
+        if websocket is not None:
+            command_tracker.cancel_device(device_id)
+            self._broker_task(websocket.close(code=ESP_REPLACED_CLOSE_CODE))
+
     async def connect_frontend(self, websocket: WebSocket, user_id: str):
         """Conecta un cliente frontend"""
         await websocket.accept()
-        self.frontend_connections[user_id] = websocket
+        previous = self.frontend_connections.get(user_id)
+        if previous is not None:
+            previous.stop()
+
+        connection = FrontendConnection(websocket, user_id, self.disconnect_frontend)
+        connection.start()
+        self.frontend_connections[user_id] = connection
+        self.set_subscriber_interval(user_id, None)
         if user_id not in self.user_devices:
             self.user_devices[user_id] = set()
         logger.info(f"Nueva conexión frontend para usuario: {user_id}")
 
-    def disconnect_frontend(self, user_id: str):
-        """Desconecta un cliente frontend"""
-        if user_id in self.frontend_connections:
-            del self.frontend_connections[user_id]
+    def disconnect_frontend(self, user_id: str, websocket: Optional[WebSocket] = None):
+        """
+        Desconecta un cliente frontend
+
+        Si se indica el websocket, solo se desconecta cuando sigue siendo la
+        conexión registrada (evita cerrar una reconexión más reciente).
+        """
+        connection = self.frontend_connections.get(user_id)
+        if connection is None or (websocket is not None and connection.websocket is not websocket):
+            return
+        del self.frontend_connections[user_id]
+        connection.stop()
         logger.info(f"Cliente frontend desconectado: {user_id}")
 
-    def subscribe_to_device(self, user_id: str, device_id: str) -> bool:
+    def send_to_frontend(self, user_id: str, message: Union[dict, str], device_id: Optional[str] = None) -> bool:
+        """Encola un mensaje para un cliente frontend sin esperar el envío"""
+        connection = self.frontend_connections.get(user_id)
+        if connection is None:
+            return False
+        return connection.send(message, device_id)
+
+    def set_subscriber_interval(self, user_id: str, interval_ms: Optional[int]) -> float:
+        """
+        Configura el intervalo de agrupación de un suscriptor.
+
+        Args:
+            user_id: Identificador del usuario
+            interval_ms: Milisegundos mínimos entre frames por dispositivo;
+                None usa FRONTEND_COALESCE_INTERVAL_MS y 0 desactiva la agrupación
+
+        Returns:
+            float: Intervalo aplicado en segundos
+        """
+        if interval_ms is None:
+            interval_ms = FRONTEND_COALESCE_INTERVAL_MS
+        interval_ms = max(0, min(int(interval_ms), FRONTEND_COALESCE_MAX_INTERVAL_MS))
+        connection = self.frontend_connections.get(user_id)
+        if connection is None:
+            return 0.0
+        connection.interval = interval_ms / 1000
+        return connection.interval
+
+    def subscribe_to_device(self, user_id: str, device_id: str, interval_ms: Optional[int] = None) -> bool:
         """Suscribe un usuario a un dispositivo"""
+        return self.subscribe_to_devices(user_id, [device_id], interval_ms)
+
+    def subscribe_to_devices(self, user_id: str, device_ids: List[str], interval_ms: Optional[int] = None) -> bool:
+        """Suscribe un usuario a varios dispositivos"""
         try:
-            if device_id not in self.device_subscribers:
-                self.device_subscribers[device_id] = set()
-            
-            self.device_subscribers[device_id].add(user_id)
-            
-            if user_id not in self.user_devices:
-                self.user_devices[user_id] = set()
-            self.user_devices[user_id].add(device_id)
-            
-            logger.info(f"Usuario {user_id} suscrito al dispositivo {device_id}")
+            if interval_ms is not None:
+                self.set_subscriber_interval(user_id, interval_ms)
+
+            devices = self.user_devices.setdefault(user_id, set())
+            for device_id in device_ids:
+                if device_id not in self.device_subscribers:
+                    self.device_subscribers[device_id] = set()
+                    if self.broker.distributed:
+                        # Recibir los datos del ESP aunque esté conectado a otro worker
+                        self._broker_task(
+                            self.broker.subscribe(ESP_DATA_CHANNEL + device_id, self._on_remote_data)
+                        )
+                self.device_subscribers[device_id].add(user_id)
+                devices.add(device_id)
+
+            if len(device_ids) == 1:
+                logger.info(f"Usuario {user_id} suscrito al dispositivo {device_ids[0]}")
+            else:
+                logger.info(f"Usuario {user_id} suscrito a {len(device_ids)} dispositivos")
             return True
         except Exception as e:
             logger.error(f"Error en suscripción: {str(e)}")
             return False
 
-    async def send_command_to_esp(self, device_id: str, command: dict) -> bool:
+    async def send_command_to_esp(self, device_id: str, command: dict, wait_ack: bool = False) -> Dict:
         """
         Envía un comando a un ESP específico
         
+        El comando se envía con un command_id; si el ESP no lo confirma con un
+        MOTOR_STATUS dentro de COMMAND_ACK_TIMEOUT_S se reenvía hasta
+        COMMAND_MAX_RETRIES veces en segundo plano.
+
         Args:
             device_id: Identificador del ESP
             command: Diccionario con el comando a enviar
+            wait_ack: Esperar la confirmación del ESP antes de retornar
             
         Returns:
-            bool: True si el comando se envió exitosamente
+            Dict: command_id y, si se esperó, el resultado de la confirmación
             
         Raises:
-            HTTPException: Si el ESP no está conectado o hay un error al enviar el comando
+            HTTPException: Si el ESP no está conectado, hay un error al enviar el
+                comando o (con wait_ack) el ESP no lo confirma
         """
         try:
+            if not self.is_connected_esp(device_id) and self.broker.distributed:
+                # El ESP puede estar conectado a otro worker: reenviarle el comando
+                return await self._forward_command(device_id, command, wait_ack)
+
             if not self.is_connected_esp(device_id):
                 raise HTTPException(
                     status_code=404,
@@ -91,25 +232,34 @@ class ConnectionManager:
                 )
 
             websocket = self.esp_connections[device_id]
+            pending = command_tracker.track(device_id, command)
             
-            logger.info(f"Enviando comando a {device_id}: {command}")
-            
-            # Enviar el comando como JSON
-            await websocket.send_json(command)
+            logger.info(f"Enviando comando a {device_id}: {pending.command}")
             
-            # Actualizar el estado del motor en esp_states
-            if command.get("action"):
-                current_state = self.esp_states.get(device_id, {})
-                current_state["motor_status"] = "running" if command["action"] == "START_MOTOR" else "stopped"
-                current_state["last_update"] = datetime.now().isoformat()
-                self.esp_states[device_id] = current_state
-                
-                # Notificar a los suscriptores del cambio de estado
-                await self.broadcast_esp_data(device_id, current_state)
+            # Enviar el comando como JSON; el estado del motor se actualiza
+            # cuando el ESP lo confirma con MOTOR_STATUS
+            try:
+                await websocket.send_json(pending.command)
+            except Exception:
+                command_tracker.expire(pending, "SEND_FAILED")
+                raise
+            command_tracker.mark_sent(pending)
+            asyncio.create_task(self._retry_until_ack(device_id, pending))
             
-            logger.info(f"Comando enviado exitosamente a {device_id}: {command}")
-            return True
+            logger.info(f"Comando enviado exitosamente a {device_id}: {pending.command}")
+            if not wait_ack:
+                return {"command_id": pending.command_id, "acknowledged": None}
+
+            result = await pending.future
+            if not result["acknowledged"]:
+                raise HTTPException(
+                    status_code=504,
+                    detail=f"ESP {device_id} no confirmó el comando {pending.command_id} ({result['status']})"
+                )
+            return result
             
+        except HTTPException:
+            raise
         except WebSocketDisconnect:
             self.disconnect_esp(device_id)
             raise HTTPException(
@@ -123,8 +273,51 @@ class ConnectionManager:
                 detail=f"Error enviando comando al ESP: {str(e)}"
             )
 
-    async def broadcast_esp_data(self, device_id: str, data: dict):
-        """Transmite datos del ESP a sus suscriptores"""
+    async def _retry_until_ack(self, device_id: str, pending) -> None:
+        """Reenvía el comando mientras no llegue su confirmación y quedan intentos."""
+        for attempt in range(COMMAND_MAX_RETRIES + 1):
+            try:
+                await asyncio.wait_for(asyncio.shield(pending.future), COMMAND_ACK_TIMEOUT_S)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            websocket = self.esp_connections.get(device_id)
+            if attempt == COMMAND_MAX_RETRIES or websocket is None:
+                break
+            try:
+                logger.info(f"Reintentando comando {pending.command_id} para {device_id} (intento {attempt + 2})")
+                await websocket.send_json(pending.command)
+                command_tracker.mark_sent(pending)
+            except Exception as e:
+                logger.error(f"Error reenviando comando a {device_id}: {str(e)}")
+                break
+        command_tracker.expire(pending)
+
+    async def handle_motor_status(self, device_id: str, status: dict) -> None:
+        """
+        Procesa un MOTOR_STATUS del ESP: confirma el comando pendiente que
+        corresponda y publica el nuevo estado del motor.
+        """
+        pending = command_tracker.acknowledge(device_id, status)
+        if pending is not None:
+            logger.info(f"ESP {device_id} confirmó el comando {pending.command_id}: {status.get('status')}")
+
+        motor_status = status.get("status")
+        current_state = dict(self.esp_states.get(device_id, {}))
+        current_state["motor_status"] = "running" if motor_status == "RUNNING" else "stopped"
+        if "current_position" in status or "position" in status:
+            current_state["motor_position"] = status.get("current_position", status.get("position"))
+        await self.broadcast_esp_data(device_id, current_state)
+
+    async def broadcast_esp_data(self, device_id: str, data: dict, samples: Optional[List[dict]] = None):
+        """
+        Transmite datos del ESP a sus suscriptores
+
+        Para un lote de muestras se envía un solo mensaje: ``data`` es el
+        estado más reciente y ``samples`` todas las lecturas del lote.
+        """
+        start = time.perf_counter()
         try:
             # Actualizar estado del ESP
             self.esp_states[device_id] = {
@@ -133,36 +326,160 @@ class ConnectionManager:
             }
             state = self.esp_states[device_id]
 
-            # Obtener suscriptores para este dispositivo
-            subscribers = self.device_subscribers.get(device_id, set()).copy()
-            
+            # Sin suscriptores locales ni otros workers no hay nada que serializar
+            subscribers = self.device_subscribers.get(device_id)
+            BROADCAST_FAN_OUT.observe(len(subscribers) if subscribers else 0)
+            if not subscribers and not self.broker.distributed:
+                return
+
             # Preparar mensaje
             message = {
                 "type": "ESP_DATA",
                 "device_id": device_id,
                 "data": state
             }
+            if samples:
+                message["samples"] = samples
 
-            # Enviar a cada suscriptor
-            for user_id in subscribers:
-                if user_id in self.frontend_connections:
-                    try:
-                        websocket = self.frontend_connections[user_id]
-                        await websocket.send_json(message)
-                        logger.debug(f"Datos enviados a usuario {user_id}")
-                    except WebSocketDisconnect:
-                        logger.info(f"Cliente {user_id} desconectado durante broadcast")
-                        self.disconnect_frontend(user_id)
-                    except Exception as e:
-                        logger.error(f"Error enviando datos a {user_id}: {str(e)}")
-                        # No desconectar por otros tipos de errores
+            # Serializar una sola vez y compartir el texto entre todos los suscriptores
+            payload = encode_json(message)
+
+            # Encolar para cada suscriptor; el envío lo hace la tarea de cada conexión
+            self._fan_out(device_id, payload)
+            BROADCAST_SECONDS.observe((time.perf_counter() - start) * 1000)
+
+            if self.broker.distributed:
+                # Compartir el frame con los demás workers (ambos comandos van en pipeline)
+                await asyncio.gather(
+                    self.broker.publish(ESP_DATA_CHANNEL + device_id, f"{NODE_ID}\n{payload}"),
+                    self.broker.set(ESP_STATE_KEY + device_id, payload, ESP_STATE_TTL_MS)
+                )
 
         except Exception as e:
             logger.error(f"Error en broadcast_esp_data: {str(e)}")
 
+    def _fan_out(self, device_id: str, payload: str) -> None:
+        for user_id in self.device_subscribers.get(device_id, ()):
+            self.send_to_frontend(user_id, payload, device_id)
+
+    def _on_remote_data(self, channel: str, message: str) -> None:
+        """Entrega a los suscriptores locales un frame ESP_DATA publicado por otro worker."""
+        origin, _, payload = message.partition("\n")
+        if origin == NODE_ID:
+            return
+        device_id = channel[len(ESP_DATA_CHANNEL):]
+        self.esp_states[device_id] = json.loads(payload)["data"]
+        self._fan_out(device_id, payload)
+
+    async def _forward_command(self, device_id: str, command: dict, wait_ack: bool = False) -> Dict:
+        """
+        Reenvía un comando al worker dueño del socket del ESP y espera su resultado.
+
+        Raises:
+            HTTPException: 404 si ningún worker tiene el ESP, 504 si el dueño no
+                responde a tiempo, o el error que reportó el dueño
+        """
+        owner = await self.registry.owner(device_id)
+        if owner is None or owner == NODE_ID:
+            raise HTTPException(status_code=404, detail=f"ESP {device_id} no está conectado")
+
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.forwarded_commands[request_id] = future
+        try:
+            receivers = await self.broker.publish(NODE_COMMAND_CHANNEL + owner, encode_json({
+                "request_id": request_id,
+                "reply_to": NODE_ID,
+                "device_id": device_id,
+                "command": command,
+                "wait_ack": wait_ack
+            }))
+            if not receivers:
+                raise HTTPException(status_code=404, detail=f"ESP {device_id} no está conectado")
+            timeout = COMMAND_FORWARD_TIMEOUT_S
+            if wait_ack:
+                timeout += COMMAND_ACK_TIMEOUT_S * (COMMAND_MAX_RETRIES + 1)
+            reply = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail=f"El worker de {device_id} no respondió en {timeout}s"
+            )
+        finally:
+            self.forwarded_commands.pop(request_id, None)
+
+        if reply["status_code"] != 200:
+            raise HTTPException(status_code=reply["status_code"], detail=reply["detail"])
+        logger.info(f"Comando para {device_id} entregado por el worker {owner}: {command}")
+        return reply["result"]
+
+    def _on_forwarded_command(self, channel: str, message: str) -> None:
+        """Ejecuta un comando que otro worker reenvió para un ESP conectado aquí."""
+        request = json.loads(message)
+        device_id = request["device_id"]
+
+        async def execute():
+            reply = {"request_id": request["request_id"], "status_code": 200, "detail": None, "result": None}
+            if not self.is_connected_esp(device_id):
+                # No reenviar de nuevo: el lease quedó desactualizado
+                reply.update(status_code=404, detail=f"ESP {device_id} no está conectado")
+            else:
+                try:
+                    reply["result"] = await self.send_command_to_esp(
+                        device_id, request["command"], request.get("wait_ack", False)
+                    )
+                except HTTPException as e:
+                    reply.update(status_code=e.status_code, detail=e.detail)
+            await self.broker.publish(NODE_REPLY_CHANNEL + request["reply_to"], encode_json(reply))
+
+        self._broker_task(execute())
+
+    def _on_forward_reply(self, channel: str, message: str) -> None:
+        """Entrega el resultado de un comando reenviado al llamador que lo espera."""
+        reply = json.loads(message)
+        future = self.forwarded_commands.get(reply["request_id"])
+        if future is not None and not future.done():
+            future.set_result(reply)
+
     def get_esp_state(self, device_id: str):
         """Obtiene el último estado conocido de un ESP"""
         return self.esp_states.get(device_id)
 
+    async def fetch_esp_state(self, device_id: str):
+        """
+        Obtiene el último estado de un ESP, consultando el broker si no se
+        conoce localmente (el ESP puede estar conectado a otro worker).
+        """
+        state = self.esp_states.get(device_id)
+        if state is None and self.broker.distributed:
+            payload = await self.broker.get(ESP_STATE_KEY + device_id)
+            if payload is not None:
+                state = json.loads(payload)["data"]
+        return state
+
+    async def fetch_esp_states(self, device_ids: List[str]) -> Dict[str, dict]:
+        """
+        Último estado de varios ESP; los que no se conocen localmente se
+        piden al broker en una sola consulta.
+
+        Returns:
+            Dict por identificador, solo con los ESP que tienen estado
+        """
+        states = {}
+        remote = []
+        for device_id in device_ids:
+            state = self.esp_states.get(device_id)
+            if state is not None:
+                states[device_id] = state
+            else:
+                remote.append(device_id)
+
+        if remote and self.broker.distributed:
+            payloads = await self.broker.get_many([ESP_STATE_KEY + device_id for device_id in remote])
+            for device_id, payload in zip(remote, payloads):
+                if payload is not None:
+                    states[device_id] = json.loads(payload)["data"]
+        return states
+
 # Instancia única
 websocket_manager = ConnectionManager()
\ No newline at end of file
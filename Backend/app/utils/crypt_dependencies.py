@@ -1,21 +1,74 @@
+import asyncio
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import bcrypt
+from dotenv import load_dotenv
+
+from app.models.ErrorsValidator import HashingOverloadedError
+
+load_dotenv()
+
+# Factor de costo de bcrypt para hashes nuevos
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Hilos dedicados a bcrypt (bcrypt libera el GIL mientras calcula)
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Operaciones en curso o en espera antes de rechazar con 503
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "32"))
+
+_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+_pending_lock = threading.Lock()
+
+_ROUNDS_PATTERN = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+async def _run_in_pool(func, *args):
+    """
+    Ejecuta una operación de bcrypt en el pool dedicado sin bloquear el event loop.
+
+    Raises:
+        HashingOverloadedError: Si ya hay BCRYPT_MAX_PENDING operaciones pendientes
+    """
+    global _pending
+    with _pending_lock:
+        if _pending >= BCRYPT_MAX_PENDING:
+            raise HashingOverloadedError(
+                f"Pool de hashing saturado ({_pending} operaciones pendientes)"
+            )
+        _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+def _hash(password: str) -> str:
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
 
-def crypt_password(password):
+async def crypt_password(password):
     """
-    Hashea una contraseña utilizando bcrypt.
+    Hashea una contraseña utilizando bcrypt en el pool dedicado.
     
     Args:
         password (str): Contraseña a hashear.
     
     Returns:
         str: Contraseña hasheada.
+
+    Raises:
+        HashingOverloadedError: Si el pool de hashing está saturado.
     """
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+    return await _run_in_pool(_hash, password)
 
-def crypt_verify_password(password, hashed_password):
+async def crypt_verify_password(password, hashed_password):
     """
-    Verifica si una contraseña coincide con la hasheada.
+    Verifica si una contraseña coincide con la hasheada, en el pool dedicado.
     
     Args:
         password (str): Contraseña a verificar.
@@ -23,5 +76,30 @@ def crypt_verify_password(password, hashed_password):
         
     Returns:
         bool: True si la contraseña coincide, False si no.
+
+    Raises:
+        HashingOverloadedError: Si el pool de hashing está saturado.
     """
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return await _run_in_pool(_verify, password, hashed_password)
+
+def crypt_needs_rehash(hashed_password):
+    """
+    Indica si un hash fue generado con un costo distinto a BCRYPT_ROUNDS.
+    
+    Args:
+        hashed_password (str): Contraseña hasheada.
+        
+    Returns:
+        bool: True si conviene volver a hashear la contraseña.
+    """
+    match = _ROUNDS_PATTERN.match(hashed_password or "")
+    return match is None or int(match.group(1)) != BCRYPT_ROUNDS
+
+def crypt_pool_stats():
+    """Estado del pool de hashing."""
+    return {
+        "workers": BCRYPT_WORKERS,
+        "pending": _pending,
+        "max_pending": BCRYPT_MAX_PENDING,
+        "rounds": BCRYPT_ROUNDS
+    }
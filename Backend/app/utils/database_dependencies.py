@@ -1,5 +1,6 @@
-from typing import Generator
+from typing import Generator, AsyncGenerator
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.database import database
 
 # Dependency para obtener una sesión de base de datos
@@ -36,3 +37,38 @@ def get_transactional_db() -> Generator[Session, None, None]:
         raise
     finally:
         session.close()
+
+# Dependency para obtener una sesión asíncrona (no bloquea el event loop)
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency para obtener una sesión asíncrona de base de datos.
+    
+    Yields:
+        AsyncSession: Sesión asíncrona de SQLAlchemy
+    """
+    session = database._AsyncSessionFactory()
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+# Dependency para obtener una sesión asíncrona con commit al finalizar
+async def get_async_transactional_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency para obtener una sesión asíncrona con manejo de transacciones.
+    
+    Yields:
+        AsyncSession: Sesión asíncrona de SQLAlchemy
+    """
+    session = database._AsyncSessionFactory()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
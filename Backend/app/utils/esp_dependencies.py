@@ -1,17 +1,51 @@
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import mysql, sqlite
 from sqlalchemy.orm import Session
 from datetime import datetime
+from typing import Dict, Iterable, List, Optional
 import logging
+import os
 
-from app.utils.database_dependencies import get_transactional_db
-from app.models.EspData import EspValidationExistRequest
+from app.models.EspData import EspData, EspValidationExistRequest
 from app.database.modelsDB import Esp, User, Usuario_Esp
+from app.utils.TTLCache import TTLCache
+from app.utils.sensor_dependencies import reading_row, insert_readings
+from app.utils.rollup_dependencies import upsert_rollups
 
 logger = logging.getLogger("app.esp_utils")
 
+# Caché de validación de ESP y de acceso usuario-dispositivo
+ESP_CACHE_MAX_SIZE = int(os.getenv("ESP_CACHE_MAX_SIZE", "10000"))
+ESP_CACHE_TTL_S = float(os.getenv("ESP_CACHE_TTL_S", "300"))
+# Los resultados negativos expiran antes por si el cambio llega por otra vía
+ESP_CACHE_NEGATIVE_TTL_S = float(os.getenv("ESP_CACHE_NEGATIVE_TTL_S", "30"))
+
+esp_validation_cache = TTLCache(ESP_CACHE_MAX_SIZE, ESP_CACHE_TTL_S, name="esp_validation")
+device_access_cache = TTLCache(ESP_CACHE_MAX_SIZE, ESP_CACHE_TTL_S, name="device_access")
+
+def invalidate_esp_cache(device_id: str) -> None:
+    """Invalida la validación y los permisos en caché de un ESP (p. ej. al cambiar su asociación)."""
+    esp_validation_cache.invalidate(device_id)
+    device_access_cache.invalidate_matching(lambda key: key[1] == device_id)
+
+def esp_cache_stats() -> Dict:
+    """Estadísticas de aciertos y fallos de las cachés de ESP."""
+    return {
+        "esp_validation": esp_validation_cache.stats(),
+        "device_access": device_access_cache.stats()
+    }
+
 def EspValidationExists(device_id: str, db: Session):
     try:
         start_time = datetime.now()
-        
+
+        cached = esp_validation_cache.get(device_id)
+        if cached is not None:
+            return {
+                **cached,
+                "response_time_seconds": (datetime.now() - start_time).total_seconds()
+            }
+
         # Consulta optimizada que une las tres tablas
         result = (
             db.query(
@@ -25,44 +59,202 @@ def EspValidationExists(device_id: str, db: Session):
             .first()
         )
 
-        response_time = (datetime.now() - start_time).total_seconds()
-
         if result:
             # ESP encontrado y asociado
             logger.info(f"ESP {device_id} encontrado y asociado al usuario {result.user_name}")
-            return {
+            validation = {
                 "status": "success",
                 "is_associated": True,
                 "esp_id": result.Esp.id,
                 "user_id": result.user_id,
                 "user_name": result.user_name,
-                "identification": result.Esp.identification,
-                "response_time_seconds": response_time
+                "identification": result.Esp.identification
             }
         else:
             # Verificar si el ESP existe pero no está asociado
             esp = db.query(Esp).filter(
                 Esp.identification == device_id
             ).first()
-            
+
             if esp:
                 logger.info(f"ESP {device_id} encontrado pero no asociado a ningún usuario")
-                return {
+                validation = {
                     "status": "success",
                     "is_associated": False,
                     "esp_id": esp.id,
-                    "message": "ESP existe pero no está asociado a ningún usuario",
-                    "response_time_seconds": response_time
+                    "message": "ESP existe pero no está asociado a ningún usuario"
                 }
             else:
                 logger.info(f"ESP {device_id} no encontrado en el sistema")
-                return {
+                validation = {
                     "status": "success",
                     "is_associated": False,
-                    "message": "ESP no encontrado en el sistema",
-                    "response_time_seconds": response_time
+                    "message": "ESP no encontrado en el sistema"
                 }
+
+        esp_validation_cache.set(
+            device_id,
+            validation,
+            ttl=None if validation["is_associated"] else ESP_CACHE_NEGATIVE_TTL_S
+        )
+        return {
+            **validation,
+            "response_time_seconds": (datetime.now() - start_time).total_seconds()
+        }
     except Exception as e:
         logger.error(f"Error al validar asociación del ESP {device_id}: {str(e)}", exc_info=True)
-        raise f"{str(e)}"
-        
\ No newline at end of file
+        raise
+
+def user_has_device_access(db: Session, user_name: str, device_id: str) -> bool:
+    """
+    Verifica si un usuario tiene acceso a un dispositivo, con caché por (usuario, dispositivo).
+    """
+    key = (user_name, device_id)
+    allowed = device_access_cache.get(key)
+    if allowed is not None:
+        return allowed
+
+    usuario_esp = (
+        db.query(Usuario_Esp.id)
+        .join(Esp)
+        .join(User)
+        .filter(
+            Esp.identification == device_id,
+            User.name == user_name
+        )
+        .first()
+    )
+    allowed = usuario_esp is not None
+    device_access_cache.set(key, allowed, ttl=None if allowed else ESP_CACHE_NEGATIVE_TTL_S)
+    return allowed
+
+def user_device_ids(db: Session, user_name: str, device_ids: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Dispositivos a los que un usuario tiene acceso, resueltos en una sola consulta.
+
+    Con ``device_ids`` se filtran los pedidos (los que ya están en la caché
+    de acceso no se consultan); sin ellos se devuelven todos los del usuario.
+    El resultado también llena la caché de ``user_has_device_access``.
+
+    Returns:
+        Lista de identificadores permitidos, en el orden pedido
+    """
+    query = (
+        select(Esp.identification)
+        .join(Usuario_Esp, Esp.id == Usuario_Esp.id_esp)
+        .join(User, Usuario_Esp.id_user == User.id)
+        .where(User.name == user_name)
+    )
+    if device_ids is None:
+        allowed = list(dict.fromkeys(db.scalars(query)))
+        for device_id in allowed:
+            device_access_cache.set((user_name, device_id), True)
+        return allowed
+
+    requested = list(dict.fromkeys(device_ids))
+    cached = {device_id: device_access_cache.get((user_name, device_id)) for device_id in requested}
+    pending = [device_id for device_id, allowed in cached.items() if allowed is None]
+    if pending:
+        found = set(db.scalars(query.where(Esp.identification.in_(pending))))
+        for device_id in pending:
+            allowed = device_id in found
+            cached[device_id] = allowed
+            device_access_cache.set((user_name, device_id), allowed, ttl=None if allowed else ESP_CACHE_NEGATIVE_TTL_S)
+    return [device_id for device_id in requested if cached[device_id]]
+
+# Resultado de cada dispositivo en el registro por lotes
+REGISTER_CREATED = "created"
+REGISTER_UPDATED = "updated"
+REGISTER_USER_NOT_FOUND = "user_not_found"
+
+def _upsert_esps(db: Session, values: List[Dict]) -> None:
+    """INSERT de ESP que actualiza json_sensores si el identificador ya existe."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql.insert(Esp)
+        stmt = stmt.on_duplicate_key_update(json_sensores=stmt.inserted.json_sensores)
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(Esp)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["identification"], set_={"json_sensores": stmt.excluded.json_sensores}
+        )
+    else:
+        raise ValueError(f"Upsert de ESP no soportado para {dialect}")
+    db.execute(stmt, values)
+
+def _insert_associations(db: Session, values: List[Dict]) -> None:
+    """INSERT de asociaciones usuario-ESP que ignora las que ya existen (registro concurrente)."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        # Asignación sin efecto en lugar de INSERT IGNORE, que también
+        # convertiría en advertencias los errores de FK o de datos
+        stmt = mysql.insert(Usuario_Esp).on_duplicate_key_update(id=Usuario_Esp.id)
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(Usuario_Esp).on_conflict_do_nothing(index_elements=["id_user", "id_esp"])
+    else:
+        stmt = insert(Usuario_Esp)
+    db.execute(stmt, values)
+
+def register_esps(db: Session, devices: List[EspData]) -> List[Dict]:
+    """
+    Registra o actualiza varios ESP con sentencias por conjunto.
+
+    Usuarios, ESP y asociaciones existentes se resuelven con consultas
+    ``IN``; los ESP se escriben con un solo upsert, las asociaciones que
+    faltan y las lecturas iniciales con INSERT multi-fila. Si un
+    identificador se repite, gana la última aparición.
+
+    Returns:
+        Lista con el resultado de cada dispositivo, en el orden recibido
+    """
+    if not devices:
+        return []
+
+    identifications = {device.identification for device in devices}
+    existing_users = set(db.scalars(select(User.id).where(User.id.in_({device.user for device in devices}))))
+    existing_esps = set(db.scalars(select(Esp.identification).where(Esp.identification.in_(identifications))))
+
+    # Último dato por identificador entre los que tienen un usuario válido
+    latest = {device.identification: device for device in devices if device.user in existing_users}
+    if latest:
+        _upsert_esps(db, [
+            {"identification": identification, "json_sensores": {"current": device.sensors_data}}
+            for identification, device in latest.items()
+        ])
+
+    esp_ids = dict(db.execute(
+        select(Esp.identification, Esp.id).where(Esp.identification.in_(latest.keys()))
+    ).all()) if latest else {}
+
+    # Asociaciones usuario-ESP que faltan
+    pairs = {(device.user, esp_ids[device.identification]) for device in devices if device.identification in latest}
+    if pairs:
+        associated = set(db.execute(
+            select(Usuario_Esp.id_user, Usuario_Esp.id_esp).where(Usuario_Esp.id_esp.in_(esp_ids.values()))
+        ).all())
+        missing = pairs - associated
+        if missing:
+            _insert_associations(db, [{"id_user": user_id, "id_esp": esp_id} for user_id, esp_id in missing])
+
+    # La lectura enviada al registrar se guarda en el histórico y sus rollups
+    rows = [reading_row(esp_ids[identification], device.sensors_data) for identification, device in latest.items()]
+    insert_readings(db, rows)
+    upsert_rollups(db, rows)
+
+    results = []
+    for device in devices:
+        if device.user not in existing_users:
+            results.append({
+                "identification": device.identification,
+                "user_id": device.user,
+                "status": REGISTER_USER_NOT_FOUND,
+                "message": f"Usuario con ID {device.user} no encontrado"
+            })
+            continue
+        results.append({
+            "identification": device.identification,
+            "user_id": device.user,
+            "esp_id": esp_ids[device.identification],
+            "status": REGISTER_UPDATED if device.identification in existing_esps else REGISTER_CREATED
+        })
+    return results
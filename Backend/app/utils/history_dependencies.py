@@ -0,0 +1,270 @@
+from sqlalchemy import Select, and_, func, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import AsyncIterator, Dict, Optional, Tuple, Type
+import math
+import os
+import re
+
+from app.database.modelsDB import SensorReading, SensorRollupMixin
+from app.utils.rollup_dependencies import ROLLUP_NAMES, rollup_for
+from app.utils.json_dependencies import encode_json
+from app.utils.sensor_dependencies import to_epoch_ms
+
+# Buckets por defecto (resolution=auto) y máximo aceptado por consulta
+HISTORY_DEFAULT_BUCKETS = int(os.getenv("HISTORY_DEFAULT_BUCKETS", "500"))
+HISTORY_MAX_BUCKETS = int(os.getenv("HISTORY_MAX_BUCKETS", "2000"))
+# Rango por defecto cuando no se indica "from"
+HISTORY_DEFAULT_RANGE_MS = 24 * 3600 * 1000
+# Buckets que se serializan y envían juntos en cada chunk de la respuesta
+HISTORY_STREAM_CHUNK = int(os.getenv("HISTORY_STREAM_CHUNK", "500"))
+
+RESOLUTION_UNITS_MS = {"ms": 1, "s": 1000, "m": 60 * 1000, "h": 3600 * 1000, "d": 24 * 3600 * 1000}
+RESOLUTION_PATTERN = re.compile(r"^(\d+)(ms|s|m|h|d)?$")
+
+FORMAT_NDJSON = "ndjson"
+FORMAT_JSON = "json"
+MEDIA_TYPES = {FORMAT_NDJSON: "application/x-ndjson", FORMAT_JSON: "application/json"}
+
+
+def parse_time(value: Optional[str], default: int) -> int:
+    """
+    Convierte un parámetro de tiempo (epoch en ms o ISO 8601) a epoch ms.
+
+    Raises:
+        ValueError: Si el valor no es un epoch ni una fecha ISO válida
+    """
+    if value is None or value == "":
+        return default
+    if value.isdigit():
+        return int(value)
+    return to_epoch_ms(value)
+
+def parse_resolution(resolution: Optional[str]) -> Optional[int]:
+    """
+    Convierte la resolución pedida a milisegundos (None para "auto").
+
+    Acepta un número con unidad opcional: ``500ms``, ``30s``, ``5m``, ``1h``,
+    ``1d``; sin unidad se interpreta en segundos.
+
+    Raises:
+        ValueError: Si el formato no es válido
+    """
+    if resolution is None or resolution in ("", "auto"):
+        return None
+    match = RESOLUTION_PATTERN.match(resolution.strip().lower())
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError(f"Resolución inválida: {resolution}")
+    return int(match.group(1)) * RESOLUTION_UNITS_MS[match.group(2) or "s"]
+
+def bucket_size_ms(from_ms: int, to_ms: int, resolution_ms: Optional[int]) -> int:
+    """
+    Tamaño del bucket para el rango pedido.
+
+    Con resolución automática se apunta a HISTORY_DEFAULT_BUCKETS; una
+    resolución explícita demasiado fina se agranda para no superar
+    HISTORY_MAX_BUCKETS.
+    """
+    span = max(to_ms - from_ms, 1)
+    if resolution_ms is None:
+        resolution_ms = math.ceil(span / HISTORY_DEFAULT_BUCKETS)
+    return max(resolution_ms, math.ceil(span / HISTORY_MAX_BUCKETS), 1)
+
+def history_plan(from_ms: int, to_ms: int, resolution_ms: Optional[int]) -> Tuple[int, Optional[Tuple[int, Type[SensorRollupMixin]]]]:
+    """
+    Elige el tamaño del bucket y la fuente de datos.
+
+    Se usa el rollup más grueso que no supere el bucket pedido; el bucket se
+    redondea a un múltiplo de su granularidad para combinar buckets enteros.
+    Por debajo de un minuto se agregan las lecturas crudas.
+
+    Returns:
+        Tuple con el tamaño del bucket en ms y el rollup (granularidad, tabla) o None
+    """
+    bucket_ms = bucket_size_ms(from_ms, to_ms, resolution_ms)
+    rollup = rollup_for(bucket_ms)
+    if rollup is not None:
+        granularity = rollup[0]
+        bucket_ms = math.ceil(bucket_ms / granularity) * granularity
+    return bucket_ms, rollup
+
+def source_name(rollup: Optional[Tuple[int, Type[SensorRollupMixin]]]) -> str:
+    return "raw" if rollup is None else ROLLUP_NAMES[rollup[0]]
+
+def rollup_query(esp_id: int, from_ms: int, to_ms: int, bucket_ms: int, granularity: int, model: Type[SensorRollupMixin]) -> Select:
+    """
+    Consulta que combina buckets de un rollup en buckets de ``bucket_ms``.
+
+    Los extremos del rango se redondean a la granularidad del rollup. El
+    promedio se calcula como suma / cantidad y el último valor sale del
+    bucket del rollup con la lectura más reciente.
+    """
+    size = literal_column(str(int(bucket_ms)))
+    bucket = model.bucket_ts - model.bucket_ts % size
+
+    buckets = (
+        select(
+            bucket.label("bucket"),
+            func.sum(model.count).label("count"),
+            func.min(model.temperature_min).label("temperature_min"),
+            func.max(model.temperature_max).label("temperature_max"),
+            (func.sum(model.temperature_sum) / func.nullif(func.sum(model.temperature_count), 0)).label("temperature_avg"),
+            func.min(model.humidity_min).label("humidity_min"),
+            func.max(model.humidity_max).label("humidity_max"),
+            (func.sum(model.humidity_sum) / func.nullif(func.sum(model.humidity_count), 0)).label("humidity_avg"),
+            func.max(model.last_ts).label("last_ts")
+        )
+        .where(
+            model.esp_id == esp_id,
+            model.bucket_ts >= from_ms - from_ms % granularity,
+            model.bucket_ts < to_ms
+        )
+        .group_by(bucket)
+        .subquery()
+    )
+
+    last = model.__table__.alias("last_rollup")
+    return (
+        select(buckets, last.c.temperature_last, last.c.humidity_last)
+        .join(last, and_(
+            last.c.esp_id == esp_id,
+            last.c.bucket_ts >= buckets.c.bucket,
+            last.c.bucket_ts < buckets.c.bucket + size,
+            last.c.last_ts == buckets.c.last_ts
+        ))
+        .order_by(buckets.c.bucket)
+    )
+
+def history_query(esp_id: int, from_ms: int, to_ms: int, bucket_ms: int) -> Select:
+    """
+    Consulta que agrega las lecturas por bucket en la base de datos.
+
+    Cada bucket trae mínimo, máximo y promedio; el último valor se obtiene
+    uniendo con la lectura de mayor ``ts`` del bucket, que se busca por el
+    índice (esp_id, ts).
+    """
+    # El tamaño del bucket es un entero calculado aquí, se incrusta en el SQL
+    # para que SELECT y GROUP BY usen exactamente la misma expresión
+    size = literal_column(str(int(bucket_ms)))
+    bucket = SensorReading.ts - SensorReading.ts % size
+
+    buckets = (
+        select(
+            bucket.label("bucket"),
+            func.count().label("count"),
+            func.min(SensorReading.temperature).label("temperature_min"),
+            func.max(SensorReading.temperature).label("temperature_max"),
+            func.avg(SensorReading.temperature).label("temperature_avg"),
+            func.min(SensorReading.humidity).label("humidity_min"),
+            func.max(SensorReading.humidity).label("humidity_max"),
+            func.avg(SensorReading.humidity).label("humidity_avg"),
+            func.max(SensorReading.ts).label("last_ts")
+        )
+        .where(
+            SensorReading.esp_id == esp_id,
+            SensorReading.ts >= from_ms,
+            SensorReading.ts < to_ms
+        )
+        .group_by(bucket)
+        .subquery()
+    )
+
+    last = SensorReading.__table__.alias("last_reading")
+    return (
+        select(buckets, last.c.temperature.label("temperature_last"), last.c.humidity.label("humidity_last"))
+        .join(last, and_(last.c.esp_id == esp_id, last.c.ts == buckets.c.last_ts))
+        .order_by(buckets.c.bucket)
+    )
+
+def _round(value) -> Optional[float]:
+    return None if value is None else round(float(value), 2)
+
+def bucket_row(row) -> Dict:
+    return {
+        "ts": int(row.bucket),
+        "count": int(row.count),
+        "temperature": {
+            "min": _round(row.temperature_min),
+            "max": _round(row.temperature_max),
+            "avg": _round(row.temperature_avg),
+            "last": _round(row.temperature_last)
+        },
+        "humidity": {
+            "min": _round(row.humidity_min),
+            "max": _round(row.humidity_max),
+            "avg": _round(row.humidity_avg),
+            "last": _round(row.humidity_last)
+        }
+    }
+
+async def iter_buckets(
+    db: AsyncSession,
+    esp_id: int,
+    from_ms: int,
+    to_ms: int,
+    bucket_ms: int,
+    rollup: Optional[Tuple[int, Type[SensorRollupMixin]]] = None
+) -> AsyncIterator[list]:
+    """
+    Lee los buckets con un cursor del lado del servidor y los entrega en
+    grupos de HISTORY_STREAM_CHUNK, sin cargar el resultado completo.
+    """
+    if rollup is None:
+        query = history_query(esp_id, from_ms, to_ms, bucket_ms)
+    else:
+        query = rollup_query(esp_id, from_ms, to_ms, bucket_ms, *rollup)
+    result = await db.stream(query)
+    previous = None
+    async for partition in result.partitions(HISTORY_STREAM_CHUNK):
+        chunk = []
+        for row in partition:
+            # Dos lecturas con el mismo ts al final del bucket lo repetirían
+            if row.bucket == previous:
+                continue
+            previous = row.bucket
+            chunk.append(bucket_row(row))
+        if chunk:
+            yield chunk
+
+async def stream_history(
+    db: AsyncSession,
+    header: Dict,
+    esp_id: int,
+    from_ms: int,
+    to_ms: int,
+    bucket_ms: int,
+    rollup: Optional[Tuple[int, Type[SensorRollupMixin]]] = None,
+    output_format: str = FORMAT_NDJSON
+) -> AsyncIterator[str]:
+    """
+    Genera el cuerpo de la respuesta por partes.
+
+    - ndjson: una línea JSON por bucket
+    - json: un objeto con los datos de ``header`` y el arreglo ``buckets``,
+      escrito de forma incremental
+    """
+    if output_format == FORMAT_JSON:
+        yield encode_json(header)[:-1] + ',"buckets":['
+        first = True
+        async for chunk in iter_buckets(db, esp_id, from_ms, to_ms, bucket_ms, rollup):
+            body = ",".join(encode_json(bucket) for bucket in chunk)
+            yield body if first else "," + body
+            first = False
+        yield "]}"
+        return
+
+    async for chunk in iter_buckets(db, esp_id, from_ms, to_ms, bucket_ms, rollup):
+        yield "".join(encode_json(bucket) + "\n" for bucket in chunk)
+
+def history_range(from_param: Optional[str], to_param: Optional[str]) -> Tuple[int, int]:
+    """
+    Resuelve el rango [from, to) en epoch ms; por defecto las últimas 24 horas.
+
+    Raises:
+        ValueError: Si algún extremo es inválido o el rango está vacío
+    """
+    to_ms = parse_time(to_param, int(datetime.now().timestamp() * 1000))
+    from_ms = parse_time(from_param, to_ms - HISTORY_DEFAULT_RANGE_MS)
+    if from_ms >= to_ms:
+        raise ValueError("'from' debe ser anterior a 'to'")
+    return from_ms, to_ms
@@ -0,0 +1,45 @@
+import json
+from typing import Any
+
+# orjson es opcional: si está instalado se usa para serializar los mensajes
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+def encode_json(message: Any) -> str:
+    """
+    Serializa un mensaje a texto JSON compacto.
+
+    Usa orjson si está disponible y la librería estándar en caso contrario.
+    Los datetime se serializan en formato ISO 8601 con ambos backends.
+
+    Args:
+        message: Mensaje a serializar
+
+    Returns:
+        str: Texto JSON listo para enviarse como frame de texto
+    """
+    if orjson is not None:
+        return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=_default)
+
+def _default(value: Any) -> Any:
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Objeto de tipo {type(value).__name__} no serializable a JSON")
+
+def decode_json(data: Any) -> Any:
+    """
+    Deserializa un frame JSON (texto o bytes).
+
+    Usa orjson si está disponible y la librería estándar en caso contrario.
+
+    Raises:
+        ValueError: Si el contenido no es JSON válido
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
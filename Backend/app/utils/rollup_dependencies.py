@@ -0,0 +1,233 @@
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+import argparse
+import logging
+import math
+import time
+
+from app.database.modelsDB import (
+    SensorReading, SensorRollupMixin, SensorRollupMinute, SensorRollupHour, SensorRollupDay
+)
+
+logger = logging.getLogger("app.rollups")
+
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+DAY_MS = 24 * HOUR_MS
+
+# Granularidades de menor a mayor: (tamaño del bucket en ms, tabla)
+ROLLUP_TABLES: Tuple[Tuple[int, Type[SensorRollupMixin]], ...] = (
+    (MINUTE_MS, SensorRollupMinute),
+    (HOUR_MS, SensorRollupHour),
+    (DAY_MS, SensorRollupDay)
+)
+ROLLUP_NAMES = {MINUTE_MS: "rollup_1m", HOUR_MS: "rollup_1h", DAY_MS: "rollup_1d"}
+
+METRICS = ("temperature", "humidity")
+# Filas por sentencia de upsert / lecturas por bloque al reconstruir
+UPSERT_CHUNK_SIZE = 1000
+REBUILD_CHUNK_SIZE = 50000
+
+
+def rollup_for(bucket_ms: int) -> Optional[Tuple[int, Type[SensorRollupMixin]]]:
+    """Rollup más grueso cuya granularidad no supera el bucket pedido (None: usar las lecturas)."""
+    chosen = None
+    for granularity, model in ROLLUP_TABLES:
+        if granularity <= bucket_ms:
+            chosen = (granularity, model)
+    return chosen
+
+def _metric_value(value) -> Optional[float]:
+    """Valor que entra en los agregados: solo números reales finitos."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    return value
+
+def aggregate_rows(rows: Iterable[Dict], granularity: int) -> List[Dict]:
+    """
+    Agrega filas de sensor_reading (las de ``reading_row``) por ESP y bucket.
+
+    Los valores que no son números finitos cuentan como NULL, así una lectura
+    mal formada no hace fallar el upsert de todo el lote.
+
+    Returns:
+        Filas parciales del rollup listas para ``upsert_rollups``
+    """
+    buckets: Dict[Tuple[int, int], Dict] = {}
+    for row in rows:
+        ts = row["ts"]
+        values = {metric: _metric_value(row[metric]) for metric in METRICS}
+        key = (row["esp_id"], ts - ts % granularity)
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {"esp_id": key[0], "bucket_ts": key[1], "count": 0, "last_ts": ts}
+            for metric in METRICS:
+                bucket.update({
+                    f"{metric}_count": 0, f"{metric}_sum": 0.0,
+                    f"{metric}_min": None, f"{metric}_max": None, f"{metric}_last": values[metric]
+                })
+        bucket["count"] += 1
+        newest = ts >= bucket["last_ts"]
+        if newest:
+            bucket["last_ts"] = ts
+        for metric in METRICS:
+            value = values[metric]
+            if newest:
+                bucket[f"{metric}_last"] = value
+            if value is None:
+                continue
+            bucket[f"{metric}_count"] += 1
+            bucket[f"{metric}_sum"] += value
+            low, high = bucket[f"{metric}_min"], bucket[f"{metric}_max"]
+            bucket[f"{metric}_min"] = value if low is None or value < low else low
+            bucket[f"{metric}_max"] = value if high is None or value > high else high
+    return list(buckets.values())
+
+def _upsert_statement(dialect: str, model: Type[SensorRollupMixin]):
+    """
+    INSERT que combina el bucket nuevo con el existente.
+
+    Los mínimos y máximos ignoran NULL; el último valor solo se reemplaza si
+    la lectura nueva es igual o más reciente.
+    """
+    table = model.__table__
+    if dialect == "mysql":
+        stmt = mysql.insert(table)
+        new = stmt.inserted
+        least, greatest = func.least, func.greatest
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(table)
+        new = stmt.excluded
+        # En SQLite min()/max() con varios argumentos son escalares
+        least, greatest = func.min, func.max
+    else:
+        raise ValueError(f"Upsert de rollups no soportado para {dialect}")
+
+    newer = new.last_ts >= table.c.last_ts
+    assignments = [("count", table.c.count + new.count)]
+    for metric in METRICS:
+        current_min, new_min = table.c[f"{metric}_min"], new[f"{metric}_min"]
+        current_max, new_max = table.c[f"{metric}_max"], new[f"{metric}_max"]
+        assignments += [
+            (f"{metric}_count", table.c[f"{metric}_count"] + new[f"{metric}_count"]),
+            (f"{metric}_sum", table.c[f"{metric}_sum"] + new[f"{metric}_sum"]),
+            (f"{metric}_min", least(func.coalesce(current_min, new_min), func.coalesce(new_min, current_min))),
+            (f"{metric}_max", greatest(func.coalesce(current_max, new_max), func.coalesce(new_max, current_max))),
+            (f"{metric}_last", case((newer, new[f"{metric}_last"]), else_=table.c[f"{metric}_last"]))
+        ]
+    # MySQL aplica las asignaciones en orden: last_ts va después de los *_last
+    assignments.append(("last_ts", case((newer, new.last_ts), else_=table.c.last_ts)))
+
+    if dialect == "mysql":
+        return stmt.on_duplicate_key_update(assignments)
+    return stmt.on_conflict_do_update(index_elements=["esp_id", "bucket_ts"], set_=dict(assignments))
+
+def upsert_rollups(db: Session, rows: List[Dict]) -> int:
+    """
+    Actualiza los rollups de minuto, hora y día con lecturas nuevas.
+
+    Se llama en la misma transacción que inserta las lecturas, así que el
+    histórico y sus agregados se confirman juntos.
+
+    Returns:
+        int: Cantidad de buckets escritos
+    """
+    if not rows:
+        return 0
+    dialect = db.get_bind().dialect.name
+    written = 0
+    for granularity, model in ROLLUP_TABLES:
+        partials = aggregate_rows(rows, granularity)
+        stmt = _upsert_statement(dialect, model)
+        for start in range(0, len(partials), UPSERT_CHUNK_SIZE):
+            db.execute(stmt, partials[start:start + UPSERT_CHUNK_SIZE])
+        written += len(partials)
+    return written
+
+def rebuild_rollups(
+    db: Session,
+    esp_ids: Optional[Iterable[int]] = None,
+    from_ms: Optional[int] = None,
+    to_ms: Optional[int] = None
+) -> int:
+    """
+    Reconstruye los rollups a partir de sensor_reading.
+
+    El rango se amplía a días completos para que todos los buckets afectados
+    se recalculen enteros; los rollups del rango se borran y se vuelven a
+    llenar leyendo las lecturas por bloques de id. Las lecturas que se
+    ingieran mientras corre pueden quedar contadas dos veces, así que se
+    debe usar sobre rangos pasados o con la ingesta detenida.
+
+    Returns:
+        int: Cantidad de lecturas procesadas
+    """
+    if from_ms is not None:
+        from_ms -= from_ms % DAY_MS
+    if to_ms is not None and to_ms % DAY_MS:
+        to_ms += DAY_MS - to_ms % DAY_MS
+
+    def in_range(ts_column, esp_column):
+        conditions = []
+        if esp_ids is not None:
+            conditions.append(esp_column.in_(list(esp_ids)))
+        if from_ms is not None:
+            conditions.append(ts_column >= from_ms)
+        if to_ms is not None:
+            conditions.append(ts_column < to_ms)
+        return conditions
+
+    for _, model in ROLLUP_TABLES:
+        db.execute(delete(model).where(*in_range(model.bucket_ts, model.esp_id)))
+
+    processed = 0
+    last_id = 0
+    columns = (SensorReading.id, SensorReading.esp_id, SensorReading.ts,
+               SensorReading.temperature, SensorReading.humidity)
+    while True:
+        chunk = db.execute(
+            select(*columns)
+            .where(SensorReading.id > last_id, *in_range(SensorReading.ts, SensorReading.esp_id))
+            .order_by(SensorReading.id)
+            .limit(REBUILD_CHUNK_SIZE)
+        ).mappings().all()
+        if not chunk:
+            break
+        upsert_rollups(db, chunk)
+        processed += len(chunk)
+        last_id = chunk[-1]["id"]
+        logger.info(f"Rollups reconstruidos con {processed} lecturas")
+    return processed
+
+
+def main():
+    from app.database.database import database
+    from app.utils.sensor_dependencies import resolve_esp_ids, to_epoch_ms
+
+    parser = argparse.ArgumentParser(description="Reconstruye los rollups de lecturas (1m, 1h, 1d)")
+    parser.add_argument("--device", action="append", help="Identificador del ESP (se puede repetir); por defecto todos")
+    parser.add_argument("--from", dest="from_ts", help="Inicio (epoch ms o ISO 8601), se redondea al día")
+    parser.add_argument("--to", dest="to_ts", help="Fin exclusivo (epoch ms o ISO 8601), se redondea al día")
+    args = parser.parse_args()
+
+    def parse(value: Optional[str]) -> Optional[int]:
+        if value is None:
+            return None
+        return int(value) if value.isdigit() else to_epoch_ms(value)
+
+    start = time.perf_counter()
+    with database.session() as db:
+        esp_ids = None
+        if args.device:
+            found = resolve_esp_ids(db, args.device)
+            missing = set(args.device) - set(found)
+            if missing:
+                parser.error(f"ESP no encontrados: {', '.join(sorted(missing))}")
+            esp_ids = found.values()
+        processed = rebuild_rollups(db, esp_ids, parse(args.from_ts), parse(args.to_ts))
+    print(f"Rollups reconstruidos: {processed} lecturas en {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+import logging
+import math
+
+from app.database.modelsDB import Esp, SensorReading
+
+logger = logging.getLogger("app.sensor_utils")
+
+# Columnas tipadas de sensor_reading; el resto de valores va a "extra"
+READING_COLUMNS = ("temperature", "humidity")
+# Filas por sentencia INSERT multi-fila
+INSERT_CHUNK_SIZE = 2000
+
+def to_epoch_ms(value: Any) -> int:
+    """
+    Convierte una marca de tiempo a epoch en milisegundos.
+
+    Acepta epoch (int/float en ms), cadenas ISO 8601, datetime o None (ahora).
+    """
+    if value is None:
+        return int(datetime.now().timestamp() * 1000)
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(datetime.fromisoformat(str(value)).timestamp() * 1000)
+
+def reading_ts(value: Any) -> int:
+    """
+    Epoch ms de la marca de tiempo enviada con una lectura.
+
+    El valor viene del dispositivo o del cliente y puede ser cualquier cosa:
+    si no es un epoch ni una fecha ISO 8601 se usa la hora de recepción, para
+    que una marca inválida no haga fallar el lote completo.
+    """
+    try:
+        return to_epoch_ms(value)
+    except (TypeError, ValueError, OverflowError):
+        logger.warning(f"Marca de tiempo inválida {value!r}, se usa la hora de recepción")
+        return to_epoch_ms(None)
+
+def reading_value(value: Any) -> Optional[float]:
+    """
+    Valor de una columna tipada (temperature, humidity) como float.
+
+    Acepta números y cadenas numéricas; lo demás (objetos, booleanos, NaN o
+    infinito) se guarda como NULL para que una lectura mal formada no haga
+    fallar el lote completo.
+    """
+    if value is None:
+        return None
+    number = None
+    if not isinstance(value, bool):
+        try:
+            number = float(value)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    if number is None or not math.isfinite(number):
+        logger.warning(f"Valor de sensor inválido {value!r}, se guarda como NULL")
+        return None
+    return number
+
+def reading_row(esp_id: int, sensor_data: Dict, ts: Any = None) -> Dict:
+    """
+    Construye la fila de sensor_reading para una lectura.
+
+    Args:
+        esp_id: ID del ESP en la base de datos
+        sensor_data: Valores enviados por el sensor
+        ts: Marca de tiempo de la lectura; si no se indica se usa la del sensor
+            (la hora de recepción si no se puede interpretar)
+
+    Returns:
+        Dict listo para un INSERT multi-fila
+    """
+    if ts is None:
+        ts = sensor_data.get("timestamp")
+    extra = {
+        key: value for key, value in sensor_data.items()
+        if key not in READING_COLUMNS and key != "timestamp"
+    }
+    return {
+        "esp_id": esp_id,
+        "ts": reading_ts(ts),
+        "temperature": reading_value(sensor_data.get("temperature")),
+        "humidity": reading_value(sensor_data.get("humidity")),
+        "extra": extra or None
+    }
+
+def resolve_esp_ids(db: Session, identifications: Iterable[str]) -> Dict[str, int]:
+    """Obtiene en una sola consulta el ID de cada ESP a partir de su identificador."""
+    identifications = set(identifications)
+    if not identifications:
+        return {}
+    rows = db.execute(
+        select(Esp.identification, Esp.id).where(Esp.identification.in_(identifications))
+    )
+    return {identification: esp_id for identification, esp_id in rows}
+
+def insert_readings(db: Session, rows: List[Dict], chunk_size: int = INSERT_CHUNK_SIZE) -> int:
+    """
+    Inserta lecturas usando executemany de SQLAlchemy Core.
+
+    El driver agrupa cada bloque en sentencias INSERT ... VALUES multi-fila,
+    así que miles de lecturas se escriben en pocos viajes a la base de datos.
+
+    Returns:
+        int: Cantidad de filas insertadas
+    """
+    for start in range(0, len(rows), chunk_size):
+        db.execute(insert(SensorReading), rows[start:start + chunk_size])
+    return len(rows)
+
+def update_current_state(db: Session, current: Dict[int, Dict]) -> None:
+    """Guarda la última lectura de cada ESP en json_sensores con un UPDATE por lotes."""
+    if not current:
+        return
+    db.execute(
+        update(Esp),
+        [{"id": esp_id, "json_sensores": {"current": data}} for esp_id, data in current.items()]
+    )
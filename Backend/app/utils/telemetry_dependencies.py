@@ -0,0 +1,291 @@
+from fastapi import WebSocket
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import deque
+import logging
+import math
+import os
+import struct
+
+logger = logging.getLogger("app.telemetry")
+
+# Formatos de telemetría aceptados en /ws/esp/{device_id}
+FORMAT_JSON = "json"
+FORMAT_BINARY_V1 = "bin.v1"
+
+# Subprotocolos WebSocket que el ESP puede ofrecer al conectarse
+SUBPROTOCOLS = {
+    "esp-telemetry.bin.v1": FORMAT_BINARY_V1,
+    "esp-telemetry.json": FORMAT_JSON
+}
+
+# Frame binario v1 (little endian):
+#   cabecera: versión (u8), tipo (u8), cantidad de muestras (u16)
+#   muestra:  secuencia (u32), epoch en ms (u64), temperatura (f32), humedad (f32)
+FRAME_VERSION_1 = 1
+FRAME_SENSOR_DATA = 0x01
+FRAME_HEADER = struct.Struct("<BBH")
+SAMPLE_V1 = struct.Struct("<IQff")
+MAX_SAMPLES_PER_FRAME = 1024
+
+# Muestra decodificada: (secuencia, epoch ms, temperatura, humedad)
+Sample = Tuple[int, int, Optional[float], Optional[float]]
+
+# Secuencias faltantes que se recuerdan por ESP para aceptar reenvíos tardíos
+SEQUENCE_MAX_MISSING = int(os.getenv("SEQUENCE_MAX_MISSING", "1024"))
+
+
+# Contadores de mensajes recibidos por formato (expuestos en /health)
+telemetry_stats = {
+    "json_messages": 0,
+    "binary_frames": 0,
+    "binary_samples": 0,
+    "invalid_frames": 0,
+    "batch_messages": 0,
+    "batch_samples": 0
+}
+
+
+class TelemetryFrameError(ValueError):
+    """Frame binario mal formado o con una versión no soportada."""
+    pass
+
+
+def negotiate_format(websocket: WebSocket) -> Tuple[str, Optional[str]]:
+    """
+    Elige el formato de telemetría al conectar.
+
+    Se respeta el primer subprotocolo conocido que ofrezca el cliente
+    (``Sec-WebSocket-Protocol``); como alternativa para clientes sin soporte
+    de subprotocolos se acepta ``?format=bin.v1``. Sin ninguno se usa JSON.
+
+    Returns:
+        Tuple con el formato y el subprotocolo que se debe aceptar (o None)
+    """
+    for subprotocol in websocket.scope.get("subprotocols", []):
+        if subprotocol in SUBPROTOCOLS:
+            return SUBPROTOCOLS[subprotocol], subprotocol
+
+    if websocket.query_params.get("format") == FORMAT_BINARY_V1:
+        return FORMAT_BINARY_V1, None
+    return FORMAT_JSON, None
+
+def _clean(value: float) -> Optional[float]:
+    # El sensor reporta NaN cuando la lectura falla; un f32 también puede traer ±inf
+    return round(value, 2) if math.isfinite(value) else None
+
+def decode_frame(data: bytes) -> Tuple[int, List[Sample]]:
+    """
+    Decodifica un frame binario sin copiar el buffer.
+
+    Las muestras se leen con ``struct.iter_unpack`` directamente sobre un
+    ``memoryview`` del frame recibido.
+
+    Returns:
+        Tuple con el tipo de frame y la lista de muestras
+
+    Raises:
+        TelemetryFrameError: Si el frame está truncado o no es de la versión 1
+    """
+    view = memoryview(data)
+    if len(view) < FRAME_HEADER.size:
+        raise TelemetryFrameError(f"Frame de {len(view)} bytes, menor que la cabecera")
+
+    version, frame_type, count = FRAME_HEADER.unpack_from(view)
+    if version != FRAME_VERSION_1:
+        raise TelemetryFrameError(f"Versión de frame no soportada: {version}")
+    if frame_type != FRAME_SENSOR_DATA:
+        raise TelemetryFrameError(f"Tipo de frame desconocido: {frame_type}")
+    if count > MAX_SAMPLES_PER_FRAME:
+        raise TelemetryFrameError(f"Frame con {count} muestras (máximo {MAX_SAMPLES_PER_FRAME})")
+
+    expected = FRAME_HEADER.size + count * SAMPLE_V1.size
+    if len(view) != expected:
+        raise TelemetryFrameError(f"Frame de {len(view)} bytes, se esperaban {expected}")
+
+    samples = [
+        (seq, ts, _clean(temperature), _clean(humidity))
+        for seq, ts, temperature, humidity in SAMPLE_V1.iter_unpack(view[FRAME_HEADER.size:])
+    ]
+    return frame_type, samples
+
+def encode_frame(samples: Iterable[Sample], frame_type: int = FRAME_SENSOR_DATA) -> bytes:
+    """Codifica muestras en un frame binario v1 (referencia para clientes y pruebas)."""
+    samples = list(samples)
+    buffer = bytearray(FRAME_HEADER.size + len(samples) * SAMPLE_V1.size)
+    FRAME_HEADER.pack_into(buffer, 0, FRAME_VERSION_1, frame_type, len(samples))
+    offset = FRAME_HEADER.size
+    for seq, ts, temperature, humidity in samples:
+        SAMPLE_V1.pack_into(
+            buffer, offset, seq, ts,
+            math.nan if temperature is None else temperature,
+            math.nan if humidity is None else humidity
+        )
+        offset += SAMPLE_V1.size
+    return bytes(buffer)
+
+def iter_sensor_data(samples: Iterable[Sample], received_ms: int) -> Iterator[Tuple[int, dict]]:
+    """
+    Convierte muestras decodificadas en (epoch ms, lectura) para el pipeline de ingesta.
+
+    Las muestras con marca de tiempo 0 (ESP sin reloj sincronizado) usan
+    ``received_ms``, el instante en que el servidor recibió el frame. Como
+    en SENSOR_DATA, ``timestamp`` va en ISO 8601 para los dashboards.
+    """
+    for seq, ts, temperature, humidity in samples:
+        ts = ts or received_ms
+        yield ts, {
+            "temperature": temperature,
+            "humidity": humidity,
+            "timestamp": datetime.fromtimestamp(ts / 1000).isoformat()
+        }
+
+def _batch_value(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    # float() también acepta "nan" e "inf": como en el frame binario, no son lecturas
+    return _clean(float(value))
+
+def parse_batch(data: Dict) -> List[Sample]:
+    """
+    Valida un mensaje SENSOR_BATCH y lo convierte en muestras.
+
+    Cada muestra puede venir como objeto
+    ``{"seq", "ts", "temperature", "humidity"}`` o, más compacta, como
+    arreglo ``[seq, ts, temperature, humidity]``. ``ts`` es epoch en ms
+    (0 si el ESP no tiene reloj sincronizado).
+
+    Raises:
+        TelemetryFrameError: Si el lote no tiene muestras válidas
+    """
+    raw_samples = data.get("samples")
+    if not isinstance(raw_samples, list) or not raw_samples:
+        raise TelemetryFrameError("SENSOR_BATCH sin muestras")
+    if len(raw_samples) > MAX_SAMPLES_PER_FRAME:
+        raise TelemetryFrameError(f"Lote con {len(raw_samples)} muestras (máximo {MAX_SAMPLES_PER_FRAME})")
+
+    samples = []
+    try:
+        for raw in raw_samples:
+            if isinstance(raw, dict):
+                seq, ts = raw["seq"], raw.get("ts", 0)
+                temperature, humidity = raw.get("temperature"), raw.get("humidity")
+            else:
+                seq, ts, temperature, humidity = raw
+            samples.append((int(seq), int(ts or 0), _batch_value(temperature), _batch_value(humidity)))
+    except (KeyError, TypeError, ValueError) as e:
+        raise TelemetryFrameError(f"Muestra inválida en SENSOR_BATCH: {str(e)}")
+    return samples
+
+
+class SequenceTracker:
+    """
+    Seguimiento de los números de secuencia de cada ESP.
+
+    Guarda la secuencia más alta recibida y un conjunto acotado de
+    secuencias faltantes (huecos). Una muestra se acepta si supera la más
+    alta o si llena un hueco conocido; el resto son duplicados, p. ej. un
+    backlog reenviado tras una reconexión. Un ``boot_id`` distinto, o la
+    secuencia 0 cuando no hay boot_id, indica que el ESP se reinició y su
+    contador volvió a empezar.
+
+    El estado es local al worker: si el ESP se reconecta a otro worker las
+    muestras reenviadas no se reconocen como duplicadas.
+    """
+
+    def __init__(self, max_missing: int = SEQUENCE_MAX_MISSING):
+        self.max_missing = max_missing
+        self._devices: Dict[str, Dict] = {}
+        self.duplicates = 0
+        self.gaps = 0
+        self.missing_samples = 0
+        self.gap_fills = 0
+        self.restarts = 0
+
+    def _restart(self, device_id: str, boot_id: Optional[str]) -> Dict:
+        # "order": las faltantes en orden creciente (pueden quedar las ya recibidas)
+        state = {"boot_id": boot_id, "last_seq": -1, "missing": set(), "order": deque()}
+        self._devices[device_id] = state
+        return state
+
+    def _add_missing(self, state: Dict, first: int, last: int) -> None:
+        """
+        Recuerda las secuencias [first, last] como faltantes.
+
+        Solo se guardan las ``max_missing`` más recientes. Los huecos nuevos
+        siempre son mayores que los conocidos, así que las más antiguas están
+        al principio de ``order`` y se descartan en O(1) cada una.
+        """
+        missing, order = state["missing"], state["order"]
+        start = max(first, last - self.max_missing + 1)
+        if last - start + 1 >= self.max_missing:
+            missing.clear()
+            order.clear()
+        new = range(start, last + 1)
+        missing.update(new)
+        order.extend(new)
+        while len(missing) > self.max_missing:
+            missing.discard(order.popleft())
+        # Compactar las secuencias que ya llegaron para que order no crezca sin límite
+        if len(order) > 2 * self.max_missing:
+            state["order"] = deque(seq for seq in order if seq in missing)
+
+    def filter(self, device_id: str, samples: Iterable[Sample], boot_id: Optional[str] = None) -> Tuple[List[Sample], bool]:
+        """
+        Descarta duplicados y registra huecos.
+
+        Returns:
+            Tuple con las muestras nuevas ordenadas por secuencia y si alguna
+            superó la secuencia más alta conocida (False si solo llenan huecos)
+        """
+        state = self._devices.get(device_id)
+        if state is None:
+            state = self._restart(device_id, boot_id)
+        elif boot_id is not None and boot_id != state["boot_id"]:
+            self.restarts += 1
+            logger.info(f"ESP {device_id} reiniciado (boot_id {state['boot_id']} -> {boot_id})")
+            state = self._restart(device_id, boot_id)
+
+        accepted = []
+        advanced = False
+        missing = state["missing"]
+        for sample in sorted(samples, key=lambda sample: sample[0]):
+            seq = sample[0]
+            if seq > state["last_seq"]:
+                if seq > state["last_seq"] + 1 and state["last_seq"] >= 0:
+                    self.gaps += 1
+                    self.missing_samples += seq - state["last_seq"] - 1
+                    logger.warning(
+                        f"Hueco en la secuencia de {device_id}: faltan {state['last_seq'] + 1}..{seq - 1}"
+                    )
+                    self._add_missing(state, state["last_seq"] + 1, seq - 1)
+                state["last_seq"] = seq
+                advanced = True
+            elif seq in missing:
+                missing.discard(seq)
+                self.gap_fills += 1
+            elif seq == 0 and boot_id is None and not accepted:
+                # Sin boot_id, la secuencia 0 marca un reinicio del contador
+                self.restarts += 1
+                state = self._restart(device_id, None)
+                missing = state["missing"]
+                state["last_seq"] = seq
+                advanced = True
+            else:
+                self.duplicates += 1
+                continue
+            accepted.append(sample)
+        return accepted, advanced
+
+    def stats(self) -> Dict:
+        return {
+            "devices": len(self._devices),
+            "duplicates": self.duplicates,
+            "gaps": self.gaps,
+            "missing_samples": self.missing_samples,
+            "gap_fills": self.gap_fills,
+            "restarts": self.restarts
+        }
+
+# Instancia única
+sequence_tracker = SequenceTracker()
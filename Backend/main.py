@@ -1,5 +1,6 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from app.utils.auth import get_protected_router
 
 import logging
@@ -10,6 +11,17 @@ import os
 from app.routes.esp_routes import esp_routes
 from app.routes.user_routes import user_routers
 from app.routes.esp_socket import esp_socket
+from app.utils.BufferManager import data_buffer
+from app.utils.RetentionManager import retention_manager
+from app.utils.esp_dependencies import esp_cache_stats
+from app.utils.crypt_dependencies import crypt_pool_stats
+from app.utils.JWT_Auth import auth_cache_stats
+from app.utils.PubSubBroker import broker
+from app.utils.WsManager import websocket_manager
+from app.utils.CommandTracker import command_tracker
+from app.utils.telemetry_dependencies import telemetry_stats, sequence_tracker
+from app.utils.Metrics import metrics, MetricsMiddleware, CONTENT_TYPE
+from app.database.database import database
 
 # Crear el directorio de logs si no existe
 log_directory = "logs"
@@ -50,10 +62,20 @@ def setup_logging():
     return logger
 
 # Eventos de inicio y apagado
-def lifespan(_):
+@asynccontextmanager
+async def lifespan(_):
+    await broker.start()
+    await websocket_manager.start()
+    await data_buffer.start()
+    await retention_manager.start()
     logger.info("Aplicación iniciada correctamente")
     yield
     logger.info("Apagando aplicación...")
+    await retention_manager.stop()
+    await data_buffer.stop()
+    await websocket_manager.stop()
+    await broker.stop()
+    await database.dispose_async()
 
 app =  FastAPI(
     title="ESP Management API",
@@ -81,6 +103,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Latencia HTTP por ruta (/metrics)
+app.add_middleware(MetricsMiddleware)
 
 # Incluir rutas
 app.include_router(esp_routes, tags=["ESP Management"])
@@ -90,4 +114,69 @@ app.include_router(esp_socket, tags=["ESP Management"])
 # Endpoint de health check
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
\ No newline at end of file
+    return {
+        "status": "ok",
+        "ingest": {**data_buffer.stats(), "telemetry": {**telemetry_stats, "sequences": sequence_tracker.stats()}},
+        "caches": {**esp_cache_stats(), **auth_cache_stats()},
+        "db_pool": database.pool_status(),
+        "db_writes": database.write_stats(),
+        "hashing": crypt_pool_stats(),
+        "broker": {**broker.stats(), "device_registry": websocket_manager.registry.stats()},
+        "commands": command_tracker.stats(),
+        "retention": retention_manager.stats()
+    }
+
+# Métricas que se leen al exportar: no agregan costo al camino caliente
+metrics.callback(
+    "ingest_queue_depth", "Lecturas en la cola de ingesta", "gauge",
+    lambda: data_buffer.stats()["queue_depth"]
+)
+metrics.callback(
+    "ingest_buffered_readings", "Lecturas en el buffer pendientes de flush", "gauge",
+    lambda: len(data_buffer.buffer)
+)
+metrics.callback(
+    "ingest_readings_total", "Lecturas de la cola de ingesta por resultado", "counter",
+    lambda: {(result,): data_buffer.stats()[result] for result in ("accepted", "dropped", "coalesced")},
+    ("result",)
+)
+metrics.callback(
+    "db_pool_checked_out", "Conexiones del pool en uso", "gauge",
+    lambda: {(engine,): status["checked_out"] for engine, status in database.pool_status().items()},
+    ("engine",)
+)
+metrics.callback(
+    "db_write_queue_depth", "Escrituras esperando la cola de SQLite", "gauge",
+    lambda: database.write_waiting
+)
+metrics.callback(
+    "db_pool_overflow", "Conexiones abiertas por encima del tamaño del pool", "gauge",
+    lambda: {(engine,): max(status["overflow"], 0) for engine, status in database.pool_status().items()},
+    ("engine",)
+)
+metrics.callback(
+    "websocket_connections", "Conexiones WebSocket abiertas en este worker", "gauge",
+    lambda: {
+        ("esp",): len(websocket_manager.esp_connections),
+        ("frontend",): len(websocket_manager.frontend_connections)
+    },
+    ("kind",)
+)
+metrics.callback(
+    "commands_total", "Comandos de motor por resultado", "counter",
+    lambda: {
+        ("acked",): command_tracker.acked,
+        ("timeout",): command_tracker.timeouts,
+        ("retry",): command_tracker.retries
+    },
+    ("result",)
+)
+metrics.callback(
+    "commands_pending", "Comandos de motor esperando confirmación", "gauge",
+    lambda: len(command_tracker.pending)
+)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Métricas del worker en formato de texto de Prometheus."""
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
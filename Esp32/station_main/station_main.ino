@@ -5,6 +5,7 @@
 #include <WebSocketsClient.h>
 #include <DHT.h>
 #include <Stepper.h>
+#include <sys/time.h>
 
 // Configuración WiFi
 const char* ssid = "ACCESO_DENEGADO";
@@ -45,6 +46,35 @@ volatile int lastSavedPosition = 0; // Última posición guardada antes de deten
 const int FULL_REVOLUTION_STEPS = stepsPerRevolution * 3; // 3 revoluciones completas
 const int MOTOR_SPEED = 4; // Reducido a 4 RPM para funcionamiento con 5V
 
+// Telemetría binaria (frame v1 del backend); en 0 se envía SENSOR_DATA en JSON
+#define TELEMETRY_BINARY 1
+const char* TELEMETRY_SUBPROTOCOL = "esp-telemetry.bin.v1";
+uint32_t telemetrySeq = 0;  // Secuencia de muestras enviadas
+uint32_t bootId = 0;        // Identifica este arranque (la secuencia vuelve a 0 al reiniciar)
+
+// Muestras pendientes de enviar; sin conexión se acumulan y se suben en lote al reconectar
+#define TELEMETRY_BACKLOG 64
+struct TelemetrySample {
+  uint32_t seq;
+  uint64_t epochMs;
+  float temperature;
+  float humidity;
+};
+TelemetrySample backlog[TELEMETRY_BACKLOG];
+int backlogStart = 0;
+int backlogCount = 0;
+
+// ID del último MOTOR_COMMAND; se devuelve en el MOTOR_STATUS que lo confirma
+char pendingCommandId[40] = "";
+
+// Agrega el command_id pendiente al mensaje y lo limpia (solo se confirma una vez)
+void attachCommandId(JsonDocument& doc) {
+  if (pendingCommandId[0] != '\0') {
+    doc["command_id"] = String(pendingCommandId);  // String: ArduinoJson guarda una copia
+    pendingCommandId[0] = '\0';
+  }
+}
+
 // Estructura para datos del sensor
 struct SensorData {
   float temperature;
@@ -158,12 +188,13 @@ void stopMotor() {
   lastSavedPosition = currentPosition;
   
   // Enviar confirmación de detención
-  StaticJsonDocument<200> doc;
+  StaticJsonDocument<256> doc;
   doc["type"] = "MOTOR_STATUS";
   doc["status"] = "STOPPED";
   doc["deviceId"] = ChipId;
   doc["position"] = currentPosition;
   doc["saved_position"] = lastSavedPosition;
+  attachCommandId(doc);
   String jsonString;
   serializeJson(doc, jsonString);
   webSocket.sendTXT(jsonString);
@@ -173,12 +204,13 @@ void stopMotor() {
 
 // Función para enviar el estado del motor
 void sendMotorStatus(const char* status) {
-  StaticJsonDocument<200> doc;
+  StaticJsonDocument<256> doc;
   doc["type"] = "MOTOR_STATUS";
   doc["status"] = status;
   doc["deviceId"] = ChipId;
   doc["current_position"] = currentPosition;
   doc["target_position"] = targetPosition;
+  attachCommandId(doc);
   String jsonString;
   serializeJson(doc, jsonString);
   webSocket.sendTXT(jsonString);
@@ -204,11 +236,12 @@ void controlMotor(void * parameter) {
       targetPosition = FULL_REVOLUTION_STEPS;
       
       // Enviar estado inicial
-      StaticJsonDocument<200> doc;
+      StaticJsonDocument<256> doc;
       doc["type"] = "MOTOR_STATUS";
       doc["status"] = "RUNNING";
       doc["deviceId"] = ChipId;
       doc["current_position"] = currentPosition;
+      attachCommandId(doc);
       String jsonString;
       serializeJson(doc, jsonString);
       webSocket.sendTXT(jsonString);
@@ -284,7 +317,7 @@ void webSocketEvent(WStype_t type, uint8_t * payload, size_t length) {
         String message = String((char*)payload);
         Serial.println("Mensaje WebSocket recibido: " + message);
         
-        StaticJsonDocument<200> doc;
+        StaticJsonDocument<256> doc;
         DeserializationError error = deserializeJson(doc, message);
         
         if (error) {
@@ -298,8 +331,18 @@ void webSocketEvent(WStype_t type, uint8_t * payload, size_t length) {
           const char* action = doc["action"] | "UNKNOWN";
           Serial.print("Acción recibida: ");
           Serial.println(action);
+
+          // Guardar el ID para confirmarlo en el próximo MOTOR_STATUS
+          strlcpy(pendingCommandId, doc["command_id"] | "", sizeof(pendingCommandId));
           
-          if (strcmp(action, "START_MOTOR") == 0) {
+          // Un comando repetido (reintento del servidor) solo se vuelve a confirmar
+          if (strcmp(action, "START_MOTOR") == 0 && motorActive) {
+            sendMotorStatus("RUNNING");
+          }
+          else if (strcmp(action, "STOP_MOTOR") == 0 && !motorActive && !motorStartRequest) {
+            sendMotorStatus("STOPPED");
+          }
+          else if (strcmp(action, "START_MOTOR") == 0) {
             emergencyStop = false;
             motorStartRequest = true;
             motorStopRequest = false;
@@ -326,24 +369,83 @@ void webSocketEvent(WStype_t type, uint8_t * payload, size_t length) {
   }
 }
 
+// Epoch en ms si el reloj ya se sincronizó por NTP, 0 en caso contrario (usa la hora del servidor)
+uint64_t currentEpochMs() {
+  struct timeval tv;
+  gettimeofday(&tv, NULL);
+  if (tv.tv_sec < 1600000000) {
+    return 0;
+  }
+  return (uint64_t)tv.tv_sec * 1000 + tv.tv_usec / 1000;
+}
+
+// Agrega una muestra al backlog; si está lleno se pierde la más antigua
+void pushSample(const SensorData& data) {
+  int index = (backlogStart + backlogCount) % TELEMETRY_BACKLOG;
+  if (backlogCount == TELEMETRY_BACKLOG) {
+    backlogStart = (backlogStart + 1) % TELEMETRY_BACKLOG;
+  } else {
+    backlogCount++;
+  }
+  backlog[index] = {telemetrySeq++, currentEpochMs(), data.temperature, data.humidity};
+}
+
+#if TELEMETRY_BINARY
+// Frame v1: cabecera (versión, tipo 0x01, cantidad u16) y por muestra
+// secuencia (u32), epoch ms (u64), temperatura y humedad (float32); little endian como el ESP32
+void sendBacklog() {
+  static uint8_t frame[4 + TELEMETRY_BACKLOG * 20];
+  frame[0] = 1;
+  frame[1] = 0x01;
+  frame[2] = backlogCount & 0xFF;
+  frame[3] = backlogCount >> 8;
+  for (int i = 0; i < backlogCount; i++) {
+    const TelemetrySample& sample = backlog[(backlogStart + i) % TELEMETRY_BACKLOG];
+    uint8_t* out = frame + 4 + i * 20;
+    memcpy(out, &sample.seq, 4);
+    memcpy(out + 4, &sample.epochMs, 8);
+    memcpy(out + 12, &sample.temperature, 4);
+    memcpy(out + 16, &sample.humidity, 4);
+  }
+  webSocket.sendBIN(frame, 4 + backlogCount * 20);
+}
+#else
+// SENSOR_BATCH con muestras compactas [seq, ts, temperatura, humedad]
+void sendBacklog() {
+  DynamicJsonDocument doc(256 + backlogCount * 64);
+  doc["type"] = "SENSOR_BATCH";
+  doc["deviceId"] = ChipId;
+  doc["boot_id"] = bootId;
+  JsonArray samples = doc.createNestedArray("samples");
+  for (int i = 0; i < backlogCount; i++) {
+    const TelemetrySample& sample = backlog[(backlogStart + i) % TELEMETRY_BACKLOG];
+    JsonArray item = samples.createNestedArray();
+    item.add(sample.seq);
+    item.add(sample.epochMs);
+    item.add(sample.temperature);
+    item.add(sample.humidity);
+  }
+
+  String jsonString;
+  serializeJson(doc, jsonString);
+  webSocket.sendTXT(jsonString);
+}
+#endif
+
 // Tarea para enviar datos por WebSocket
 void sendSensorData(void * parameter) {
   for(;;) {
     if(isRegistered) {
-      SensorData data = readSensors();
-      
-      StaticJsonDocument<200> doc;
-      doc["type"] = "SENSOR_DATA";
-      doc["temperature"] = data.temperature;
-      doc["humidity"] = data.humidity;
-      doc["deviceId"] = ChipId;
-      
-      String jsonString;
-      serializeJson(doc, jsonString);
-      
-      webSocket.sendTXT(jsonString);
+      pushSample(readSensors());
+
+      // Conectado: se envía la lectura nueva junto con lo acumulado sin conexión
+      if (webSocket.isConnected()) {
+        sendBacklog();
+        backlogStart = 0;
+        backlogCount = 0;
+      }
     }
-    vTaskDelay(2000); // Enviar datos cada 2 segundos
+    vTaskDelay(2000); // Leer datos cada 2 segundos
   }
 }
 
@@ -357,6 +459,10 @@ void setup() {
     Serial.print(".");
   }
   Serial.println("\nConectado a WiFi");
+
+  // Hora para las marcas de tiempo de las muestras y ID de este arranque
+  configTime(0, 0, "pool.ntp.org");
+  bootId = esp_random();
   
   ChipId = getChipId();
   Serial.println("ChipId Address: " + ChipId);
@@ -399,7 +505,11 @@ void setup() {
     String wsEndpoint = String("/ws/esp/") + ChipId;
 
     // Configurar WebSocket
+#if TELEMETRY_BINARY
+    webSocket.begin(wsUrl, wsPort, wsEndpoint.c_str(), TELEMETRY_SUBPROTOCOL);
+#else
     webSocket.begin(wsUrl, wsPort, wsEndpoint.c_str());
+#endif
     webSocket.onEvent(webSocketEvent);
     webSocket.setReconnectInterval(5000);
     
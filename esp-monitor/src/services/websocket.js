@@ -13,6 +13,7 @@ export class WebSocketService {
       this.socket = null;
       this.listeners = new Set();
       this.deviceId = null;
+      this.subscription = null;
       this.retryTimeout = null;
   
       WebSocketService.instance = this;
@@ -52,8 +53,8 @@ export class WebSocketService {
             WebSocketService.connectionPromise = null;
             console.log('WebSocket connected successfully');
             
-            if (this.deviceId) {
-              this.subscribeToDevice(this.deviceId);
+            if (this.subscription) {
+              this.sendSubscription();
             }
             
             resolve(this.socket);
@@ -63,7 +64,12 @@ export class WebSocketService {
             try {
               const data = JSON.parse(event.data);
               if (data.type === 'ESP_DATA') {
-                this.notifyListeners(data.data);
+                this.notifyListeners(data.data, data.device_id);
+              } else if (data.type === 'ESP_SNAPSHOT') {
+                // Estado actual de todos los dispositivos suscritos en un solo frame
+                Object.entries(data.devices).forEach(([deviceId, state]) => {
+                  this.notifyListeners(state, deviceId);
+                });
               }
             } catch (error) {
               console.error('Error processing message:', error);
@@ -100,11 +106,25 @@ export class WebSocketService {
   
     subscribeToDevice(deviceId) {
       this.deviceId = deviceId;
+      this.subscription = { device_id: deviceId };
+      this.sendSubscription();
+    }
+  
+    subscribeToDevices(deviceIds) {
+      this.subscription = { device_ids: deviceIds };
+      this.sendSubscription();
+    }
+  
+    subscribeToAll() {
+      this.subscription = { mode: 'ALL' };
+      this.sendSubscription();
+    }
   
+    sendSubscription() {
       if (this.socket?.readyState === WebSocket.OPEN) {
         this.socket.send(JSON.stringify({
           type: 'SUBSCRIBE',
-          device_id: deviceId
+          ...this.subscription
         }));
       }
     }
@@ -119,10 +139,10 @@ export class WebSocketService {
       this.listeners.delete(callback);
     }
   
-    notifyListeners(data) {
+    notifyListeners(data, deviceId) {
       this.listeners.forEach(callback => {
         try {
-          callback(data);
+          callback(data, deviceId);
         } catch (error) {
           console.error('Error in listener:', error);
         }
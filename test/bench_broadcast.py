@@ -0,0 +1,97 @@
+"""
+Benchmark del costo de serialización por broadcast de ESP_DATA.
+
+Compara la serialización por suscriptor (lo que hace send_json) contra la
+serialización única que usa ConnectionManager.broadcast_esp_data, con la
+librería estándar y con orjson si está instalado.
+
+Uso (desde la carpeta Backend):
+    python ../test/bench_broadcast.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+
+from app.utils import json_dependencies
+from app.utils.WsManager import ConnectionManager
+
+SUBSCRIBER_COUNTS = (1, 100, 1000)
+ROUNDS = 200
+
+MESSAGE = {
+    "type": "ESP_DATA",
+    "device_id": "ESP32-ABC123",
+    "data": {
+        "temperature": 25.2,
+        "humidity": 86,
+        "timestamp": "2024-11-17T01:05:29.029237",
+        "motor_status": "running",
+        "last_update": "2024-11-17T01:05:29.031337"
+    }
+}
+
+def per_subscriber_stdlib(subscribers: int):
+    # Equivalente a websocket.send_json(message) para cada suscriptor
+    for _ in range(subscribers):
+        json.dumps(MESSAGE, separators=(",", ":"), ensure_ascii=False)
+
+def once_stdlib(subscribers: int):
+    json.dumps(MESSAGE, separators=(",", ":"), ensure_ascii=False)
+
+def once_encoder(subscribers: int):
+    json_dependencies.encode_json(MESSAGE)
+
+def measure(func, subscribers: int) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        func(subscribers)
+    return (time.perf_counter() - start) / ROUNDS * 1e6
+
+class NullWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+async def measure_broadcast(subscribers: int) -> float:
+    """Costo de broadcast_esp_data (hasta encolar) en microsegundos."""
+    manager = ConnectionManager()
+    for index in range(subscribers):
+        user_id = f"user-{index}"
+        await manager.connect_frontend(NullWebSocket(), user_id)
+        manager.subscribe_to_device(user_id, "ESP32-ABC123")
+
+    total = 0.0
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        await manager.broadcast_esp_data("ESP32-ABC123", MESSAGE["data"])
+        total += time.perf_counter() - start
+        # Dejar que los escritores vacíen sus colas
+        await asyncio.sleep(0)
+
+    for index in range(subscribers):
+        manager.disconnect_frontend(f"user-{index}")
+    return total / ROUNDS * 1e6
+
+def main():
+    results = {"json_backend": json_dependencies.JSON_BACKEND, "rounds": ROUNDS, "results": []}
+    for subscribers in SUBSCRIBER_COUNTS:
+        results["results"].append({
+            "subscribers": subscribers,
+            "encode_per_subscriber_stdlib_us": round(measure(per_subscriber_stdlib, subscribers), 2),
+            "encode_once_stdlib_us": round(measure(once_stdlib, subscribers), 2),
+            "encode_once_backend_us": round(measure(once_encoder, subscribers), 2),
+            "broadcast_esp_data_us": round(asyncio.run(measure_broadcast(subscribers)), 2)
+        })
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
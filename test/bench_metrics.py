@@ -0,0 +1,143 @@
+"""
+Benchmark del costo de las métricas en el camino caliente.
+
+Mide lo que agrega la instrumentación a cada mensaje de un ESP:
+
+- la secuencia completa que corre por mensaje SENSOR_DATA (dos contadores,
+  dos lecturas de reloj y dos histogramas), aislada;
+- broadcast_esp_data con y sin sus histogramas, con 0, 10 y 100
+  suscriptores (sin instrumentar se reemplazan por un objeto que no hace nada).
+  El costo es fijo por mensaje; con muchos suscriptores la diferencia queda
+  dentro del ruido del encolado;
+- el costo de generar /metrics, que se paga en cada lectura de Prometheus.
+
+Uso (desde la carpeta Backend):
+    python ../test/bench_metrics.py
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+
+from app.utils import WsManager
+from app.utils.Metrics import metrics, INGEST_MESSAGES, INGEST_SAMPLES, BROADCAST_DURATION, BROADCAST_SUBSCRIBERS, HTTP_DURATION
+from app.utils.WsManager import ConnectionManager
+
+ROUNDS = 200000
+BROADCAST_ROUNDS = 1000
+BLOCKS = 5
+SUBSCRIBER_COUNTS = (0, 10, 100)
+DEVICE_ID = "ESP32-BENCH"
+DATA = {"temperature": 25.2, "humidity": 61.0, "timestamp": "2024-11-17T01:05:29.029237"}
+
+
+class NullChild:
+    def observe(self, value: float) -> None:
+        pass
+
+
+class NullWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def per_message_instrumentation() -> float:
+    """Nanosegundos de la instrumentación que corre por cada SENSOR_DATA."""
+    messages = INGEST_MESSAGES.labels("sensor_data")
+    samples = INGEST_SAMPLES.labels("json")
+    duration = BROADCAST_DURATION.labels()
+    subscribers = BROADCAST_SUBSCRIBERS.labels()
+    clock = time.perf_counter
+
+    start = clock()
+    for _ in range(ROUNDS):
+        messages.inc()
+        samples.inc()
+        began = clock()
+        subscribers.observe(10)
+        duration.observe((clock() - began) * 1000)
+    return (clock() - start) / ROUNDS * 1e9
+
+def empty_loop() -> float:
+    clock = time.perf_counter
+    start = clock()
+    for _ in range(ROUNDS):
+        pass
+    return (clock() - start) / ROUNDS * 1e9
+
+async def measure_broadcast(manager: ConnectionManager) -> float:
+    total = 0.0
+    for _ in range(BROADCAST_ROUNDS):
+        start = time.perf_counter()
+        await manager.broadcast_esp_data(DEVICE_ID, DATA)
+        total += time.perf_counter() - start
+        # Dejar que los escritores vacíen sus colas
+        await asyncio.sleep(0)
+    return total / BROADCAST_ROUNDS * 1e6
+
+async def broadcast_overhead(subscribers: int) -> dict:
+    manager = ConnectionManager()
+    for index in range(subscribers):
+        await manager.connect_frontend(NullWebSocket(), f"user-{index}")
+    if subscribers:
+        manager.subscribe_to_devices(f"user-0", [DEVICE_ID])
+        for index in range(1, subscribers):
+            manager.subscribe_to_device(f"user-{index}", DEVICE_ID)
+
+    instrumented = WsManager.BROADCAST_SECONDS, WsManager.BROADCAST_FAN_OUT
+    disabled = NullChild()
+    await measure_broadcast(manager)  # calentamiento
+    # Bloques alternados para que ambos casos vean el mismo estado de las colas
+    with_metrics, without_metrics = [], []
+    try:
+        for _ in range(BLOCKS):
+            WsManager.BROADCAST_SECONDS, WsManager.BROADCAST_FAN_OUT = instrumented
+            with_metrics.append(await measure_broadcast(manager))
+            WsManager.BROADCAST_SECONDS = WsManager.BROADCAST_FAN_OUT = disabled
+            without_metrics.append(await measure_broadcast(manager))
+    finally:
+        WsManager.BROADCAST_SECONDS, WsManager.BROADCAST_FAN_OUT = instrumented
+    with_metrics, without_metrics = min(with_metrics), min(without_metrics)
+
+    for index in range(subscribers):
+        manager.disconnect_frontend(f"user-{index}")
+    manager.device_subscribers.pop(DEVICE_ID, None)
+    return {
+        "subscribers": subscribers,
+        "broadcast_with_metrics_us": round(with_metrics, 3),
+        "broadcast_without_metrics_us": round(without_metrics, 3),
+        "overhead_us": round(with_metrics - without_metrics, 3)
+    }
+
+def render_cost() -> dict:
+    # Series típicas de un worker: rutas HTTP con varios códigos
+    for index in range(30):
+        HTTP_DURATION.labels("GET", f"/api/route-{index}", "200").observe(3)
+    start = time.perf_counter()
+    text = metrics.render()
+    return {"render_ms": round((time.perf_counter() - start) * 1000, 3), "bytes": len(text)}
+
+def main():
+    # Los avisos de "cola compactada" de los clientes simulados no interesan aquí
+    logging.disable(logging.WARNING)
+    baseline = empty_loop()
+    results = {
+        "rounds": ROUNDS,
+        "per_message_instrumentation_ns": round(per_message_instrumentation() - baseline, 1),
+        "broadcast": [asyncio.run(broadcast_overhead(subscribers)) for subscribers in SUBSCRIBER_COUNTS],
+        "metrics_endpoint": render_cost()
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Benchmark de los motores de base de datos (DB_BACKEND) en los caminos de
+ingesta e histórico.
+
+Cada variante corre en su propio proceso (la configuración se lee al
+importar ``database``) y mide:
+
+- ingesta: lotes escritos con ``data_buffer.process_batch`` (lecturas,
+  rollups y estado actual, con la cola de escritura de SQLite);
+- histórico: consultas de la ruta /history por ``iter_buckets``, una hora
+  de lecturas crudas y un día desde el rollup de minutos;
+- mixto: el histórico mientras se siguen escribiendo lotes (con WAL los
+  lectores no esperan al escritor).
+
+Variantes:
+    sqlite       WAL, synchronous=NORMAL (configuración por defecto)
+    sqlite-full  WAL, synchronous=FULL (fsync en cada commit)
+    mysql        la base MySQL configurada en .env; los datos del benchmark
+                 se borran al terminar
+
+Uso (desde la carpeta Backend):
+    python ../test/bench_storage.py
+    python ../test/bench_storage.py --variants sqlite,sqlite-full,mysql --readings 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+
+from loadtest import latency_summary
+
+BENCH_USER = "bench-storage"
+DEVICE_PREFIX = "BENCH-STORAGE-"
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+# Variables de entorno de cada variante (SQLITE_PATH y WAL_DIRECTORY se agregan al correr)
+VARIANTS = {
+    "sqlite": {"DB_BACKEND": "sqlite"},
+    "sqlite-full": {"DB_BACKEND": "sqlite", "SQLITE_SYNCHRONOUS": "FULL"},
+    "mysql": {"DB_BACKEND": "mysql"}
+}
+
+
+def cleanup(db) -> None:
+    from sqlalchemy import delete, select
+    from app.database.modelsDB import Esp, SensorReading, User, Usuario_Esp
+    from app.utils.rollup_dependencies import ROLLUP_TABLES
+
+    esp_ids = select(Esp.id).where(Esp.identification.like(f"{DEVICE_PREFIX}%")).scalar_subquery()
+    db.execute(delete(SensorReading).where(SensorReading.esp_id.in_(esp_ids)))
+    for _, model in ROLLUP_TABLES:
+        db.execute(delete(model).where(model.esp_id.in_(esp_ids)))
+    db.execute(delete(Usuario_Esp).where(Usuario_Esp.id_esp.in_(esp_ids)))
+    db.execute(delete(Esp).where(Esp.identification.like(f"{DEVICE_PREFIX}%")))
+    db.execute(delete(User).where(User.name == BENCH_USER))
+
+def create_devices(db, names: List[str]) -> List[int]:
+    from app.database.modelsDB import Esp, User, Usuario_Esp
+
+    user = User(name=BENCH_USER, password="-", location="bench", longitud=0.0, latitud=0.0)
+    db.add(user)
+    esps = [Esp(identification=name) for name in names]
+    db.add_all(esps)
+    db.flush()
+    db.add_all(Usuario_Esp(id_user=user.id, id_esp=esp.id) for esp in esps)
+    return [esp.id for esp in esps]
+
+def make_batches(names: List[str], readings: int, batch_size: int, start_ms: int) -> List[List[Dict]]:
+    """Una lectura por segundo y dispositivo a partir de ``start_ms``."""
+    entries = [
+        {
+            "device_id": names[index % len(names)],
+            "data": {"temperature": 20 + index % 100 / 10, "humidity": 50 + index % 30},
+            "ts": start_ms + index // len(names) * 1000
+        }
+        for index in range(readings)
+    ]
+    return [entries[start:start + batch_size] for start in range(0, len(entries), batch_size)]
+
+async def ingest(batches: List[List[Dict]]) -> Dict:
+    from app.utils.BufferManager import data_buffer
+
+    durations = []
+    started = time.perf_counter()
+    for batch in batches:
+        data_buffer.buffer = list(batch)
+        start = time.perf_counter()
+        await data_buffer.process_batch()
+        durations.append((time.perf_counter() - start) * 1000)
+        if data_buffer.stats()["failed_batch"]:
+            raise RuntimeError("El flush falló, ver el log")
+        # Dejar correr a los lectores entre lotes, como el flush periódico
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    rows = sum(len(batch) for batch in batches)
+    return {"rows": rows, "rows_per_second": round(rows / elapsed), "flush_ms": latency_summary(durations)}
+
+async def history(esp_id: int, from_ms: int, to_ms: int) -> int:
+    from app.database.database import database
+    from app.utils.history_dependencies import history_plan, iter_buckets
+
+    bucket_ms, rollup = history_plan(from_ms, to_ms, None)
+    buckets = 0
+    async with database.async_session() as db:
+        async for chunk in iter_buckets(db, esp_id, from_ms, to_ms, bucket_ms, rollup):
+            buckets += len(chunk)
+    return buckets
+
+async def history_loop(esp_ids: List[int], span_ms: int, end_ms: int, queries: int, stop: asyncio.Event = None) -> Dict:
+    durations, buckets = [], 0
+    index = 0
+    while (stop is None and index < queries) or (stop is not None and not stop.is_set()):
+        start = time.perf_counter()
+        buckets += await history(esp_ids[index % len(esp_ids)], end_ms - span_ms, end_ms)
+        durations.append((time.perf_counter() - start) * 1000)
+        index += 1
+    summary = latency_summary(durations)
+    summary["buckets_per_query"] = round(buckets / max(index, 1))
+    return summary
+
+async def run_variant(args) -> Dict:
+    from app.database.database import database
+
+    names = [f"{DEVICE_PREFIX}{index:04d}" for index in range(args.devices)]
+    async with database.write_session() as db:
+        await db.run_sync(cleanup)
+    async with database.write_session() as db:
+        esp_ids = await db.run_sync(create_devices, names)
+
+    # La ingesta inicial termina "ahora"; la mixta sigue después
+    per_device_s = args.readings // args.devices
+    now_ms = int(time.time() * 1000)
+    start_ms = now_ms - per_device_s * 1000
+    results = {"backend": database.backend, "pragmas": None}
+    if database.backend == "sqlite":
+        results["pragmas"] = database._config.sqlite_pragmas
+
+    try:
+        results["ingest"] = await ingest(make_batches(names, args.readings, args.batch, start_ms))
+        results["history_raw_1h"] = await history_loop(esp_ids, HOUR_MS, now_ms, args.queries)
+        results["history_rollup_1d"] = await history_loop(esp_ids, DAY_MS, now_ms, args.queries)
+
+        stop = asyncio.Event()
+        reader = asyncio.create_task(history_loop(esp_ids, HOUR_MS, now_ms, 0, stop))
+        mixed = await ingest(make_batches(names, args.readings // 2, args.batch, now_ms))
+        stop.set()
+        results["mixed"] = {"ingest": mixed, "history_raw_1h": await reader}
+    finally:
+        async with database.write_session() as db:
+            await db.run_sync(cleanup)
+        await database.dispose_async()
+    return results
+
+def run_child(variant: str, args) -> Dict:
+    """Corre una variante en un proceso nuevo con su configuración."""
+    workdir = tempfile.mkdtemp(prefix="bench-storage-")
+    env = dict(os.environ, **VARIANTS[variant])
+    env.update(SQLITE_PATH=os.path.join(workdir, "bench.db"), WAL_DIRECTORY=os.path.join(workdir, "wal"))
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child",
+        "--devices", str(args.devices), "--readings", str(args.readings),
+        "--batch", str(args.batch), "--queries", str(args.queries)
+    ]
+    try:
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if completed.returncode != 0:
+        # p. ej. MySQL no disponible: se informa y se siguen las demás variantes
+        return {"error": (completed.stderr.strip().splitlines() or ["sin salida"])[-1]}
+    return json.loads(completed.stdout)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compara los motores de base de datos en ingesta e histórico")
+    parser.add_argument("--variants", default="sqlite,sqlite-full,mysql",
+                        help=f"Variantes separadas por coma ({', '.join(VARIANTS)})")
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--readings", type=int, default=50000, help="Lecturas de la ingesta inicial")
+    parser.add_argument("--batch", type=int, default=500, help="Lecturas por flush")
+    parser.add_argument("--queries", type=int, default=200, help="Consultas de histórico por fase")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.child:
+        # Solo el JSON va a stdout
+        import logging
+        logging.disable(logging.WARNING)
+        print(json.dumps(asyncio.run(run_variant(args))))
+        return
+
+    variants = [name.strip() for name in args.variants.split(",") if name.strip()]
+    unknown = set(variants) - set(VARIANTS)
+    if unknown:
+        sys.exit(f"Variantes desconocidas: {', '.join(sorted(unknown))}")
+    results = {
+        "devices": args.devices,
+        "readings": args.readings,
+        "batch": args.batch,
+        "variants": {variant: run_child(variant, args) for variant in variants}
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
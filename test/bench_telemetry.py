@@ -0,0 +1,74 @@
+"""
+Benchmark de decodificación de telemetría en /ws/esp.
+
+Compara el camino JSON (parseo del texto más la construcción de la lectura
+con ``datetime.now().isoformat()``) contra el frame binario v1, con una y
+con varias muestras por frame. Reporta microsegundos por muestra y bytes
+por muestra en el cable.
+
+Uso (desde la carpeta Backend):
+    python ../test/bench_telemetry.py
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+
+from app.utils.json_dependencies import decode_json
+from app.utils.telemetry_dependencies import encode_frame, decode_frame, iter_sensor_data
+
+SAMPLES = 20000
+BATCH_SIZES = (1, 10, 50)
+
+def json_messages():
+    return [
+        json.dumps({"type": "SENSOR_DATA", "temperature": 20 + index % 10 / 10, "humidity": 40 + index % 7})
+        for index in range(SAMPLES)
+    ]
+
+def binary_frames(batch_size: int):
+    now = int(time.time() * 1000)
+    samples = [(index, now + index, 20 + index % 10 / 10, 40.0 + index % 7) for index in range(SAMPLES)]
+    return [encode_frame(samples[start:start + batch_size]) for start in range(0, SAMPLES, batch_size)]
+
+def run_json(messages):
+    for raw in messages:
+        data = decode_json(raw)
+        {
+            "temperature": data.get("temperature"),
+            "humidity": data.get("humidity"),
+            "timestamp": datetime.now().isoformat()
+        }
+
+def run_binary(frames):
+    received_ms = int(time.time() * 1000)
+    for frame in frames:
+        _, samples = decode_frame(frame)
+        for _ in iter_sensor_data(samples, received_ms):
+            pass
+
+def measure(func, payload) -> float:
+    start = time.perf_counter()
+    func(payload)
+    return (time.perf_counter() - start) / SAMPLES * 1e6
+
+def main():
+    messages = json_messages()
+    rows = [("json", measure(run_json, messages), sum(len(m) for m in messages) / SAMPLES)]
+    for batch_size in BATCH_SIZES:
+        frames = binary_frames(batch_size)
+        rows.append((
+            f"bin.v1 x{batch_size}",
+            measure(run_binary, frames),
+            sum(len(frame) for frame in frames) / SAMPLES
+        ))
+
+    print(f"{'formato':>14} {'us/muestra':>12} {'bytes/muestra':>14}")
+    for name, micros, size in rows:
+        print(f"{name:>14} {micros:>12.3f} {size:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Configuración común de las pruebas.
+
+Las pruebas corren contra una base SQLite temporal (DB_BACKEND=sqlite) y un
+WAL de ingesta en un directorio temporal; las variables se fijan antes de
+importar ``app`` porque la base de datos se inicializa al importarla.
+
+Uso (desde la raíz del repositorio):
+    python -m pytest -q test
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+
+_workdir = tempfile.mkdtemp(prefix="iot-tests-")
+os.environ.update(
+    DB_BACKEND="sqlite",
+    SQLITE_PATH=os.path.join(_workdir, "tests.db"),
+    WAL_DIRECTORY=os.path.join(_workdir, "sensor_data_wal")
+)
+for key, value in dict(SECRET_KEY="test-secret", ALGORITHM="HS256", ACCESS_TOKEN_EXPIRE_MINUTES="30",
+                       REFRESH_TOKEN_EXPIRE_DAYS="7", STATIC_AUTH_TOKEN="test-token").items():
+    os.environ.setdefault(key, value)
+
+
+@pytest.fixture
+def db():
+    """Sesión síncrona cuyos cambios se descartan al terminar la prueba."""
+    from app.database.database import database
+
+    session = database._SessionFactory()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+@pytest.fixture
+def user_id(db) -> int:
+    from app.database.modelsDB import User
+
+    user = User(name="test-user", password="-", location="test", longitud=0.0, latitud=0.0)
+    db.add(user)
+    db.flush()
+    return user.id
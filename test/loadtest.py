@@ -0,0 +1,531 @@
+"""
+Prueba de carga WebSocket contra el backend, con dos escenarios.
+
+connections: abre N sockets de ESP en /ws/esp/{id} y M sockets de
+dashboard en /ws/frontend al mismo tiempo, los mantiene abiertos y reporta
+cuántos se conectaron, la latencia de conexión y el estado del pool de BD
+tomado de /health mientras todos están abiertos. Sirve para comprobar que
+la cantidad de sockets concurrentes no depende del tamaño del pool.
+
+traffic: N ESP simulados envían SENSOR_DATA a --rate mensajes por segundo
+y responden los MOTOR_COMMAND con MOTOR_STATUS; M dashboards se suscriben
+(cada ESP lo miran --watchers dashboards) y se mide la latencia de punta a
+punta, del envío del ESP a la recepción del ESP_DATA en el dashboard. En
+paralelo se envían comandos de motor por HTTP a --command-rate por
+segundo. Reporta throughput, p50/p95/p99 y frames perdidos.
+
+Ambos escenarios imprimen un reporte JSON; con --baseline se compara contra
+el reporte de una corrida anterior. Con --spawn se inicia el backend local
+(un proceso uvicorn con la base de datos configurada en .env; con
+DB_BACKEND=sqlite no hace falta un servidor MySQL).
+
+Uso (con el backend corriendo):
+    python test/loadtest.py --url http://localhost:8000 --devices 500 --dashboards 200
+    python test/loadtest.py --scenario traffic --devices 200 --dashboards 20 --rate 2 --duration 30
+    python test/loadtest.py --scenario traffic --spawn --output run.json --baseline previous.json
+    DB_BACKEND=sqlite SQLITE_PATH=/tmp/loadtest.db python test/loadtest.py --scenario traffic --spawn
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import websockets
+
+DEVICE_PREFIX = "LOAD-ESP-"
+DASHBOARD_PREFIX = "load-dash-"
+PASSWORD = "load-test-password"
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 2)
+
+def latency_summary(values_ms: List[float]) -> Dict:
+    return {
+        "count": len(values_ms),
+        "p50_ms": percentile(values_ms, 50),
+        "p95_ms": percentile(values_ms, 95),
+        "p99_ms": percentile(values_ms, 99),
+        "max_ms": round(max(values_ms), 2) if values_ms else None
+    }
+
+async def ensure_user(client: httpx.AsyncClient, name: str) -> Dict:
+    """Crea el usuario si no existe y retorna token e ID."""
+    await client.post("/users/", json={
+        "name": name,
+        "password": PASSWORD,
+        "location": "load-test",
+        "longitud": 0.0,
+        "latitud": 0.0
+    })
+    response = await client.post("/login", json={"username": name, "password": PASSWORD})
+    response.raise_for_status()
+    body = response.json()
+    return {"name": name, "token": body["access_token"], "id": body["user_data"]["id"]}
+
+# Dispositivos por petición a /api/esp/register/bulk
+REGISTER_BULK_SIZE = 1000
+
+async def register_pairs(client: httpx.AsyncClient, pairs: List[Tuple[int, str]], concurrency: int):
+    """Registra dispositivos asociados a usuarios; un mismo ESP puede aparecer con varios usuarios."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def register(chunk: List[Tuple[int, str]]):
+        async with semaphore:
+            response = await client.post("/api/esp/register/bulk", json={"devices": [
+                {
+                    "identification": device_id,
+                    "user": user_id,
+                    "sensors_data": {"temperature": 0, "humidity": 0}
+                }
+                for user_id, device_id in chunk
+            ]})
+            response.raise_for_status()
+
+    chunks = [pairs[start:start + REGISTER_BULK_SIZE] for start in range(0, len(pairs), REGISTER_BULK_SIZE)]
+    await asyncio.gather(*(register(chunk) for chunk in chunks))
+
+async def register_devices(client: httpx.AsyncClient, owner_id: int, device_ids: List[str], concurrency: int):
+    await register_pairs(client, [(owner_id, device_id) for device_id in device_ids], concurrency)
+
+class SocketStats:
+    def __init__(self):
+        self.connect_ms: List[float] = []
+        self.failures: Dict[str, int] = {}
+        self.open_sockets = []
+
+    def fail(self, reason: str):
+        self.failures[reason] = self.failures.get(reason, 0) + 1
+
+async def open_socket(url: str, stats: SocketStats, timeout: float):
+    start = time.perf_counter()
+    try:
+        ws = await asyncio.wait_for(websockets.connect(url, open_timeout=timeout), timeout)
+        stats.connect_ms.append((time.perf_counter() - start) * 1000)
+        stats.open_sockets.append(ws)
+    except Exception as e:
+        stats.fail(type(e).__name__)
+
+async def still_open(stats: SocketStats) -> int:
+    """Cuenta los sockets que siguen abiertos (el servidor no los cerró durante la espera)."""
+    alive = 0
+    for ws in stats.open_sockets:
+        try:
+            await asyncio.wait_for(ws.ping(), 5)
+            alive += 1
+        except Exception:
+            pass
+    return alive
+
+async def dashboard_users(client: httpx.AsyncClient, count: int, concurrency: int) -> List[Dict]:
+    """Un usuario por dashboard: el servidor mantiene una conexión por usuario."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def dashboard_user(index: int):
+        async with semaphore:
+            return await ensure_user(client, f"{DASHBOARD_PREFIX}{index:05d}")
+
+    return await asyncio.gather(*(dashboard_user(index) for index in range(count)))
+
+async def run_connections(args) -> Dict:
+    ws_base = args.url.replace("http://", "ws://").replace("https://", "wss://")
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=limits) as client:
+        owner = await ensure_user(client, f"{DASHBOARD_PREFIX}owner")
+        device_ids = [f"{DEVICE_PREFIX}{index:05d}" for index in range(args.devices)]
+        await register_devices(client, owner["id"], device_ids, args.concurrency)
+
+        dashboards = await dashboard_users(client, args.dashboards, args.concurrency)
+
+        esp_stats, frontend_stats = SocketStats(), SocketStats()
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(open_socket(f"{ws_base}/ws/esp/{device_id}", esp_stats, args.timeout) for device_id in device_ids),
+            *(open_socket(f"{ws_base}/ws/frontend?token={quote('Bearer ' + user['token'])}", frontend_stats, args.timeout)
+              for user in dashboards)
+        )
+        connect_seconds = time.perf_counter() - start
+
+        # Con todos los sockets abiertos, el pool no debería tener conexiones retenidas
+        health = (await client.get("/health")).json()
+        await asyncio.sleep(args.hold)
+
+        esp_alive = await still_open(esp_stats)
+        frontend_alive = await still_open(frontend_stats)
+        for ws in esp_stats.open_sockets + frontend_stats.open_sockets:
+            await ws.close()
+
+    return {
+        "scenario": "connections",
+        "devices": args.devices,
+        "dashboards": args.dashboards,
+        "connect_seconds": round(connect_seconds, 3),
+        "esp": {
+            "connected": len(esp_stats.open_sockets),
+            "alive_after_hold": esp_alive,
+            "failures": esp_stats.failures,
+            "connect_latency": latency_summary(esp_stats.connect_ms)
+        },
+        "frontend": {
+            "connected": len(frontend_stats.open_sockets),
+            "alive_after_hold": frontend_alive,
+            "failures": frontend_stats.failures,
+            "connect_latency": latency_summary(frontend_stats.connect_ms)
+        },
+        "db_pool_while_connected": health.get("db_pool")
+    }
+
+class TrafficStats:
+    """Envíos y recepciones del escenario traffic (todos en el mismo reloj)."""
+
+    def __init__(self):
+        self.sent_at: Dict[Tuple[str, int], float] = {}
+        self.expected = 0
+        self.late_sends = 0
+        self.send_errors: Dict[str, int] = {}
+        self.received: set = set()
+        self.latency_ms: List[float] = []
+        self.duplicates = 0
+        self.unexpected = 0
+        self.motor_commands_received = 0
+        self.command_ms: List[float] = []
+        self.command_results: Dict[str, int] = {}
+
+    def count(self, table: Dict[str, int], key: str):
+        table[key] = table.get(key, 0) + 1
+
+async def simulated_esp(ws, device_id: str, watchers: int, args, stats: TrafficStats, stop_at: float):
+    """
+    ESP simulado: envía SENSOR_DATA a ``args.rate`` por segundo con la
+    secuencia en ``temperature`` (para reconocer cada mensaje en el
+    dashboard) y confirma los MOTOR_COMMAND como el firmware.
+    """
+    async def reply_commands():
+        try:
+            async for raw in ws:
+                message = json.loads(raw)
+                if message.get("type") == "MOTOR_COMMAND":
+                    stats.motor_commands_received += 1
+                    await ws.send(json.dumps({
+                        "type": "MOTOR_STATUS",
+                        "status": "RUNNING" if message.get("action") == "START_MOTOR" else "STOPPED",
+                        "deviceId": device_id,
+                        "command_id": message.get("command_id")
+                    }))
+        except websockets.ConnectionClosed:
+            pass
+
+    listener = asyncio.create_task(reply_commands())
+    interval = 1 / args.rate
+    # Desfase aleatorio para no enviar todos los ESP en el mismo instante
+    next_send = time.perf_counter() + random.random() * interval
+    try:
+        for seq in itertools.count():
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -interval:
+                stats.late_sends += 1
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+            stats.sent_at[(device_id, seq)] = now
+            stats.expected += watchers
+            try:
+                await ws.send(json.dumps({"type": "SENSOR_DATA", "temperature": seq, "humidity": 50}))
+            except websockets.ConnectionClosed as e:
+                stats.count(stats.send_errors, type(e).__name__)
+                break
+            next_send += interval
+    finally:
+        listener.cancel()
+
+async def dashboard_reader(ws, name: str, stats: TrafficStats):
+    """Registra la latencia de cada ESP_DATA recibido por un dashboard."""
+    try:
+        async for raw in ws:
+            received = time.perf_counter()
+            message = json.loads(raw)
+            if message.get("type") != "ESP_DATA":
+                continue
+            data = message.get("data") or {}
+            # Los MOTOR_STATUS también generan ESP_DATA: solo cuentan las lecturas
+            if "motor_status" in data:
+                continue
+            key = (message.get("device_id"), data.get("temperature"))
+            sent = stats.sent_at.get(key)
+            if sent is None:
+                stats.unexpected += 1
+                continue
+            receipt = (name, *key)
+            if receipt in stats.received:
+                stats.duplicates += 1
+                continue
+            stats.received.add(receipt)
+            stats.latency_ms.append((received - sent) * 1000)
+    except websockets.ConnectionClosed:
+        pass
+
+async def motor_commands(client: httpx.AsyncClient, device_ids: List[str], args, stats: TrafficStats, stop_at: float):
+    """Comandos de motor por HTTP a ``args.command_rate`` por segundo, esperando la confirmación."""
+    tasks = []
+
+    async def command(index: int):
+        device_id = random.choice(device_ids)
+        action = "START_MOTOR" if index % 2 == 0 else "STOP_MOTOR"
+        start = time.perf_counter()
+        try:
+            response = await client.post(
+                f"/api/esp/{device_id}/motor", json={"action": action}, params={"wait_ack": True}
+            )
+        except httpx.HTTPError as e:
+            stats.count(stats.command_results, type(e).__name__)
+            return
+        stats.count(stats.command_results, f"http_{response.status_code}")
+        if response.status_code == 200:
+            stats.command_ms.append((time.perf_counter() - start) * 1000)
+
+    interval = 1 / args.command_rate
+    next_send = time.perf_counter()
+    for index in itertools.count():
+        await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+        if time.perf_counter() >= stop_at:
+            break
+        tasks.append(asyncio.create_task(command(index)))
+        next_send += interval
+    await asyncio.gather(*tasks)
+
+def watched_by(device_index: int, dashboards: int, watchers: int) -> List[int]:
+    """Dashboards que miran un ESP: ``watchers`` consecutivos, repartidos en ronda."""
+    if dashboards == 0:
+        return []
+    return sorted({(device_index * watchers + offset) % dashboards for offset in range(min(watchers, dashboards))})
+
+async def run_traffic(args) -> Dict:
+    ws_base = args.url.replace("http://", "ws://").replace("https://", "wss://")
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=limits) as client:
+        owner = await ensure_user(client, f"{DASHBOARD_PREFIX}owner")
+        dashboards = await dashboard_users(client, args.dashboards, args.concurrency)
+
+        device_ids = [f"{DEVICE_PREFIX}{index:05d}" for index in range(args.devices)]
+        watchers = {device_id: watched_by(index, args.dashboards, args.watchers) for index, device_id in enumerate(device_ids)}
+        pairs = [(owner["id"], device_id) for device_id in device_ids]
+        pairs += [(dashboards[dashboard]["id"], device_id) for device_id in device_ids for dashboard in watchers[device_id]]
+        await register_pairs(client, pairs, args.concurrency)
+
+        # Dashboards: suscripción por lotes sin agrupación, para medir cada mensaje
+        stats = TrafficStats()
+        frontends, readers = [], []
+        for index, user in enumerate(dashboards):
+            ws = await websockets.connect(f"{ws_base}/ws/frontend?token={quote('Bearer ' + user['token'])}")
+            watched = [device_id for device_id in device_ids if index in watchers[device_id]]
+            await ws.send(json.dumps({"type": "SUBSCRIBE", "device_ids": watched, "interval_ms": 0}))
+            while json.loads(await ws.recv()).get("type") != "ESP_SNAPSHOT":
+                pass
+            frontends.append(ws)
+            readers.append(asyncio.create_task(dashboard_reader(ws, user["name"], stats)))
+
+        esps = [await websockets.connect(f"{ws_base}/ws/esp/{device_id}") for device_id in device_ids]
+        # Dar tiempo a que los ESP queden registrados antes de enviar comandos
+        await asyncio.sleep(0.5)
+
+        started = time.perf_counter()
+        stop_at = started + args.duration
+        senders = [
+            simulated_esp(ws, device_id, len(watchers[device_id]), args, stats, stop_at)
+            for ws, device_id in zip(esps, device_ids)
+        ]
+        if args.command_rate > 0:
+            senders.append(motor_commands(client, device_ids, args, stats, stop_at))
+        await asyncio.gather(*senders)
+        duration = time.perf_counter() - started
+
+        # Esperar los mensajes en vuelo antes de contar los perdidos
+        deadline = time.perf_counter() + args.drain
+        while len(stats.received) < stats.expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+
+        health = (await client.get("/health")).json()
+        for task in readers:
+            task.cancel()
+        for ws in esps + frontends:
+            await ws.close()
+
+    sent = len(stats.sent_at)
+    delivered = len(stats.received)
+    return {
+        "scenario": "traffic",
+        "devices": args.devices,
+        "dashboards": args.dashboards,
+        "watchers": args.watchers,
+        "rate_per_device": args.rate,
+        "duration_seconds": round(duration, 3),
+        "throughput": {
+            "sent": sent,
+            "sent_per_second": round(sent / duration, 1),
+            "delivered": delivered,
+            "delivered_per_second": round(delivered / duration, 1),
+            "late_sends": stats.late_sends,
+            "send_errors": stats.send_errors
+        },
+        "end_to_end_latency": latency_summary(stats.latency_ms),
+        "dropped_frames": stats.expected - delivered,
+        "dropped_ratio": round((stats.expected - delivered) / stats.expected, 5) if stats.expected else 0,
+        "duplicate_frames": stats.duplicates,
+        "unexpected_frames": stats.unexpected,
+        "motor_commands": {
+            "rate": args.command_rate,
+            "results": stats.command_results,
+            "received_by_esp": stats.motor_commands_received,
+            "ack_latency": latency_summary(stats.command_ms)
+        },
+        "server": {
+            "ingest": health.get("ingest"),
+            "commands": health.get("commands"),
+            "db_pool": health.get("db_pool")
+        }
+    }
+
+# Métricas que se comparan con --baseline: (ruta en el reporte, True si mayor es mejor)
+COMPARED_METRICS = {
+    "connections": [
+        (("connect_seconds",), False),
+        (("esp", "connect_latency", "p95_ms"), False),
+        (("frontend", "connect_latency", "p95_ms"), False)
+    ],
+    "traffic": [
+        (("throughput", "delivered_per_second"), True),
+        (("end_to_end_latency", "p50_ms"), False),
+        (("end_to_end_latency", "p95_ms"), False),
+        (("end_to_end_latency", "p99_ms"), False),
+        (("dropped_ratio",), False),
+        (("motor_commands", "ack_latency", "p95_ms"), False)
+    ]
+}
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> Dict:
+    """
+    Compara las métricas principales contra un reporte anterior del mismo escenario.
+
+    Una métrica es regresión si empeora más que ``tolerance`` (fracción).
+    """
+    def lookup(data: Dict, path: Tuple[str, ...]):
+        for key in path:
+            data = data.get(key) if isinstance(data, dict) else None
+        return data
+
+    metrics, regressions = {}, []
+    for path, higher_is_better in COMPARED_METRICS[report["scenario"]]:
+        name = ".".join(path)
+        current, previous = lookup(report, path), lookup(baseline, path)
+        if current is None or previous is None:
+            continue
+        if previous:
+            change = (current - previous) / previous
+            worse = (-change if higher_is_better else change) > tolerance
+        else:
+            # Sin base relativa (p. ej. 0 frames perdidos): cualquier empeoramiento cuenta
+            change = None
+            worse = current < previous if higher_is_better else current > previous
+        metrics[name] = {"baseline": previous, "current": current, "change": None if change is None else round(change, 4)}
+        if worse:
+            regressions.append(name)
+    return {"tolerance": tolerance, "metrics": metrics, "regressions": regressions}
+
+# ----------------------------------------------------------------------
+# Backend local (--spawn)
+# ----------------------------------------------------------------------
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend")
+DEFAULT_APP_COMMAND = "{python} -m uvicorn main:app --host 127.0.0.1 --port {port}"
+
+def spawn(command: str, env: Dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(shlex.split(command), cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+async def wait_ready(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.3)
+    raise RuntimeError(f"El worker {url} no respondió en {timeout}s")
+
+async def run(args) -> Dict:
+    scenario = run_traffic if args.scenario == "traffic" else run_connections
+    if not args.spawn:
+        return await scenario(args)
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    env = dict(os.environ, WAL_DIRECTORY=os.path.join(workdir, "wal"))
+    process = spawn(args.app_command.format(python=sys.executable, port=args.port), env,
+                    os.path.join(workdir, "backend.log"))
+    try:
+        args.url = f"http://127.0.0.1:{args.port}"
+        await wait_ready(args.url, args.startup_timeout)
+        report = await scenario(args)
+        report["logs"] = workdir
+        return report
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=("connections", "traffic"), default="connections", help="Escenario a ejecutar")
+    parser.add_argument("--url", default="http://localhost:8000", help="URL base del backend")
+    parser.add_argument("--devices", type=int, default=100, help="Sockets de ESP a abrir")
+    parser.add_argument("--dashboards", type=int, default=50, help="Sockets de dashboard a abrir")
+    parser.add_argument("--hold", type=float, default=10, help="connections: segundos que se mantienen abiertos")
+    parser.add_argument("--timeout", type=float, default=30, help="connections: tiempo máximo por conexión")
+    parser.add_argument("--rate", type=float, default=1, help="traffic: SENSOR_DATA por segundo de cada ESP")
+    parser.add_argument("--duration", type=float, default=30, help="traffic: segundos de envío")
+    parser.add_argument("--watchers", type=int, default=1, help="traffic: dashboards suscritos a cada ESP")
+    parser.add_argument("--command-rate", type=float, default=1, help="traffic: comandos de motor por segundo (0 = ninguno)")
+    parser.add_argument("--drain", type=float, default=5, help="traffic: espera máxima de los mensajes en vuelo al terminar")
+    parser.add_argument("--concurrency", type=int, default=10, help="Peticiones HTTP simultáneas")
+    parser.add_argument("--spawn", action="store_true", help="Iniciar el backend local en --port")
+    parser.add_argument("--port", type=int, default=8090, help="Puerto del backend iniciado con --spawn")
+    parser.add_argument("--app-command", default=DEFAULT_APP_COMMAND, help="Comando del backend; admite {python} y {port}")
+    parser.add_argument("--startup-timeout", type=float, default=30, help="Espera máxima del backend iniciado")
+    parser.add_argument("--output", help="Archivo donde guardar el reporte JSON")
+    parser.add_argument("--baseline", help="Reporte JSON anterior con el que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Empeoramiento relativo que se marca como regresión")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report, json.load(f), args.tolerance)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+    if report.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Arnés de varios workers: levanta N instancias del backend que comparten un
+broker RESP y mide la latencia de los comandos de motor cuando el ESP está
+conectado a un worker distinto del que recibe la petición HTTP.
+
+Por defecto inicia el stand-in RESP (test/resp_standin.py) y N procesos
+uvicorn en puertos consecutivos, cada uno con su NODE_ID y su directorio de
+WAL. Los ESP simulados se reparten entre los workers y cada comando se envía
+a un worker elegido al azar; el reporte separa los comandos locales de los
+reenviados.
+
+Uso (con la base de datos configurada en .env):
+    python test/multiworker.py --workers 4 --devices 40 --commands 400
+    python test/multiworker.py --broker-url redis://localhost:6379/0 --workers 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+import websockets
+
+from loadtest import (
+    DEVICE_PREFIX, DASHBOARD_PREFIX, DEFAULT_APP_COMMAND, ensure_user, register_devices, latency_summary, spawn, wait_ready
+)
+
+STANDIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resp_standin.py")
+
+async def esp_listener(ws, received: Dict[str, List[float]], device_id: str):
+    """
+    Registra el instante en que el ESP simulado recibe cada MOTOR_COMMAND y
+    lo confirma con un MOTOR_STATUS que devuelve el command_id, como el firmware.
+    """
+    try:
+        async for raw in ws:
+            message = json.loads(raw)
+            if message.get("type") == "MOTOR_COMMAND":
+                received.setdefault(device_id, []).append(time.perf_counter())
+                await ws.send(json.dumps({
+                    "type": "MOTOR_STATUS",
+                    "status": "RUNNING" if message.get("action") == "START_MOTOR" else "STOPPED",
+                    "deviceId": device_id,
+                    "command_id": message.get("command_id")
+                }))
+    except websockets.ConnectionClosed:
+        pass
+
+async def run_scenario(args, urls: List[str]) -> Dict:
+    async with httpx.AsyncClient(base_url=urls[0], timeout=60) as client:
+        owner = await ensure_user(client, f"{DASHBOARD_PREFIX}owner")
+        device_ids = [f"{DEVICE_PREFIX}{index:05d}" for index in range(args.devices)]
+        await register_devices(client, owner["id"], device_ids, args.concurrency)
+
+    # Repartir los ESP entre los workers
+    home: Dict[str, int] = {}
+    sockets = []
+    received: Dict[str, List[float]] = {}
+    listeners = []
+    for index, device_id in enumerate(device_ids):
+        worker = index % len(urls)
+        ws_url = urls[worker].replace("http://", "ws://") + f"/ws/esp/{device_id}"
+        ws = await websockets.connect(ws_url)
+        home[device_id] = worker
+        sockets.append(ws)
+        listeners.append(asyncio.create_task(esp_listener(ws, received, device_id)))
+
+    # Dar tiempo a que los leases queden registrados
+    await asyncio.sleep(0.5)
+
+    results = {"local": [], "forwarded": []}
+    delivery_ms: List[float] = []
+    failures: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    clients = [httpx.AsyncClient(base_url=url, timeout=30) for url in urls]
+
+    async def command(index: int):
+        device_id = random.choice(device_ids)
+        worker = random.randrange(len(urls))
+        action = "START_MOTOR" if index % 2 == 0 else "STOP_MOTOR"
+        async with semaphore:
+            before = len(received.get(device_id, []))
+            start = time.perf_counter()
+            try:
+                response = await clients[worker].post(
+                    f"/api/esp/{device_id}/motor", json={"action": action}, params={"wait_ack": args.wait_ack}
+                )
+            except httpx.HTTPError as e:
+                failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+                return
+            elapsed = (time.perf_counter() - start) * 1000
+            if response.status_code != 200:
+                key = f"http_{response.status_code}"
+                failures[key] = failures.get(key, 0) + 1
+                return
+            results["local" if worker == home[device_id] else "forwarded"].append(elapsed)
+
+            # Latencia hasta que el ESP recibe el comando
+            for _ in range(100):
+                arrivals = received.get(device_id, [])
+                if len(arrivals) > before:
+                    delivery_ms.append((arrivals[before] - start) * 1000)
+                    break
+                await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(command(index) for index in range(args.commands)))
+    duration = time.perf_counter() - started
+
+    for http_client in clients:
+        await http_client.aclose()
+    for ws in sockets:
+        await ws.close()
+    for task in listeners:
+        task.cancel()
+
+    return {
+        "scenario": "multiworker",
+        "workers": len(urls),
+        "devices": args.devices,
+        "commands": args.commands,
+        "wait_ack": args.wait_ack,
+        "duration_seconds": round(duration, 3),
+        "http_latency": {
+            "local": latency_summary(results["local"]),
+            "forwarded": latency_summary(results["forwarded"])
+        },
+        "esp_delivery_latency": latency_summary(delivery_ms),
+        "failures": failures
+    }
+
+async def run(args) -> Dict:
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="multiworker-")
+    broker_url = args.broker_url
+    try:
+        if not broker_url:
+            processes.append(spawn(f"{sys.executable} {STANDIN} --port {args.standin_port}", dict(os.environ),
+                                   os.path.join(workdir, "standin.log")))
+            broker_url = f"redis://127.0.0.1:{args.standin_port}/0"
+            await asyncio.sleep(0.5)
+
+        urls = []
+        for index in range(args.workers):
+            port = args.base_port + index
+            env = dict(os.environ,
+                       BROKER_URL=broker_url,
+                       NODE_ID=f"worker-{index}",
+                       WAL_DIRECTORY=os.path.join(workdir, f"wal-{index}"))
+            command = args.app_command.format(python=sys.executable, port=port)
+            processes.append(spawn(command, env, os.path.join(workdir, f"worker-{index}.log")))
+            urls.append(f"http://127.0.0.1:{port}")
+            # Uno a la vez: todos crean las tablas al importar la app
+            await wait_ready(urls[-1], args.startup_timeout)
+
+        report = await run_scenario(args, urls)
+        report["logs"] = workdir
+        return report
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3, help="Workers del backend a iniciar")
+    parser.add_argument("--base-port", type=int, default=8100, help="Puerto del primer worker")
+    parser.add_argument("--broker-url", help="Broker existente; si se omite se inicia el stand-in RESP")
+    parser.add_argument("--standin-port", type=int, default=6390, help="Puerto del stand-in RESP")
+    parser.add_argument("--app-command", default=DEFAULT_APP_COMMAND,
+                        help="Comando de cada worker; admite {python} y {port}")
+    parser.add_argument("--devices", type=int, default=30, help="ESP simulados")
+    parser.add_argument("--commands", type=int, default=300, help="Comandos de motor a enviar")
+    parser.add_argument("--concurrency", type=int, default=10, help="Peticiones HTTP simultáneas")
+    parser.add_argument("--wait-ack", action="store_true", help="Esperar la confirmación del ESP en cada comando")
+    parser.add_argument("--startup-timeout", type=float, default=30, help="Espera máxima por worker")
+    parser.add_argument("--output", help="Archivo donde guardar el reporte JSON")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
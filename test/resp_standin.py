@@ -0,0 +1,193 @@
+"""
+Servidor mínimo compatible con RESP para probar el broker sin Redis.
+
+Implementa solo los comandos que usa el backend: PING, AUTH, SELECT,
+PUBLISH, SUBSCRIBE, UNSUBSCRIBE, SET (con NX/XX/PX/EX), GET, DEL y EVAL
+(únicamente los scripts de leases definidos en PubSubBroker, no Lua en
+general). Todo vive en memoria de un proceso; no es un reemplazo de Redis.
+
+Uso:
+    python test/resp_standin.py --port 6390
+    BROKER_URL=redis://127.0.0.1:6390/0 uvicorn main:app --workers 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Dict, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+from app.utils.PubSubBroker import RENEW_IF_EQUAL_SCRIPT, DELETE_IF_EQUAL_SCRIPT
+
+
+def encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, Exception):
+        return f"-ERR {value}\r\n".encode()
+    if isinstance(value, list):
+        return f"*{len(value)}\r\n".encode() + b"".join(encode(item) for item in value)
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return f"${len(value)}\r\n".encode() + value + b"\r\n"
+
+OK = b"+OK\r\n"
+
+
+class Client:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.channels: Set[str] = set()
+
+
+class StandinServer:
+    def __init__(self):
+        self.values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self.channels: Dict[str, Set[Client]] = {}
+        self.clients: Set[Client] = set()
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    async def _read_command(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.decode().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = await reader.readline()
+            length = int(header[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2].decode("utf-8"))
+        return args
+
+    def _set(self, args) -> bytes:
+        key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+        expires_at = None
+        if "PX" in options:
+            expires_at = time.monotonic() + int(args[2 + options.index("PX") + 1]) / 1000
+        elif "EX" in options:
+            expires_at = time.monotonic() + int(args[2 + options.index("EX") + 1])
+        exists = self._get(key) is not None
+        if ("NX" in options and exists) or ("XX" in options and not exists):
+            return encode(None)
+        self.values[key] = (value, expires_at)
+        return OK
+
+    def _eval(self, args) -> bytes:
+        script, key, value = args[0], args[2], args[3]
+        if self._get(key) != value:
+            return encode(0)
+        if script == RENEW_IF_EQUAL_SCRIPT:
+            self.values[key] = (value, time.monotonic() + int(args[4]) / 1000)
+            return encode(1)
+        if script == DELETE_IF_EQUAL_SCRIPT:
+            del self.values[key]
+            return encode(1)
+        return encode(Exception("script no soportado por el stand-in"))
+
+    def _publish(self, channel: str, message: str) -> int:
+        subscribers = self.channels.get(channel, set())
+        frame = encode(["message", channel, message])
+        for client in subscribers:
+            client.writer.write(frame)
+        return len(subscribers)
+
+    def _subscription(self, client: Client, kind: str, channels) -> bytes:
+        frames = []
+        for channel in channels:
+            if kind == "subscribe":
+                client.channels.add(channel)
+                self.channels.setdefault(channel, set()).add(client)
+            else:
+                client.channels.discard(channel)
+                self.channels.get(channel, set()).discard(client)
+            frames.append(encode([kind, channel, len(client.channels)]))
+        return b"".join(frames)
+
+    def execute(self, client: Client, args) -> bytes:
+        name, args = args[0].upper(), args[1:]
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name in ("AUTH", "SELECT"):
+            return OK
+        if name == "GET":
+            return encode(self._get(args[0]))
+        if name == "MGET":
+            return encode([self._get(key) for key in args])
+        if name == "SET":
+            return self._set(args)
+        if name == "DEL":
+            return encode(sum(1 for key in args if self.values.pop(key, None) is not None))
+        if name == "EVAL":
+            return self._eval(args)
+        if name == "PUBLISH":
+            return encode(self._publish(args[0], args[1]))
+        if name == "SUBSCRIBE":
+            return self._subscription(client, "subscribe", args)
+        if name == "UNSUBSCRIBE":
+            return self._subscription(client, "unsubscribe", args or list(client.channels))
+        return encode(Exception(f"unknown command '{name}'"))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = Client(writer)
+        self.clients.add(client)
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if args:
+                    writer.write(self.execute(client, args))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.discard(client)
+            for channel in client.channels:
+                self.channels.get(channel, set()).discard(client)
+            writer.close()
+
+    def drop_connections(self) -> None:
+        """Cierra todas las conexiones de clientes, como un reinicio de Redis (para pruebas)."""
+        for client in list(self.clients):
+            client.writer.close()
+
+
+async def start_standin(host: str = "127.0.0.1", port: int = 0) -> Tuple[StandinServer, asyncio.AbstractServer]:
+    """Inicia el stand-in en el event loop actual (``port=0``: un puerto libre)."""
+    standin = StandinServer()
+    server = await asyncio.start_server(standin.handle, host, port)
+    return standin, server
+
+async def serve(host: str, port: int):
+    _, server = await start_standin(host, port)
+    print(f"Stand-in RESP escuchando en {host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import select
+
+from app.database.modelsDB import Esp, SensorReading
+from app.utils.BufferManager import DataBufferManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """Buffer independiente del singleton, con su WAL en un directorio temporal."""
+    instance = object.__new__(DataBufferManager)
+    instance.WAL_DIRECTORY = str(tmp_path / "wal")
+    instance.BUFFER_FILE = str(tmp_path / "legacy.json")
+    instance.QUARANTINE_FILE = str(tmp_path / "quarantine.jsonl")
+    instance.FLUSH_RETRY_MIN_S = 0.01
+    instance.FLUSH_RETRY_MAX_S = 0.04
+    instance.initialize()
+    yield instance
+    if instance._retry_task is not None:
+        instance._retry_task.cancel()
+    instance.wal.close()
+
+
+class FakeDatabase:
+    """Reemplaza _write_batch: registra los lotes o falla como una BD caída."""
+
+    def __init__(self):
+        self.down = True
+        self.attempts = 0
+        self.written = []
+
+    def write_batch(self, db, batch):
+        self.attempts += 1
+        if self.down:
+            raise RuntimeError("BD caída")
+        if any("poison" in item["data"] for item in batch):
+            raise ValueError("lectura inválida")
+        self.written.extend(batch)
+
+    async def ping(self):
+        if self.down:
+            raise RuntimeError("BD caída")
+
+
+def entry(index: int):
+    return {"device_id": "TEST-ESP", "data": {"temperature": index}, "ts": 1700000000000 + index}
+
+
+def test_outage_makes_one_attempt_and_keeps_wal_segments(manager):
+    # Espera mayor que lo que tardan las 300 lecturas
+    manager.FLUSH_RETRY_MIN_S = 0.3
+    manager.FLUSH_RETRY_MAX_S = 1
+
+    async def scenario():
+        fake = FakeDatabase()
+        manager._write_batch = fake.write_batch
+
+        for index in range(300):
+            manager._append(entry(index))
+            await asyncio.sleep(0)
+        # Un solo intento al cruzar el umbral; las lecturas siguientes no programan más
+        assert fake.attempts == 1
+        assert manager.stats()["failed_batch"] == manager.BATCH_SIZE
+        # El segmento del lote fallido y el activo: no uno por lectura
+        assert len(manager.wal._segment_ids()) == 2
+
+        fake.down = False
+        await asyncio.sleep(manager.FLUSH_RETRY_MIN_S * 1.5)
+        assert len(fake.written) == 300
+        assert [item["data"]["temperature"] for item in fake.written] == list(range(300))
+        assert manager.stats()["failed_batch"] == 0
+        assert manager.buffer == []
+        assert manager.wal._segment_ids() == [manager.wal.segment_id]
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_backs_off_exponentially(manager):
+    # Esperas largas: en esta prueba los reintentos solo se fuerzan
+    manager.FLUSH_RETRY_MIN_S = 1
+    manager.FLUSH_RETRY_MAX_S = 4
+
+    async def scenario():
+        fake = FakeDatabase()
+        manager._write_batch = fake.write_batch
+        for index in range(manager.BATCH_SIZE):
+            manager._append(entry(index))
+        await manager.process_batch()
+        assert fake.attempts == 1
+        assert manager._retry_delay == 1
+
+        # Antes de que venza la espera no se reintenta
+        await manager.process_batch()
+        assert fake.attempts == 1
+
+        delays = []
+        for _ in range(3):
+            await manager.process_batch(force=True)
+            delays.append(manager._retry_delay)
+        assert fake.attempts == 4
+        assert delays == [2, 4, 4]
+
+    asyncio.run(scenario())
+
+
+def test_permanently_failing_entry_goes_to_quarantine(manager):
+    manager.FLUSH_RETRY_MIN_S = 1
+    manager.FLUSH_MAX_ATTEMPTS = 3
+
+    async def scenario():
+        fake = FakeDatabase()
+        fake.down = False
+        manager._write_batch = fake.write_batch
+        manager._ping = fake.ping
+        batch = [entry(index) for index in range(manager.BATCH_SIZE)]
+        batch[17] = {"device_id": "TEST-ESP", "data": {"poison": True}, "ts": 1700000000017}
+        for item in batch:
+            manager._append(item)
+
+        await manager.process_batch()
+        for _ in range(manager.FLUSH_MAX_ATTEMPTS - 1):
+            await manager.process_batch(force=True)
+        assert manager.stats()["failed_attempts"] == manager.FLUSH_MAX_ATTEMPTS
+        assert fake.written == []
+
+        # Con la BD respondiendo, el lote se divide y solo la lectura inválida queda fuera
+        await manager.process_batch(force=True)
+        assert len(fake.written) == manager.BATCH_SIZE - 1
+        assert manager.stats()["failed_batch"] == 0
+        assert manager.stats()["quarantined"] == 1
+        with open(manager.QUARANTINE_FILE) as f:
+            [record] = [json.loads(line) for line in f]
+        assert record["entry"] == batch[17]
+        assert record["error"] == "lectura inválida"
+        # El WAL se libera: la lectura no se vuelve a cargar al reiniciar
+        assert manager.wal._segment_ids() == [manager.wal.segment_id]
+
+    asyncio.run(scenario())
+
+
+def test_outage_is_not_quarantined(manager):
+    manager.FLUSH_RETRY_MIN_S = 1
+    manager.FLUSH_MAX_ATTEMPTS = 1
+
+    async def scenario():
+        fake = FakeDatabase()
+        manager._write_batch = fake.write_batch
+        manager._ping = fake.ping
+        for index in range(manager.BATCH_SIZE):
+            manager._append(entry(index))
+        await manager.process_batch()
+
+        # La BD tampoco responde a la consulta mínima: el lote sigue esperando entero
+        await manager.process_batch(force=True)
+        assert fake.attempts == 1
+        assert manager.stats()["failed_batch"] == manager.BATCH_SIZE
+        assert manager.stats()["quarantined"] == 0
+
+        fake.down = False
+        await manager.process_batch(force=True)
+        assert len(fake.written) == manager.BATCH_SIZE
+        assert manager.stats()["quarantined"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_buffer_stops_draining_queue_during_outage(manager):
+    manager.INGEST_BUFFER_MAX_SIZE = 100
+
+    async def scenario():
+        fake = FakeDatabase()
+        manager._write_batch = fake.write_batch
+        writer = asyncio.create_task(manager._writer())
+        try:
+            for index in range(400):
+                await manager.submit("TEST-ESP", {"temperature": index})
+                await asyncio.sleep(0)
+            # El buffer queda acotado y lo demás espera en la cola (con su política)
+            assert len(manager.buffer) <= manager.INGEST_BUFFER_MAX_SIZE
+            assert manager.stats()["queue_depth"] > 0
+
+            fake.down = False
+            await asyncio.sleep(manager.FLUSH_RETRY_MIN_S * 3)
+            await manager._queue.join()
+            await manager.process_batch(force=True)
+            assert len(fake.written) == 400
+        finally:
+            writer.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_write_batch_keeps_valid_readings_next_to_malformed_values(manager, db):
+    esp = Esp(identification="TEST-ESP")
+    db.add(esp)
+    db.flush()
+    batch = [entry(index) for index in range(60)]
+    for index, value in enumerate(("25.1", {"value": 25}, float("nan"), float("inf"))):
+        batch.append({"device_id": "TEST-ESP", "data": {"temperature": value}, "ts": 1700000001000 + index})
+
+    manager._write_batch(db, batch)
+
+    stored = db.execute(
+        select(SensorReading.ts, SensorReading.temperature).where(SensorReading.esp_id == esp.id)
+    ).all()
+    assert len(stored) == 64
+    assert sorted(value for _, value in stored if value is not None)[-1] == 59.0
+    assert [value for ts, value in sorted(stored) if ts > 1700000000999] == [25.1, None, None, None]
+
+
+@pytest.mark.parametrize("policy, dropped, coalesced", [
+    ("drop_oldest", 3, 0),
+    ("coalesce", 0, 2)
+])
+def test_overflow_counters_exclude_discarded_readings(manager, policy, dropped, coalesced):
+    manager.overflow_policy = policy
+    manager._queue = asyncio.Queue(maxsize=2)
+
+    async def scenario():
+        results = [await manager.submit("TEST-ESP", {"temperature": index}) for index in range(5)]
+        assert results == [True, True, False, False, False]
+        stats = manager.stats()
+        assert stats["received"] == 5
+        assert (stats["dropped"], stats["coalesced"]) == (dropped, coalesced)
+        # Solo las aceptadas llegan al WAL
+        assert stats["accepted"] == 5 - dropped - coalesced
+        while not manager._queue.empty():
+            manager._append_many(manager._queue.get_nowait())
+        manager._drain_coalesced()
+        assert len(manager.buffer) == stats["accepted"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,139 @@
+import asyncio
+
+from app.utils import WsManager
+from app.utils.CommandTracker import CommandTracker
+
+
+def start(action: str):
+    return {"type": "MOTOR_COMMAND", "action": action}
+
+
+def test_status_with_command_id_resolves_that_command():
+    async def scenario():
+        tracker = CommandTracker()
+        first = tracker.track("ESP", start("START_MOTOR"))
+        second = tracker.track("ESP", start("START_MOTOR"))
+        tracker.mark_sent(first)
+        tracker.mark_sent(second)
+
+        assert tracker.acknowledge("ESP", {"status": "RUNNING", "command_id": second.command_id}) is second
+        result = second.future.result()
+        assert result["acknowledged"] is True
+        assert result["status"] == "RUNNING"
+        assert result["attempts"] == 1
+        assert not first.future.done()
+        assert list(tracker.pending) == [first.command_id]
+
+        # Un ID desconocido o de otro dispositivo no confirma nada
+        assert tracker.acknowledge("ESP", {"status": "RUNNING", "command_id": "otro"}) is None
+        assert tracker.acknowledge("OTHER", {"status": "RUNNING", "command_id": first.command_id}) is None
+        assert not first.future.done()
+
+    asyncio.run(scenario())
+
+
+def test_status_without_command_id_resolves_oldest_matching_action():
+    async def scenario():
+        tracker = CommandTracker()
+        stop = tracker.track("ESP", start("STOP_MOTOR"))
+        first_start = tracker.track("ESP", start("START_MOTOR"))
+        second_start = tracker.track("ESP", start("START_MOTOR"))
+
+        # RUNNING no confirma STOP_MOTOR: se salta y confirma el START más antiguo
+        assert tracker.acknowledge("ESP", {"status": "RUNNING"}) is first_start
+        assert tracker.acknowledge("ESP", {"status": "COMPLETED"}) is second_start
+        assert tracker.acknowledge("ESP", {"status": "RUNNING"}) is None
+        assert tracker.acknowledge("ESP", {"status": "STOPPED"}) is stop
+        assert tracker.pending == {}
+        assert tracker._by_device == {}
+        assert tracker.stats()["acked"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_expire_and_cancel_device_resolve_without_exception():
+    async def scenario():
+        tracker = CommandTracker()
+        lost = tracker.track("ESP", start("START_MOTOR"))
+        tracker.mark_sent(lost)
+        tracker.expire(lost)
+        assert lost.future.result() == {
+            "command_id": lost.command_id,
+            "acknowledged": False,
+            "status": "TIMEOUT",
+            "attempts": 1,
+            "rtt_ms": None
+        }
+        # Un comando ya resuelto no se vuelve a contar
+        tracker.expire(lost)
+        assert tracker.timeouts == 1
+
+        pending = [tracker.track("ESP", start("START_MOTOR")), tracker.track("ESP", start("STOP_MOTOR"))]
+        other = tracker.track("OTHER", start("START_MOTOR"))
+        tracker.cancel_device("ESP")
+        assert [item.future.result()["status"] for item in pending] == ["DISCONNECTED", "DISCONNECTED"]
+        assert tracker.timeouts == 1
+        assert list(tracker.pending) == [other.command_id]
+        assert tracker.device_stats("ESP")["pending"] == 0
+
+        # Una confirmación tardía ya no encuentra el comando
+        assert tracker.acknowledge("ESP", {"status": "RUNNING", "command_id": pending[0].command_id}) is None
+
+    asyncio.run(scenario())
+
+
+class FakeEsp:
+    """WebSocket de un ESP que registra los comandos recibidos sin confirmarlos."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+def test_unacknowledged_command_is_resent_with_same_id_then_expired(monkeypatch):
+    tracker = CommandTracker()
+    monkeypatch.setattr(WsManager, "command_tracker", tracker)
+    monkeypatch.setattr(WsManager, "COMMAND_ACK_TIMEOUT_S", 0.01)
+    monkeypatch.setattr(WsManager, "COMMAND_MAX_RETRIES", 2)
+    esp = FakeEsp()
+    monkeypatch.setitem(WsManager.websocket_manager.esp_connections, "ESP", esp)
+
+    async def scenario():
+        pending = tracker.track("ESP", start("START_MOTOR"))
+        tracker.mark_sent(pending)
+        await WsManager.websocket_manager._retry_until_ack("ESP", pending)
+
+        assert [command["command_id"] for command in esp.sent] == [pending.command_id] * 2
+        result = pending.future.result()
+        assert (result["acknowledged"], result["status"], result["attempts"]) == (False, "TIMEOUT", 3)
+        assert (tracker.retries, tracker.timeouts) == (2, 1)
+
+    asyncio.run(scenario())
+
+
+def test_acknowledged_retry_stops_resending(monkeypatch):
+    tracker = CommandTracker()
+    monkeypatch.setattr(WsManager, "command_tracker", tracker)
+    monkeypatch.setattr(WsManager, "COMMAND_ACK_TIMEOUT_S", 0.05)
+    monkeypatch.setattr(WsManager, "COMMAND_MAX_RETRIES", 2)
+    esp = FakeEsp()
+    monkeypatch.setitem(WsManager.websocket_manager.esp_connections, "ESP", esp)
+
+    async def scenario():
+        pending = tracker.track("ESP", start("STOP_MOTOR"))
+        tracker.mark_sent(pending)
+        retry = asyncio.create_task(WsManager.websocket_manager._retry_until_ack("ESP", pending))
+        # Confirmación después del primer reenvío
+        while not esp.sent:
+            await asyncio.sleep(0.005)
+        tracker.acknowledge("ESP", {"status": "STOPPED"})
+        await retry
+
+        assert len(esp.sent) == 1
+        result = pending.future.result()
+        assert (result["acknowledged"], result["attempts"]) == (True, 2)
+        assert (tracker.retries, tracker.timeouts) == (1, 0)
+
+    asyncio.run(scenario())
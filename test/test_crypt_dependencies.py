@@ -0,0 +1,122 @@
+import asyncio
+import threading
+
+import bcrypt
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, select
+
+from app.database.database import database
+from app.database.modelsDB import User
+from app.models.ErrorsValidator import HashingOverloadedError
+from app.routes import user_routes
+from app.utils import JWT_Auth, crypt_dependencies
+from app.utils.crypt_dependencies import (
+    crypt_needs_rehash, crypt_password, crypt_pool_stats, crypt_verify_password
+)
+
+USER = "crypt-user"
+PASSWORD = "contraseña1234"
+NEW_USER = {"name": USER, "password": PASSWORD, "location": "test", "longitud": 0.0, "latitud": 0.0}
+
+
+@pytest.fixture(autouse=True)
+def fast_rounds(monkeypatch):
+    # Costo mínimo de bcrypt: las pruebas no miden la fuerza del hash
+    monkeypatch.setattr(crypt_dependencies, "BCRYPT_ROUNDS", 4)
+
+
+def test_hash_and_verify_run_in_the_pool():
+    async def scenario():
+        hashed = await crypt_password(PASSWORD)
+        assert await crypt_verify_password(PASSWORD, hashed)
+        assert not await crypt_verify_password("otra-clave", hashed)
+        assert not crypt_needs_rehash(hashed)
+
+    asyncio.run(scenario())
+    assert crypt_pool_stats()["pending"] == 0
+
+
+def test_hash_with_other_cost_needs_rehash():
+    assert crypt_needs_rehash(bcrypt.hashpw(b"x", bcrypt.gensalt(rounds=5)).decode())
+    assert crypt_needs_rehash("texto-plano")
+    assert crypt_needs_rehash(None)
+
+
+def test_saturated_pool_rejects_instead_of_queueing(monkeypatch):
+    monkeypatch.setattr(crypt_dependencies, "BCRYPT_MAX_PENDING", 2)
+    release = threading.Event()
+
+    def slow_verify(password, hashed_password):
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(crypt_dependencies, "_verify", slow_verify)
+
+    async def scenario():
+        running = [asyncio.create_task(crypt_verify_password("a", "b")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        # El event loop sigue libre mientras los hilos esperan
+        assert crypt_pool_stats()["pending"] == 2
+        with pytest.raises(HashingOverloadedError):
+            await crypt_verify_password("a", "b")
+        release.set()
+        assert await asyncio.gather(*running) == [True, True]
+        assert crypt_pool_stats()["pending"] == 0
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(user_routes.user_routers)
+    JWT_Auth.user_cache.clear()
+    with TestClient(app) as client:
+        yield client
+    with database.session() as db:
+        db.execute(delete(User).where(User.name == USER))
+    JWT_Auth.user_cache.clear()
+
+
+def stored_hash() -> str:
+    with database.session() as db:
+        return db.scalar(select(User.password).where(User.name == USER))
+
+
+def test_register_and_login_with_rehash(client):
+    response = client.post("/users/", json=NEW_USER)
+    assert response.status_code == 200
+    assert response.json()["user_id"]
+    # Un nombre repetido es un 400, no un 500
+    assert client.post("/users/", json=NEW_USER).status_code == 400
+
+    with database.session() as db:
+        user = db.scalars(select(User).where(User.name == USER)).one()
+        user.password = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=5)).decode()
+
+    response = client.post("/login", json={"username": USER, "password": PASSWORD})
+    assert response.status_code == 200
+    assert response.json()["user_data"]["name"] == USER
+    assert stored_hash().startswith("$2b$04$")
+
+    response = client.post("/login", json={"username": USER, "password": "incorrecta"})
+    assert response.status_code == 401
+
+
+def test_overloaded_hashing_returns_503(client, monkeypatch):
+    async def overloaded(*args):
+        raise HashingOverloadedError("saturado")
+
+    monkeypatch.setattr(user_routes, "crypt_password", overloaded)
+    response = client.post("/users/", json=NEW_USER)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert stored_hash() is None
+
+
+def test_missing_required_column_is_not_reported_as_duplicate(client):
+    response = client.post("/users/", json={"name": USER, "password": PASSWORD})
+    assert response.status_code == 500
+    assert stored_hash() is None
@@ -0,0 +1,84 @@
+import asyncio
+
+from app.utils.DeviceRegistry import OWNER_KEY, DeviceRegistry
+from app.utils.PubSubBroker import InProcessBroker
+
+
+def two_workers(**kwargs):
+    """Dos workers que comparten el broker, como con Redis."""
+    broker = InProcessBroker()
+    return broker, DeviceRegistry(broker, "node-1", **kwargs), DeviceRegistry(broker, "node-2", **kwargs)
+
+
+def test_newest_connection_owns_the_device_and_release_is_owner_only():
+    async def scenario():
+        broker, first, second = two_workers()
+        await first.acquire("ESP")
+        assert await second.owner("ESP") == "node-1"
+
+        await second.acquire("ESP")
+        assert await first.owner("ESP") == "node-2"
+        # El worker anterior no puede liberar un lease que ya no es suyo
+        await first.release("ESP")
+        assert await first.owner("ESP") == "node-2"
+        await second.release("ESP")
+        assert await first.owner("ESP") is None
+
+    asyncio.run(scenario())
+
+
+def test_renew_keeps_own_lease_and_reacquires_expired_one():
+    async def scenario():
+        broker, first, _ = two_workers(lease_ms=50)
+        lost = []
+        first._on_lost = lost.append
+        await first.acquire("ESP")
+        await first._renew("ESP")
+        assert first.renewals == 1
+
+        # El lease expiró sin otro dueño: se vuelve a tomar, no se cierra el socket
+        await asyncio.sleep(0.08)
+        assert await first.owner("ESP") is None
+        await first._renew("ESP")
+        assert await first.owner("ESP") == "node-1"
+        assert lost == [] and first.lost == 0
+
+    asyncio.run(scenario())
+
+
+def test_renew_fires_on_lost_when_another_worker_took_the_lease():
+    async def scenario():
+        broker, first, second = two_workers()
+        lost = []
+        first._on_lost = lost.append
+        await first.acquire("ESP")
+        await second.acquire("ESP")
+
+        await first._renew("ESP")
+        assert lost == ["ESP"]
+        assert first.lost == 1 and first.renewals == 0
+        # El lease del nuevo dueño no se toca
+        assert await broker.get(OWNER_KEY + "ESP") == "node-2"
+
+    asyncio.run(scenario())
+
+
+def test_heartbeat_renews_owned_devices_and_stop_releases_them():
+    async def scenario():
+        broker, first, second = two_workers(lease_ms=1000, heartbeat_ms=10)
+        owned = {"ESP-1", "ESP-2"}
+        lost = []
+        for device_id in owned:
+            await first.acquire(device_id)
+        await second.acquire("ESP-2")
+
+        first.start(lambda: owned, lost.append)
+        await asyncio.sleep(0.05)
+        assert first.renewals >= 2
+        assert lost and set(lost) == {"ESP-2"}
+
+        await first.stop(owned)
+        assert await broker.get(OWNER_KEY + "ESP-1") is None
+        assert await broker.get(OWNER_KEY + "ESP-2") == "node-2"
+
+    asyncio.run(scenario())
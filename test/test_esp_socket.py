@@ -0,0 +1,171 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, event
+from starlette.websockets import WebSocketDisconnect
+
+from app.database.database import database
+from app.database.modelsDB import Esp, User, Usuario_Esp
+from app.routes import esp_socket as esp_socket_module
+from app.routes.esp_socket import esp_socket
+from app.utils import JWT_Auth, esp_dependencies
+from app.utils.JWT_Auth import create_access_token
+from app.utils.WsManager import websocket_manager
+from app.utils.esp_dependencies import user_device_ids, user_has_device_access
+
+USER = "ws-user"
+DEVICE = "TEST-WS-ESP"
+
+
+def clear_caches():
+    for cache in (esp_dependencies.esp_validation_cache, esp_dependencies.device_access_cache,
+                  JWT_Auth.token_cache, JWT_Auth.user_cache):
+        cache.clear()
+
+
+@pytest.fixture
+def registered():
+    """Usuario y ESP asociados, confirmados para que los vean las sesiones del endpoint."""
+    clear_caches()
+    with database.session() as db:
+        user = User(name=USER, password="-", location="test", longitud=0.0, latitud=0.0)
+        esp = Esp(identification=DEVICE)
+        db.add_all([user, esp])
+        db.flush()
+        db.add(Usuario_Esp(id_user=user.id, id_esp=esp.id))
+    yield
+    with database.session() as db:
+        db.execute(delete(Usuario_Esp).where(Usuario_Esp.id_esp.in_(
+            db.query(Esp.id).filter(Esp.identification == DEVICE)
+        )))
+        db.execute(delete(Esp).where(Esp.identification == DEVICE))
+        db.execute(delete(User).where(User.name == USER))
+    clear_caches()
+
+
+class PoolUsage:
+    """Conexiones del engine asíncrono tomadas y devueltas durante la prueba."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.checkouts = 0
+        self.checkins = 0
+
+    def _checkout(self, *args):
+        self.checkouts += 1
+
+    def _checkin(self, *args):
+        self.checkins += 1
+
+    @property
+    def checked_out(self) -> int:
+        return self.checkouts - self.checkins
+
+    def __enter__(self):
+        event.listen(self.engine, "checkout", self._checkout)
+        event.listen(self.engine, "checkin", self._checkin)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "checkout", self._checkout)
+        event.remove(self.engine, "checkin", self._checkin)
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(esp_socket)
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def pool():
+    with PoolUsage(database.async_engine.sync_engine) as usage:
+        yield usage
+
+
+def test_esp_socket_holds_no_connection_while_open(client, pool, registered):
+    with client.websocket_connect(f"/ws/esp/{DEVICE}") as websocket:
+        websocket.send_json({"type": "PING"})
+        # La validación consultó la BD y devolvió la conexión antes de aceptar el socket
+        assert pool.checkouts >= 1
+        assert pool.checked_out == 0
+
+
+def test_unknown_esp_is_rejected_without_leaking_a_connection(client, pool, registered):
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect("/ws/esp/TEST-WS-UNKNOWN") as websocket:
+            websocket.receive_text()
+    assert closed.value.code == 4000
+    assert pool.checked_out == 0
+
+
+def test_frontend_socket_releases_connection_after_each_check(client, pool, registered):
+    token = create_access_token({"sub": USER})
+    with client.websocket_connect(f"/ws/frontend?token={token}") as websocket:
+        assert pool.checked_out == 0
+        websocket.send_json({"type": "SUBSCRIBE", "device_id": "TEST-WS-UNKNOWN"})
+        assert websocket.receive_json()["type"] == "ERROR"
+        assert pool.checked_out == 0
+
+
+def test_frontend_socket_rejects_invalid_token(client, pool, registered):
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect("/ws/frontend?token=invalid") as websocket:
+            websocket.receive_text()
+    assert closed.value.code == 4001
+    assert pool.checked_out == 0
+
+
+def test_user_device_ids_resolves_and_caches_access(db, user_id, monkeypatch):
+    esp_dependencies.device_access_cache.clear()
+    esps = [Esp(identification=f"TEST-BATCH-{index}") for index in range(3)]
+    db.add_all(esps)
+    db.flush()
+    db.add_all([Usuario_Esp(id_user=user_id, id_esp=esp.id) for esp in esps[:2]])
+    db.flush()
+
+    assert sorted(user_device_ids(db, "test-user")) == ["TEST-BATCH-0", "TEST-BATCH-1"]
+    requested = ["TEST-BATCH-1", "TEST-BATCH-2", "TEST-BATCH-X", "TEST-BATCH-1", "TEST-BATCH-0"]
+    assert user_device_ids(db, "test-user", requested) == ["TEST-BATCH-1", "TEST-BATCH-0"]
+
+    # Todo está en caché: una nueva consulta fallaría
+    monkeypatch.setattr(db, "scalars", None)
+    assert user_device_ids(db, "test-user", requested) == ["TEST-BATCH-1", "TEST-BATCH-0"]
+    assert user_has_device_access(db, "test-user", "TEST-BATCH-2") is False
+    esp_dependencies.device_access_cache.clear()
+
+
+@pytest.fixture
+def frontend(client, registered):
+    websocket_manager.esp_states[DEVICE] = {"temperature": 21.5}
+    token = create_access_token({"sub": USER})
+    with client.websocket_connect(f"/ws/frontend?token={token}") as websocket:
+        yield websocket
+    websocket_manager.esp_states.pop(DEVICE, None)
+
+
+def test_batch_subscribe_sends_one_snapshot(frontend, pool):
+    frontend.send_json({"type": "SUBSCRIBE", "device_ids": [DEVICE, "TEST-WS-UNKNOWN", DEVICE]})
+    snapshot = frontend.receive_json()
+    assert snapshot == {
+        "type": "ESP_SNAPSHOT",
+        "devices": {DEVICE: {"temperature": 21.5}},
+        "subscribed": [DEVICE],
+        "denied": ["TEST-WS-UNKNOWN"]
+    }
+    assert USER in websocket_manager.device_subscribers[DEVICE]
+    assert pool.checked_out == 0
+
+    frontend.send_json({"type": "SUBSCRIBE", "mode": "ALL"})
+    snapshot = frontend.receive_json()
+    assert (snapshot["subscribed"], snapshot["denied"]) == ([DEVICE], [])
+
+
+def test_batch_subscribe_rejects_invalid_lists(frontend, monkeypatch):
+    monkeypatch.setattr(esp_socket_module, "SUBSCRIBE_MAX_DEVICES", 1)
+    frontend.send_json({"type": "SUBSCRIBE", "device_ids": DEVICE})
+    assert frontend.receive_json()["type"] == "ERROR"
+    frontend.send_json({"type": "SUBSCRIBE", "device_ids": [DEVICE, "TEST-WS-OTHER"]})
+    assert frontend.receive_json()["message"] == "Máximo 1 dispositivos por SUBSCRIBE"
@@ -0,0 +1,85 @@
+import asyncio
+
+from app.utils.FrontendConnection import SLOW_CONSUMER_CLOSE_CODE, FrontendConnection
+
+
+class FakeWebSocket:
+    """WebSocket de frontend que registra lo enviado; ``stalled`` simula un cliente que no lee."""
+
+    def __init__(self, stalled: bool = False):
+        self.stalled = stalled
+        self.sent = []
+        self.close_codes = []
+
+    async def send_text(self, message: str):
+        if self.stalled:
+            await asyncio.sleep(3600)
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        self.close_codes.append(code)
+
+
+def new_connection(websocket: FakeWebSocket, **kwargs):
+    closed = []
+    connection = FrontendConnection(websocket, "user", lambda user_id, ws: closed.append(user_id), **kwargs)
+    return connection, closed
+
+
+def queued(connection: FrontendConnection):
+    return list(connection._queue._queue)
+
+
+def test_send_timeout_closes_slow_consumer():
+    async def scenario():
+        websocket = FakeWebSocket(stalled=True)
+        connection, closed = new_connection(websocket, send_timeout=0.05)
+        connection.start()
+        assert connection.send("frame")
+        await asyncio.sleep(0.2)
+
+        assert websocket.close_codes == [SLOW_CONSUMER_CLOSE_CODE]
+        assert closed == ["user"]
+        assert connection.closed
+        assert not connection.send("frame")
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_keeps_latest_frame_per_device():
+    async def scenario():
+        # Sin escritor: la cola se llena como con un cliente que no lee
+        connection, _ = new_connection(FakeWebSocket(), queue_size=3)
+        for message, device_id in (("a1", "A"), ("b1", "B"), ("a2", "A"), ("b2", "B")):
+            assert connection.send(message, device_id)
+
+        assert queued(connection) == [("B", "b1"), ("A", "a2"), ("B", "b2")]
+        assert connection.dropped_count == 1
+
+    asyncio.run(scenario())
+
+
+def test_queue_full_after_compaction_closes_once():
+    async def scenario():
+        websocket = FakeWebSocket()
+        connection, closed = new_connection(websocket, queue_size=2)
+        close_calls = []
+        close = connection.close
+
+        async def counting_close(code: int = 1011):
+            close_calls.append(code)
+            await close(code)
+
+        connection.close = counting_close
+        # Frames sin dispositivo no se pueden compactar
+        assert connection.send("one") and connection.send("two")
+        assert not connection.send("three")
+        assert not connection.send("four")
+        await asyncio.sleep(0.05)
+
+        assert close_calls == [SLOW_CONSUMER_CLOSE_CODE]
+        assert websocket.close_codes == [SLOW_CONSUMER_CLOSE_CODE]
+        assert closed == ["user"]
+        assert connection.dropped_count == 1
+
+    asyncio.run(scenario())
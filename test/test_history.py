@@ -0,0 +1,121 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+
+from app.database.database import database
+from app.database.modelsDB import (
+    Esp, SensorReading, SensorRollupDay, SensorRollupHour, SensorRollupMinute
+)
+from app.routes.esp_routes import esp_routes
+from app.utils import history_dependencies
+from app.utils.history_dependencies import bucket_size_ms, history_range, parse_resolution
+from app.utils.rollup_dependencies import HOUR_MS, MINUTE_MS, upsert_rollups
+from app.utils.sensor_dependencies import insert_readings, reading_row
+
+DEVICE = "TEST-HISTORY"
+START = 1700000000000 - 1700000000000 % HOUR_MS
+READINGS = 720
+
+
+@pytest.mark.parametrize("resolution, expected", [
+    ("auto", None), ("", None), (None, None),
+    ("500ms", 500), ("30", 30000), ("30s", 30000), ("5m", 5 * MINUTE_MS), ("1H", HOUR_MS), ("2d", 2 * 24 * HOUR_MS)
+])
+def test_parse_resolution(resolution, expected):
+    assert parse_resolution(resolution) == expected
+
+
+@pytest.mark.parametrize("resolution", ["0", "5w", "-1s", "1.5m", "m"])
+def test_parse_resolution_rejects_invalid_values(resolution):
+    with pytest.raises(ValueError):
+        parse_resolution(resolution)
+
+
+def test_bucket_size_targets_default_buckets_and_caps_fine_resolutions():
+    day = 24 * HOUR_MS
+    assert bucket_size_ms(0, day, None) == day // history_dependencies.HISTORY_DEFAULT_BUCKETS
+    # 1 s sobre un día serían 86 400 buckets: se agranda hasta HISTORY_MAX_BUCKETS
+    assert bucket_size_ms(0, day, 1000) == day // history_dependencies.HISTORY_MAX_BUCKETS
+    assert bucket_size_ms(0, day, HOUR_MS) == HOUR_MS
+
+
+def test_history_range_defaults_and_validation():
+    assert history_range("1000", "2000") == (1000, 2000)
+    from_ms, to_ms = history_range(None, "2024-11-17T00:00:00")
+    assert to_ms - from_ms == history_dependencies.HISTORY_DEFAULT_RANGE_MS
+    for from_param, to_param in (("2000", "1000"), ("ayer", None)):
+        with pytest.raises(ValueError):
+            history_range(from_param, to_param)
+
+
+@pytest.fixture
+def client():
+    """ESP con dos horas de lecturas cada 10 s y sus rollups, confirmados."""
+    with database.session() as db:
+        esp = Esp(identification=DEVICE)
+        db.add(esp)
+        db.flush()
+        rows = [
+            reading_row(esp.id, {"temperature": 20 + index % 10, "humidity": 50}, START + index * 10000)
+            for index in range(READINGS)
+        ]
+        insert_readings(db, rows)
+        upsert_rollups(db, rows)
+        esp_id = esp.id
+
+    app = FastAPI()
+    app.include_router(esp_routes)
+    with TestClient(app) as client:
+        yield client
+
+    with database.session() as db:
+        for model in (SensorReading, SensorRollupMinute, SensorRollupHour, SensorRollupDay):
+            db.execute(delete(model).where(model.esp_id == esp_id))
+        db.execute(delete(Esp).where(Esp.id == esp_id))
+
+
+def history(client, **params):
+    params.setdefault("from", str(START))
+    params.setdefault("to", str(START + 2 * HOUR_MS))
+    return client.get(f"/api/esp/{DEVICE}/history", params=params)
+
+
+def test_history_uses_rollups_and_formats_match(client, monkeypatch):
+    # Chunks pequeños para que el JSON se escriba en varias partes
+    monkeypatch.setattr(history_dependencies, "HISTORY_STREAM_CHUNK", 7)
+    response = history(client, resolution="10m")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert (response.headers["X-History-Source"], response.headers["X-Bucket-Ms"]) == ("rollup_1m", str(10 * MINUTE_MS))
+    buckets = [json.loads(line) for line in response.text.splitlines()]
+    assert len(buckets) == 12
+    assert sum(bucket["count"] for bucket in buckets) == READINGS
+    assert buckets[0]["temperature"] == {"min": 20.0, "max": 29.0, "avg": 24.5, "last": 29.0}
+
+    document = history(client, resolution="10m", format="json").json()
+    assert (document["device_id"], document["source"], document["bucket_ms"]) == (DEVICE, "rollup_1m", 10 * MINUTE_MS)
+    assert document["buckets"] == buckets
+
+
+def test_fine_resolution_reads_raw_readings(client):
+    response = history(client, resolution="30s", to=str(START + 10 * MINUTE_MS))
+    assert response.headers["X-History-Source"] == "raw"
+    buckets = [json.loads(line) for line in response.text.splitlines()]
+    assert len(buckets) == 20
+    assert all(bucket["count"] == 3 for bucket in buckets)
+
+
+def test_history_errors(client):
+    assert history(client, resolution="5w").status_code == 400
+    assert history(client, **{"from": str(START + HOUR_MS), "to": str(START)}).status_code == 400
+    assert history(client, format="csv").status_code == 422
+    assert client.get("/api/esp/TEST-HISTORY-MISSING/history").status_code == 404
+
+
+def test_empty_range_streams_no_buckets(client):
+    response = history(client, format="json", **{"from": str(START - HOUR_MS), "to": str(START)})
+    assert response.json()["buckets"] == []
+    assert history(client, **{"from": str(START - HOUR_MS), "to": str(START)}).text == ""
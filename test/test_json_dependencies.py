@@ -0,0 +1,48 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from app.utils import json_dependencies
+from app.utils.json_dependencies import decode_json, encode_json
+
+MESSAGE = {
+    "type": "ESP_DATA",
+    "device_id": "ESP-ñ",
+    "data": {"temperature": 21.5, "last_update": datetime(2024, 11, 17, 1, 5, 29)}
+}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(json_dependencies, "orjson", None)
+    return request.param
+
+
+def test_encode_json_is_compact_with_iso_datetimes(backend):
+    text = encode_json(MESSAGE)
+    assert isinstance(text, str)
+    assert ", " not in text and ": " not in text
+    assert "ESP-ñ" in text
+    assert json.loads(text)["data"]["last_update"] == "2024-11-17T01:05:29"
+
+
+def test_backends_produce_the_same_frame(monkeypatch):
+    pytest.importorskip("orjson")
+    fast = encode_json(MESSAGE)
+    monkeypatch.setattr(json_dependencies, "orjson", None)
+    assert encode_json(MESSAGE) == fast
+
+
+def test_encode_json_rejects_unknown_types(backend):
+    with pytest.raises(TypeError):
+        encode_json({"value": object()})
+
+
+def test_decode_json_accepts_text_and_bytes(backend):
+    assert decode_json('{"a":1}') == decode_json(b'{"a":1}') == {"a": 1}
+    with pytest.raises(ValueError):
+        decode_json("{")
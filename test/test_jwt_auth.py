@@ -0,0 +1,116 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import jwt
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import delete
+
+from app.database.database import database
+from app.database.modelsDB import User
+from app.utils import JWT_Auth
+from app.utils.JWT_Auth import (
+    create_access_token, decode_token, get_current_user, get_user_by_name, invalidate_user_cache,
+    validate_ws_token
+)
+
+USER = "jwt-user"
+
+
+@pytest.fixture(autouse=True)
+def caches():
+    JWT_Auth.token_cache.clear()
+    JWT_Auth.user_cache.clear()
+    yield
+    JWT_Auth.token_cache.clear()
+    JWT_Auth.user_cache.clear()
+
+
+@pytest.fixture
+def registered():
+    with database.session() as db:
+        db.add(User(name=USER, password="-", location="test", longitud=0.0, latitud=0.0))
+    yield
+    with database.session() as db:
+        db.execute(delete(User).where(User.name == USER))
+
+
+@pytest.fixture
+def decode_calls(monkeypatch):
+    calls = []
+    original = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(JWT_Auth.jwt, "decode", counting_decode)
+    return calls
+
+
+def test_verified_claims_are_cached_until_token_expiry(decode_calls):
+    token = create_access_token({"sub": USER}, timedelta(minutes=5))
+    assert decode_token(token)["sub"] == USER
+    assert decode_token(token)["sub"] == USER
+    assert len(decode_calls) == 1
+
+    # La entrada vence con el "exp" del token, no con el TTL general de la caché
+    _, expires_at = JWT_Auth.token_cache._data[token]
+    assert abs((expires_at - time.monotonic()) - 300) < 5
+
+
+def test_expired_and_invalid_tokens_are_not_cached(decode_calls):
+    expired = create_access_token({"sub": USER}, timedelta(seconds=-10))
+    for _ in range(2):
+        with pytest.raises(jwt.ExpiredSignatureError):
+            decode_token(expired)
+    with pytest.raises(jwt.InvalidTokenError):
+        decode_token("no-es-un-token")
+    assert len(decode_calls) == 3
+    assert len(JWT_Auth.token_cache) == 0
+
+
+def test_user_is_read_once_until_invalidated(registered):
+    async def scenario():
+        async with database.async_session() as db:
+            user = await get_user_by_name(db, USER)
+        assert user.name == USER
+        # Sin sesión: el acierto no toca la base de datos
+        assert await get_user_by_name(None, USER) is user
+
+        invalidate_user_cache(USER)
+        async with database.async_session() as db:
+            assert await get_user_by_name(db, USER) is not user
+            # Un usuario inexistente no se guarda en caché
+            assert await get_user_by_name(db, "jwt-missing") is None
+        assert JWT_Auth.user_cache.get("jwt-missing") is None
+
+    asyncio.run(scenario())
+
+
+def test_get_current_user_and_ws_token_share_the_caches(registered, decode_calls):
+    token = create_access_token({"sub": USER})
+
+    async def scenario():
+        async with database.async_session() as db:
+            user = await get_current_user(token, db)
+        assert await get_current_user(token, None) is user
+        assert await validate_ws_token(f"Bearer {token}", None) is user
+        assert len(decode_calls) == 1
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("token, detail", [
+    (create_access_token({"sub": USER}, timedelta(seconds=-10)), "Token expirado"),
+    (create_access_token({"name": USER}), "No se pudieron validar las credenciales"),
+    ("no-es-un-token", "No se pudieron validar las credenciales")
+])
+def test_get_current_user_rejects_bad_tokens(token, detail):
+    async def scenario():
+        with pytest.raises(HTTPException) as rejected:
+            await get_current_user(token, None)
+        assert (rejected.value.status_code, rejected.value.detail) == (401, detail)
+
+    asyncio.run(scenario())
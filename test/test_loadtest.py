@@ -0,0 +1,79 @@
+import asyncio
+import json
+from collections import Counter
+
+from loadtest import TrafficStats, compare, dashboard_reader, latency_summary, percentile, watched_by
+
+
+def test_percentiles_use_nearest_rank():
+    values = list(range(1, 101))
+    assert (percentile(values, 50), percentile(values, 95), percentile(values, 99)) == (51, 95, 99)
+    assert percentile([], 50) is None
+    assert latency_summary([3.14159, 1.0]) == {"count": 2, "p50_ms": 1.0, "p95_ms": 3.14, "p99_ms": 3.14, "max_ms": 3.14}
+    assert latency_summary([])["max_ms"] is None
+
+
+def test_watched_by_spreads_devices_evenly():
+    load = Counter(dashboard for device in range(100) for dashboard in watched_by(device, 20, 3))
+    assert set(load.values()) == {15}
+    assert watched_by(0, 2, 5) == [0, 1]
+    assert watched_by(0, 0, 3) == []
+
+
+def traffic_report(**values):
+    return {
+        "scenario": "traffic",
+        "throughput": {"delivered_per_second": values.get("throughput", 1000)},
+        "end_to_end_latency": {"p50_ms": values.get("p50", 10), "p95_ms": 20, "p99_ms": 30},
+        "dropped_ratio": values.get("dropped", 0),
+        "motor_commands": {"ack_latency": {"p95_ms": None}}
+    }
+
+
+def test_compare_flags_only_regressions_beyond_tolerance():
+    baseline = traffic_report()
+    result = compare(traffic_report(throughput=950, p50=11.5), baseline, 0.1)
+    assert result["regressions"] == ["end_to_end_latency.p50_ms"]
+    assert result["metrics"]["throughput.delivered_per_second"]["change"] == -0.05
+    # Sin dato en alguno de los dos reportes la métrica no se compara
+    assert "motor_commands.ack_latency.p95_ms" not in result["metrics"]
+
+    # Con base 0 cualquier empeoramiento cuenta
+    assert compare(traffic_report(dropped=0.001), baseline, 0.5)["regressions"] == ["dropped_ratio"]
+    assert compare(traffic_report(throughput=500), baseline, 0.1)["regressions"] == ["throughput.delivered_per_second"]
+
+
+class FakeDashboard:
+    """Socket de dashboard que entrega una lista fija de frames."""
+
+    def __init__(self, frames):
+        self.frames = [json.dumps(frame) for frame in frames]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for frame in self.frames:
+            yield frame
+
+
+def esp_data(device_id, data):
+    return {"type": "ESP_DATA", "device_id": device_id, "data": data}
+
+
+def test_dashboard_reader_counts_duplicates_and_unexpected_frames():
+    stats = TrafficStats()
+    stats.sent_at = {("ESP", 0): 0.0, ("ESP", 1): 0.0}
+    frames = [
+        esp_data("ESP", {"temperature": 0}),
+        esp_data("ESP", {"temperature": 0}),
+        esp_data("ESP", {"temperature": 1}),
+        esp_data("ESP", {"temperature": 7}),
+        esp_data("ESP", {"motor_status": "RUNNING"}),
+        {"type": "ESP_SNAPSHOT", "devices": {}}
+    ]
+
+    asyncio.run(dashboard_reader(FakeDashboard(frames), "dash", stats))
+
+    assert stats.received == {("dash", "ESP", 0), ("dash", "ESP", 1)}
+    assert (stats.duplicates, stats.unexpected, len(stats.latency_ms)) == (1, 1, 2)
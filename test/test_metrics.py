@@ -0,0 +1,98 @@
+import re
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.utils import Metrics
+from app.utils.Metrics import LatencyHistogram, MetricsMiddleware, MetricsRegistry, metrics
+
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]+="([^"\\]|\\.)*",?)*\})? (-?[0-9.e+-]+|[+-]Inf|NaN)$')
+
+
+@pytest.fixture
+def registry():
+    """Registro independiente del singleton."""
+    instance = object.__new__(MetricsRegistry)
+    instance.initialize()
+    return instance
+
+
+def test_latency_histogram_percentiles_are_bucket_bounds():
+    histogram = LatencyHistogram((10, 100))
+    for value in (1, 5, 10, 50, 500):
+        histogram.observe(value)
+    # Un valor igual al límite cae en ese bucket (le = menor o igual)
+    assert histogram.counts == [3, 1, 1]
+    assert (histogram.percentile(50), histogram.percentile(80), histogram.percentile(99)) == (10, 100, "+Inf")
+    assert histogram.to_dict()["buckets"] == {"10": 3, "100": 4, "+Inf": 5}
+    assert LatencyHistogram().percentile(50) is None
+
+
+def test_render_exposition_format(registry):
+    messages = registry.counter("messages_total", "Mensajes", ("type",))
+    messages.labels("sensor_data").inc()
+    messages.labels("sensor_data").inc(2)
+    messages.labels('raro"\n').inc()
+    registry.gauge("queue_depth", "Profundidad").set(1.5)
+    registry.histogram("flush_seconds", "Flush", buckets=(5, 50), scale=0.001).observe(20)
+    registry.callback("pool", "Pool", "gauge", lambda: {("sync",): 3, ("async",): 0}, ("engine",))
+    registry.callback("uptime", "Uptime", "gauge", lambda: float("inf"))
+
+    assert registry.render() == "\n".join([
+        "# HELP messages_total Mensajes",
+        "# TYPE messages_total counter",
+        'messages_total{type="sensor_data"} 3',
+        'messages_total{type="raro\\"\\n"} 1',
+        "# HELP queue_depth Profundidad",
+        "# TYPE queue_depth gauge",
+        "queue_depth 1.5",
+        "# HELP flush_seconds Flush",
+        "# TYPE flush_seconds histogram",
+        'flush_seconds_bucket{le="0.005"} 0',
+        'flush_seconds_bucket{le="0.05"} 1',
+        'flush_seconds_bucket{le="+Inf"} 1',
+        "flush_seconds_sum 0.02",
+        "flush_seconds_count 1",
+        "# HELP pool Pool",
+        "# TYPE pool gauge",
+        'pool{engine="sync"} 3',
+        'pool{engine="async"} 0',
+        "# HELP uptime Uptime",
+        "# TYPE uptime gauge",
+        "uptime +Inf"
+    ]) + "\n"
+
+
+def test_registry_rejects_duplicates_and_wrong_labels(registry):
+    counter = registry.counter("requests_total", "Peticiones", ("method",))
+    with pytest.raises(ValueError):
+        registry.counter("requests_total", "Otra vez")
+    with pytest.raises(ValueError):
+        counter.labels("GET", "200")
+    # Los hijos se crean una vez y se reutilizan
+    assert counter.labels("GET") is counter.labels("GET")
+
+
+def test_middleware_labels_by_route_template(monkeypatch):
+    histogram = Metrics.Histogram("http_test", "HTTP", ("method", "route", "status"))
+    monkeypatch.setattr(Metrics, "HTTP_DURATION", histogram)
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/api/esp/{device_id}/state")
+    async def state(device_id: str):
+        return {"device_id": device_id}
+
+    with TestClient(app) as client:
+        for device_id in ("A", "B", "C"):
+            assert client.get(f"/api/esp/{device_id}/state").status_code == 200
+        assert client.get("/missing").status_code == 404
+
+    counts = {values: child.count for values, child in histogram._children.items()}
+    assert counts == {("GET", "/api/esp/{device_id}/state", "200"): 3, ("GET", "unmatched", "404"): 1}
+
+
+def test_global_registry_renders_valid_lines():
+    for line in metrics.render().splitlines():
+        assert line.startswith("# ") or SAMPLE_LINE.match(line), line
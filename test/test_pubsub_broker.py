@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from app.utils import PubSubBroker
+from app.utils.PubSubBroker import BrokerError, InProcessBroker, RespBroker, encode_command, read_reply
+from resp_standin import StandinServer, start_standin
+
+
+def reader_for(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+async def wait_until(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "tiempo de espera agotado"
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b"+OK\r\n", "OK"),
+    (b":42\r\n", 42),
+    ("$4\r\nhól\r\n".encode("utf-8"), "hól"),
+    (b"$-1\r\n", None),
+    (b"*-1\r\n", None),
+    (b"*3\r\n$7\r\nmessage\r\n$2\r\nch\r\n$0\r\n\r\n", ["message", "ch", ""]),
+    (b"*2\r\n:1\r\n*1\r\n+OK\r\n", [1, ["OK"]])
+], ids=["simple", "integer", "bulk-utf8", "null-bulk", "null-array", "message", "nested"])
+def test_read_reply_types(data, expected):
+    async def scenario():
+        return await read_reply(reader_for(data))
+
+    assert asyncio.run(scenario()) == expected
+
+
+def test_read_reply_returns_errors_and_rejects_garbage():
+    async def scenario():
+        error = await read_reply(reader_for(b"-ERR wrong type\r\n"))
+        assert isinstance(error, BrokerError) and str(error) == "ERR wrong type"
+        with pytest.raises(BrokerError):
+            await read_reply(reader_for(b"?what\r\n"))
+        with pytest.raises(ConnectionError):
+            await read_reply(reader_for(b""))
+
+    asyncio.run(scenario())
+
+
+def test_encode_command_round_trips_through_resp_parser():
+    async def scenario():
+        command = encode_command("SET", "clave", "válue\r\nsegunda", 1500, b"\x00bin")
+        assert command.startswith(b"*5\r\n$3\r\nSET\r\n")
+        args = await StandinServer()._read_command(reader_for(command))
+        assert args == ["SET", "clave", "válue\r\nsegunda", "1500", "\x00bin"]
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture(params=["memory", "resp"])
+def broker_factory(request):
+    """Crea el broker a probar dentro del event loop de cada prueba (con su stand-in si es RESP)."""
+    async def create():
+        if request.param == "memory":
+            return InProcessBroker(), None
+        standin, server = await start_standin()
+        broker = RespBroker("127.0.0.1", server.sockets[0].getsockname()[1])
+        await broker.start()
+        return broker, (standin, server)
+    return create
+
+
+async def shutdown(broker, standin):
+    await broker.stop()
+    if standin is not None:
+        standin[1].close()
+
+
+def test_lease_operations_only_succeed_for_the_owner(broker_factory):
+    async def scenario():
+        broker, standin = await broker_factory()
+        try:
+            await broker.set("esp_owner:A", "node-1", ttl_ms=5000)
+            assert await broker.get("esp_owner:A") == "node-1"
+            assert await broker.renew_if_equal("esp_owner:A", "node-1", 5000)
+            assert not await broker.renew_if_equal("esp_owner:A", "node-2", 5000)
+            assert not await broker.delete_if_equal("esp_owner:A", "node-2")
+            assert await broker.get_many(["esp_owner:A", "esp_owner:B"]) == ["node-1", None]
+            assert await broker.delete_if_equal("esp_owner:A", "node-1")
+            assert await broker.get("esp_owner:A") is None
+            assert not await broker.renew_if_equal("esp_owner:A", "node-1", 5000)
+
+            await broker.set("esp_owner:B", "node-1", ttl_ms=20)
+            await asyncio.sleep(0.05)
+            assert await broker.get("esp_owner:B") is None
+        finally:
+            await shutdown(broker, standin)
+
+    asyncio.run(scenario())
+
+
+def test_publish_reaches_subscribed_handler(broker_factory):
+    async def scenario():
+        broker, standin = await broker_factory()
+        received = []
+        try:
+            await broker.subscribe("esp:A", lambda channel, message: received.append((channel, message)))
+            if standin is not None:
+                await wait_until(lambda: standin[0].channels.get("esp:A"))
+            assert await broker.publish("esp:A", "hola") == 1
+            assert await broker.publish("esp:B", "nadie") == 0
+            await wait_until(lambda: received)
+            assert received == [("esp:A", "hola")]
+
+            await broker.unsubscribe("esp:A")
+            assert not broker.is_subscribed("esp:A")
+        finally:
+            await shutdown(broker, standin)
+
+    asyncio.run(scenario())
+
+
+def test_resp_broker_restores_subscriptions_after_reconnect(monkeypatch):
+    monkeypatch.setattr(PubSubBroker, "BROKER_RECONNECT_DELAY_S", 0.05)
+
+    async def scenario():
+        standin, server = await start_standin()
+        broker = RespBroker("127.0.0.1", server.sockets[0].getsockname()[1])
+        await broker.start()
+        received = []
+        try:
+            await broker.subscribe("esp:A", lambda channel, message: received.append(message))
+            await broker.subscribe("esp:B", lambda channel, message: received.append(message))
+            await wait_until(lambda: standin.channels.get("esp:A") and standin.channels.get("esp:B"))
+
+            # El broker se reinicia: se pierden ambas conexiones
+            before = set(standin.clients)
+            standin.drop_connections()
+
+            def restored(channel):
+                subscribers = standin.channels.get(channel)
+                return subscribers and not subscribers & before
+
+            await wait_until(lambda: restored("esp:A") and restored("esp:B"))
+
+            # La conexión de comandos también se restablece en el siguiente comando
+            assert await broker.publish("esp:A", "uno") == 1
+            assert await broker.publish("esp:B", "dos") == 1
+            await wait_until(lambda: len(received) == 2)
+            assert sorted(received) == ["dos", "uno"]
+        finally:
+            await broker.stop()
+            server.close()
+
+    asyncio.run(scenario())
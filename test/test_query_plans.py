@@ -0,0 +1,100 @@
+"""
+Planes de consulta de las búsquedas frecuentes.
+
+Ejecuta EXPLAIN QUERY PLAN sobre las consultas del login, la validación de
+ESP, el control de acceso usuario-dispositivo, el registro y el histórico, y
+comprueba que cada tabla se lea por el índice esperado y no con un recorrido
+completo (p. ej. si falta una migración).
+"""
+from typing import List, Optional, Tuple
+
+import pytest
+from sqlalchemy import select, text
+
+from app.database.database import database
+from app.database.modelsDB import Esp, User, Usuario_Esp
+from app.utils.history_dependencies import history_query
+
+# Índice único de esp.identification, sin nombre en el modelo
+ESP_IDENTIFICATION = {"sqlite_autoindex_esp_1"}
+PRIMARY = {"INTEGER PRIMARY KEY"}
+
+# (nombre, consulta, {tabla o alias: índices aceptados})
+HOT_QUERIES = [
+    (
+        "login / get_current_user",
+        select(User).where(User.name == "usuario"),
+        {"user": {"uq_user_name"}}
+    ),
+    (
+        "asociación usuario-ESP",
+        select(Usuario_Esp.id).where(Usuario_Esp.id_user == 1, Usuario_Esp.id_esp == 1),
+        {"usuario_esp": {"uq_usuario_esp_user_esp"}}
+    ),
+    (
+        "EspValidationExists",
+        select(Esp, User.id, User.name)
+        .join(Usuario_Esp, Esp.id == Usuario_Esp.id_esp)
+        .join(User, Usuario_Esp.id_user == User.id)
+        .where(Esp.identification == "esp-0001")
+        .limit(1),
+        {"esp": ESP_IDENTIFICATION, "usuario_esp": {"ix_usuario_esp_esp", "uq_usuario_esp_user_esp"}, "user": PRIMARY | {"uq_user_name"}}
+    ),
+    (
+        "user_has_device_access",
+        select(Usuario_Esp.id)
+        .join(Esp).join(User)
+        .where(Esp.identification == "esp-0001", User.name == "usuario")
+        .limit(1),
+        {
+            "esp": ESP_IDENTIFICATION | PRIMARY,
+            "usuario_esp": {"ix_usuario_esp_esp", "uq_usuario_esp_user_esp"},
+            "user": PRIMARY | {"uq_user_name"}
+        }
+    ),
+    (
+        "register_esps (asociaciones)",
+        select(Usuario_Esp.id_user, Usuario_Esp.id_esp).where(Usuario_Esp.id_esp.in_([1, 2, 3])),
+        {"usuario_esp": {"ix_usuario_esp_esp"}}
+    ),
+    (
+        "histórico crudo",
+        history_query(1, 0, 3600 * 1000, 60 * 1000),
+        {"sensor_reading": {"ix_sensor_reading_esp_ts"}, "last_reading": {"ix_sensor_reading_esp_ts"}}
+    )
+]
+
+
+def query_plan(conn, query) -> List[Tuple[str, str, Optional[str]]]:
+    """(tabla, acceso, índice) de cada paso de EXPLAIN QUERY PLAN."""
+    sql = str(query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    steps = []
+    for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql)):
+        words = row.detail.split()
+        if words[0] not in ("SCAN", "SEARCH"):
+            continue
+        index = None
+        if "INTEGER PRIMARY KEY" in row.detail:
+            index = "INTEGER PRIMARY KEY"
+        elif "INDEX" in words:
+            index = words[words.index("INDEX") + 1]
+        # SCAN recorre la tabla (o el índice) completo; SEARCH usa el índice para acotar
+        steps.append((words[1], "search" if words[0] == "SEARCH" else "scan", index))
+    return steps
+
+
+@pytest.mark.parametrize("query, expected", [(query, expected) for _, query, expected in HOT_QUERIES],
+                         ids=[name for name, _, _ in HOT_QUERIES])
+def test_hot_query_uses_its_indexes(query, expected):
+    with database.engine.connect() as conn:
+        plan = query_plan(conn, query)
+
+    tables = {table for table, _, _ in plan}
+    assert set(expected) <= tables, plan
+    for table, access, index in plan:
+        accepted = expected.get(table)
+        if accepted is None:
+            continue
+        assert access == "search" and index in accepted, (
+            f"{table} se lee con {access} ({index or 'sin índice'}), se esperaba {sorted(accepted)}"
+        )
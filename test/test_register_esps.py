@@ -0,0 +1,56 @@
+import time
+
+from sqlalchemy import select
+
+from app.database.modelsDB import Esp, SensorReading, Usuario_Esp
+from app.models.EspData import EspData
+from app.utils.esp_dependencies import REGISTER_CREATED, REGISTER_UPDATED, REGISTER_USER_NOT_FOUND, register_esps
+
+
+def device(identification: str, user: int, **sensors_data) -> EspData:
+    return EspData(identification=identification, user=user, sensors_data=sensors_data)
+
+
+def test_bulk_register_with_invalid_timestamp_registers_every_item(db, user_id):
+    before = int(time.time() * 1000)
+    results = register_esps(db, [
+        device("TEST-ESP-0001", user_id, temperature=20.0, timestamp="2024-11-17T01:05:29"),
+        device("TEST-ESP-0002", user_id, temperature=21.0, timestamp="yesterday")
+    ])
+
+    assert [result["status"] for result in results] == [REGISTER_CREATED, REGISTER_CREATED]
+    readings = dict(db.execute(select(SensorReading.esp_id, SensorReading.ts)).all())
+    assert len(readings) == 2
+    # La marca inválida se reemplaza por la hora de recepción
+    assert readings[results[1]["esp_id"]] >= before
+
+
+def test_single_register_with_invalid_timestamp(db, user_id):
+    results = register_esps(db, [device("TEST-ESP-0003", user_id, timestamp="not a date")])
+    assert results[0]["status"] == REGISTER_CREATED
+
+
+def test_register_again_updates_state_without_duplicating_associations(db, user_id):
+    first = register_esps(db, [device("TEST-ESP-0004", user_id, temperature=20.0)])
+    results = register_esps(db, [
+        device("TEST-ESP-0004", user_id, temperature=22.0),
+        device("TEST-ESP-0005", user_id + 1000, temperature=23.0)
+    ])
+
+    assert [result["status"] for result in results] == [REGISTER_UPDATED, REGISTER_USER_NOT_FOUND]
+    esp_id = results[0]["esp_id"]
+    assert esp_id == first[0]["esp_id"]
+    assert db.get(Esp, esp_id).json_sensores == {"current": {"temperature": 22.0}}
+    associations = db.scalars(select(Usuario_Esp.id_user).where(Usuario_Esp.id_esp == esp_id)).all()
+    assert associations == [user_id]
+    # Cada registro guarda su lectura en el histórico
+    assert len(db.scalars(select(SensorReading.id).where(SensorReading.esp_id == esp_id)).all()) == 2
+
+
+def test_repeated_identification_keeps_last_item(db, user_id):
+    results = register_esps(db, [
+        device("TEST-ESP-0006", user_id, temperature=20.0),
+        device("TEST-ESP-0006", user_id, temperature=21.0)
+    ])
+    assert results[0]["esp_id"] == results[1]["esp_id"]
+    assert db.get(Esp, results[0]["esp_id"]).json_sensores == {"current": {"temperature": 21.0}}
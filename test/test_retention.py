@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import delete, select
+
+from app.database.database import database
+from app.database.modelsDB import Esp, SensorReading
+from app.utils.RetentionManager import retention_manager
+
+DAY_MS = 24 * 3600 * 1000
+
+
+@pytest.fixture
+def esp_id():
+    """ESP con datos confirmados: la retención los borra en sus propias transacciones."""
+    with database._SessionFactory() as session:
+        esp = Esp(identification="TEST-RETENTION")
+        session.add(esp)
+        session.commit()
+        identifier = esp.id
+    yield identifier
+    with database._SessionFactory() as session:
+        session.execute(delete(SensorReading).where(SensorReading.esp_id == identifier))
+        session.execute(delete(Esp).where(Esp.id == identifier))
+        session.commit()
+
+
+def add_readings(esp_id: int, timestamps):
+    with database._SessionFactory() as session:
+        session.add_all(SensorReading(esp_id=esp_id, ts=ts, temperature=20.0) for ts in timestamps)
+        session.commit()
+
+
+def test_purge_raw_deletes_late_inserted_old_readings(esp_id, monkeypatch):
+    monkeypatch.setattr(retention_manager, "RETENTION_CHUNK_ROWS", 2)
+    monkeypatch.setattr(retention_manager, "RETENTION_PAUSE_MS", 0)
+    now = int(time.time() * 1000)
+    cutoff = now - DAY_MS
+
+    add_readings(esp_id, [cutoff - 3000, cutoff - 2000, cutoff - 1000])
+    # Ventanas de ids enteras solo con lecturas vigentes...
+    add_readings(esp_id, [now - index for index in range(5)])
+    # ...y después lecturas viejas con ids altos (p. ej. recuperadas del WAL)
+    add_readings(esp_id, [cutoff - 5000, cutoff - 4000])
+
+    assert asyncio.run(retention_manager._purge_raw(cutoff)) == 5
+
+    with database._SessionFactory() as session:
+        remaining = session.scalars(select(SensorReading.ts).where(SensorReading.esp_id == esp_id)).all()
+    assert sorted(remaining) == sorted(now - index for index in range(5))
@@ -0,0 +1,112 @@
+from sqlalchemy import select
+
+from app.database.modelsDB import Esp, SensorRollupMinute
+from app.utils.history_dependencies import bucket_row, history_plan, history_query, rollup_query
+from app.utils.rollup_dependencies import (
+    DAY_MS, HOUR_MS, MINUTE_MS, aggregate_rows, rebuild_rollups, rollup_for, upsert_rollups
+)
+from app.utils.sensor_dependencies import insert_readings, reading_row
+
+START = 1700000000000 - 1700000000000 % MINUTE_MS
+COLUMNS = ("bucket_ts", "count", "last_ts", "temperature_count", "temperature_sum",
+           "temperature_min", "temperature_max", "temperature_last", "humidity_count")
+
+
+def rollup_minutes(db, esp_id: int):
+    model = SensorRollupMinute
+    return db.execute(
+        select(*(model.__table__.c[name] for name in COLUMNS)).where(model.esp_id == esp_id).order_by(model.bucket_ts)
+    ).all()
+
+
+def rows_for(esp_id: int):
+    return [
+        reading_row(esp_id, {"temperature": 20 + index, "humidity": 50}, START + index * 20000)
+        for index in range(6)
+    ]
+
+
+def new_esp(db) -> int:
+    esp = Esp(identification="TEST-ROLLUP")
+    db.add(esp)
+    db.flush()
+    return esp.id
+
+
+def test_aggregate_rows_skips_values_that_are_not_finite_numbers():
+    rows = [
+        {"esp_id": 1, "ts": START, "temperature": 20.0, "humidity": None},
+        {"esp_id": 1, "ts": START + 1, "temperature": float("nan"), "humidity": "50"},
+        {"esp_id": 1, "ts": START + 2, "temperature": float("inf"), "humidity": {"value": 1}}
+    ]
+    [bucket] = aggregate_rows(rows, MINUTE_MS)
+    assert bucket["count"] == 3
+    assert (bucket["temperature_count"], bucket["temperature_sum"]) == (1, 20.0)
+    assert bucket["temperature_min"] == bucket["temperature_max"] == 20.0
+    assert bucket["humidity_count"] == 0
+    # El último valor es el de la lectura más reciente, aunque no sea válido
+    assert bucket["temperature_last"] is None
+
+
+def test_upsert_in_parts_matches_single_upsert(db):
+    esp_id = new_esp(db)
+    rows = rows_for(esp_id)
+    # Las partes llegan desordenadas, como un lote recuperado del WAL
+    upsert_rollups(db, rows[3:])
+    upsert_rollups(db, rows[:3])
+    in_parts = rollup_minutes(db, esp_id)
+
+    assert in_parts == [
+        (START, 3, START + 40000, 3, 63.0, 20.0, 22.0, 22.0, 3),
+        (START + MINUTE_MS, 3, START + 100000, 3, 72.0, 23.0, 25.0, 25.0, 3)
+    ]
+
+
+def test_rebuild_is_idempotent(db):
+    esp_id = new_esp(db)
+    rows = rows_for(esp_id)
+    insert_readings(db, rows)
+    upsert_rollups(db, rows)
+    incremental = rollup_minutes(db, esp_id)
+
+    assert rebuild_rollups(db, [esp_id]) == len(rows)
+    assert rollup_minutes(db, esp_id) == incremental
+    rebuild_rollups(db, [esp_id])
+    assert rollup_minutes(db, esp_id) == incremental
+
+
+def test_rollup_for_picks_coarsest_granularity_that_fits():
+    assert rollup_for(MINUTE_MS - 1) is None
+    assert rollup_for(MINUTE_MS) == (MINUTE_MS, SensorRollupMinute)
+    assert rollup_for(HOUR_MS - 1)[0] == MINUTE_MS
+    assert rollup_for(HOUR_MS)[0] == HOUR_MS
+    assert rollup_for(30 * DAY_MS)[0] == DAY_MS
+
+
+def test_history_plan_rounds_bucket_to_rollup_granularity():
+    # 24 h en 500 buckets: 172.8 s, se usa el rollup de minuto con buckets de 3 min
+    assert history_plan(START, START + DAY_MS, None) == (3 * MINUTE_MS, (MINUTE_MS, SensorRollupMinute))
+    # Menos de un minuto por bucket: lecturas crudas sin redondear
+    assert history_plan(START, START + HOUR_MS, None) == (7200, None)
+    bucket_ms, (granularity, _) = history_plan(START, START + 30 * DAY_MS, 90 * MINUTE_MS)
+    assert (bucket_ms, granularity) == (2 * HOUR_MS, HOUR_MS)
+
+
+def test_rollup_query_matches_raw_history(db):
+    esp_id = new_esp(db)
+    rows = [
+        reading_row(esp_id, {"temperature": 20 + index % 7, "humidity": 40 + index % 3}, START + index * 7000)
+        for index in range(200)
+    ]
+    insert_readings(db, rows)
+    upsert_rollups(db, rows)
+    to_ms = START + 200 * 7000
+    bucket_ms = 5 * MINUTE_MS
+
+    raw = [bucket_row(row) for row in db.execute(history_query(esp_id, START, to_ms, bucket_ms))]
+    from_rollup = [
+        bucket_row(row)
+        for row in db.execute(rollup_query(esp_id, START, to_ms, bucket_ms, MINUTE_MS, SensorRollupMinute))
+    ]
+    assert sum(bucket["count"] for bucket in raw) == len(rows)
+    assert from_rollup == raw
@@ -0,0 +1,40 @@
+import time
+from datetime import datetime
+
+from app.utils.sensor_dependencies import reading_row
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def test_reading_row_accepts_epoch_and_iso():
+    assert reading_row(1, {"timestamp": 1700000000000})["ts"] == 1700000000000
+    iso = "2024-11-17T01:05:29.029237"
+    assert reading_row(1, {"timestamp": iso})["ts"] == int(datetime.fromisoformat(iso).timestamp() * 1000)
+
+
+def test_reading_row_invalid_timestamp_uses_receive_time():
+    before = now_ms()
+    row = reading_row(1, {"temperature": 21.5, "timestamp": "yesterday"})
+    assert before <= row["ts"] <= now_ms()
+    assert row["temperature"] == 21.5
+    # La marca inválida no se guarda en extra
+    assert row["extra"] is None
+
+
+def test_reading_row_non_string_timestamp_uses_receive_time():
+    before = now_ms()
+    assert before <= reading_row(1, {"timestamp": {"day": 1}})["ts"] <= now_ms()
+
+
+def test_reading_row_converts_typed_columns_to_float():
+    row = reading_row(1, {"temperature": "25.1", "humidity": 40})
+    assert row["temperature"] == 25.1
+    assert row["humidity"] == 40.0 and isinstance(row["humidity"], float)
+
+
+def test_reading_row_stores_invalid_values_as_null():
+    for value in ({"value": 25}, "warm", float("nan"), float("inf"), "-inf", "nan", True, [1]):
+        row = reading_row(1, {"temperature": value, "humidity": value})
+        assert row["temperature"] is None and row["humidity"] is None, value
@@ -0,0 +1,125 @@
+import math
+from datetime import datetime
+
+import pytest
+
+from app.utils.telemetry_dependencies import (
+    FRAME_HEADER, FRAME_VERSION_1, FRAME_SENSOR_DATA, SAMPLE_V1, TelemetryFrameError,
+    SequenceTracker, decode_frame, encode_frame, iter_sensor_data, parse_batch
+)
+
+TS = 1700000000000
+
+
+def test_binary_frame_round_trip():
+    samples = [(1, TS, 21.5, 40.25), (2, TS + 1000, None, 41.0)]
+    frame_type, decoded = decode_frame(encode_frame(samples))
+    assert frame_type == FRAME_SENSOR_DATA
+    assert decoded == samples
+
+
+def test_binary_frame_non_finite_values_are_null():
+    frame = bytearray(FRAME_HEADER.pack(FRAME_VERSION_1, FRAME_SENSOR_DATA, 3))
+    for seq, value in enumerate((math.nan, math.inf, -math.inf)):
+        frame += SAMPLE_V1.pack(seq, TS, value, value)
+    _, decoded = decode_frame(bytes(frame))
+    assert [(temperature, humidity) for _, _, temperature, humidity in decoded] == [(None, None)] * 3
+
+
+@pytest.mark.parametrize("frame", [
+    b"\x01",
+    FRAME_HEADER.pack(2, FRAME_SENSOR_DATA, 0),
+    FRAME_HEADER.pack(FRAME_VERSION_1, 0x7F, 0),
+    encode_frame([(1, TS, 20.0, 40.0)])[:-1],
+    FRAME_HEADER.pack(FRAME_VERSION_1, FRAME_SENSOR_DATA, 2000)
+], ids=["truncated-header", "version", "type", "truncated-sample", "too-many-samples"])
+def test_invalid_binary_frames_are_rejected(frame):
+    with pytest.raises(TelemetryFrameError):
+        decode_frame(frame)
+
+
+def test_sensor_data_timestamps_match_the_json_path():
+    received = TS + 5000
+    readings = list(iter_sensor_data([(1, TS, 20.0, 40.0), (2, 0, 21.0, 41.0)], received))
+    assert [ts for ts, _ in readings] == [TS, received]
+    # Mismo formato que SENSOR_DATA en JSON: ISO 8601
+    assert readings[0][1]["timestamp"] == datetime.fromtimestamp(TS / 1000).isoformat()
+    assert readings[1][1]["timestamp"] == datetime.fromtimestamp(received / 1000).isoformat()
+
+
+def test_batch_accepts_objects_and_arrays():
+    samples = parse_batch({"samples": [
+        {"seq": 1, "ts": TS, "temperature": 20.123, "humidity": None},
+        [2, 0, "21.5", 40]
+    ]})
+    assert samples == [(1, TS, 20.12, None), (2, 0, 21.5, 40.0)]
+
+
+def test_batch_non_finite_values_are_null():
+    samples = parse_batch({"samples": [[1, TS, "nan", "inf"], [2, TS, float("-inf"), 40.0]]})
+    assert [(temperature, humidity) for _, _, temperature, humidity in samples] == [(None, None), (None, 40.0)]
+
+
+@pytest.mark.parametrize("data", [
+    {},
+    {"samples": []},
+    {"samples": [{"ts": TS}]},
+    {"samples": [[1, TS, "warm", 40.0]]},
+    {"samples": [[1, TS] for _ in range(2000)]}
+], ids=["missing", "empty", "no-seq", "not-a-number", "too-many"])
+def test_invalid_batches_are_rejected(data):
+    with pytest.raises(TelemetryFrameError):
+        parse_batch(data)
+
+
+def sample(seq: int):
+    return (seq, TS + seq, 20.0, 40.0)
+
+
+def seqs(samples):
+    return [seq for seq, _, _, _ in samples]
+
+
+def test_sequence_tracker_drops_duplicates_and_fills_gaps():
+    tracker = SequenceTracker()
+    accepted, advanced = tracker.filter("ESP", [sample(seq) for seq in (1, 2, 3)])
+    assert seqs(accepted) == [1, 2, 3] and advanced
+
+    # Reenvío de un backlog tras reconectar: solo pasan las nuevas, con un hueco 5..6
+    accepted, advanced = tracker.filter("ESP", [sample(seq) for seq in (7, 2, 3, 4)])
+    assert seqs(accepted) == [4, 7] and advanced
+    assert tracker.stats()["duplicates"] == 2
+    assert (tracker.stats()["gaps"], tracker.stats()["missing_samples"]) == (1, 2)
+
+    # Las faltantes llegan tarde una sola vez y no avanzan la secuencia
+    accepted, advanced = tracker.filter("ESP", [sample(seq) for seq in (6, 5, 6)])
+    assert seqs(accepted) == [5, 6] and not advanced
+    assert tracker.stats()["gap_fills"] == 2
+    assert tracker.stats()["duplicates"] == 3
+
+
+def test_sequence_tracker_restarts_on_new_boot_id_or_seq_zero():
+    tracker = SequenceTracker()
+    tracker.filter("ESP", [sample(seq) for seq in (10, 11)], boot_id="a")
+    accepted, _ = tracker.filter("ESP", [sample(seq) for seq in (1, 2)], boot_id="b")
+    assert seqs(accepted) == [1, 2]
+
+    tracker.filter("OTHER", [sample(seq) for seq in (10, 11)])
+    accepted, _ = tracker.filter("OTHER", [sample(seq) for seq in (0, 1)])
+    assert seqs(accepted) == [0, 1]
+    assert tracker.stats()["restarts"] == 2
+
+
+def test_sequence_tracker_keeps_only_the_newest_missing():
+    tracker = SequenceTracker(max_missing=4)
+    tracker.filter("ESP", [sample(0)])
+    tracker.filter("ESP", [sample(4)])            # faltan 1..3
+    tracker.filter("ESP", [sample(8)])            # faltan 5..7: se olvida 1 y 2
+    accepted, _ = tracker.filter("ESP", [sample(seq) for seq in (1, 2, 3, 5, 6, 7)])
+    assert seqs(accepted) == [3, 5, 6, 7]
+
+    # Un hueco enorme solo recuerda las últimas max_missing secuencias
+    tracker.filter("ESP", [sample(1_000_000)])
+    accepted, _ = tracker.filter("ESP", [sample(seq) for seq in (9, 999_995, 999_996, 999_999)])
+    assert seqs(accepted) == [999_996, 999_999]
+    assert len(tracker._devices["ESP"]["missing"]) == 2
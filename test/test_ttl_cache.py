@@ -0,0 +1,100 @@
+import pytest
+
+from app.database.modelsDB import Esp, Usuario_Esp
+from app.utils import TTLCache as ttl_module
+from app.utils import esp_dependencies
+from app.utils.TTLCache import TTLCache
+from app.utils.esp_dependencies import EspValidationExists, invalidate_esp_cache, user_has_device_access
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ttl_module.time, "monotonic", clock)
+    return clock
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = TTLCache(ttl=10)
+    cache.set("a", 1)
+    cache.set("b", False, ttl=2)
+    clock.now += 5
+    # Los valores negativos se distinguen de un fallo con ``default``
+    assert cache.get("b", default="miss") == "miss"
+    assert cache.get("a") == 1
+    clock.now += 5
+    assert cache.get("a", default="miss") == "miss"
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_lru_eviction_keeps_recently_read_entries(clock):
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_zero_ttl_and_invalidation_remove_entries(clock):
+    cache = TTLCache()
+    cache.set("a", 1)
+    cache.set("a", 2, ttl=0)
+    assert cache.get("a") is None
+    for key in (("u1", "ESP"), ("u2", "ESP"), ("u1", "OTHER")):
+        cache.set(key, True)
+    assert cache.invalidate_matching(lambda key: key[1] == "ESP") == 2
+    assert list(cache._data) == [("u1", "OTHER")]
+
+
+@pytest.fixture
+def esp_caches():
+    esp_dependencies.esp_validation_cache.clear()
+    esp_dependencies.device_access_cache.clear()
+    yield
+    esp_dependencies.esp_validation_cache.clear()
+    esp_dependencies.device_access_cache.clear()
+
+
+def test_validation_is_served_from_cache_until_invalidated(db, user_id, esp_caches):
+    esp = Esp(identification="TEST-CACHE")
+    db.add(esp)
+    db.flush()
+    assert EspValidationExists("TEST-CACHE", db)["is_associated"] is False
+
+    db.add(Usuario_Esp(id_user=user_id, id_esp=esp.id))
+    db.flush()
+    # El resultado negativo sigue en caché hasta que vence o se invalida
+    assert EspValidationExists("TEST-CACHE", db)["is_associated"] is False
+    assert user_has_device_access(db, "test-user", "TEST-CACHE") is True
+
+    invalidate_esp_cache("TEST-CACHE")
+    validation = EspValidationExists("TEST-CACHE", db)
+    assert (validation["is_associated"], validation["user_id"]) == (True, user_id)
+    assert len(esp_dependencies.device_access_cache) == 0
+
+
+def test_negative_results_use_the_shorter_ttl(db, esp_caches, monkeypatch):
+    stored = {}
+    monkeypatch.setattr(esp_dependencies.esp_validation_cache, "set",
+                        lambda key, value, ttl=None: stored.update({key: ttl}))
+    monkeypatch.setattr(esp_dependencies.device_access_cache, "set",
+                        lambda key, value, ttl=None: stored.update({key: ttl}))
+
+    EspValidationExists("TEST-MISSING", db)
+    user_has_device_access(db, "test-user", "TEST-MISSING")
+    assert stored == {
+        "TEST-MISSING": esp_dependencies.ESP_CACHE_NEGATIVE_TTL_S,
+        ("test-user", "TEST-MISSING"): esp_dependencies.ESP_CACHE_NEGATIVE_TTL_S
+    }
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import threading
+
+from app.utils.WriteAheadLog import FSYNC_ALWAYS, RECORD_HEADER, WriteAheadLog
+
+
+def records(count: int, start: int = 0):
+    return [{"device_id": "TEST-ESP", "seq": index} for index in range(start, start + count)]
+
+
+def new_log(tmp_path, **kwargs) -> WriteAheadLog:
+    wal = WriteAheadLog(str(tmp_path / "wal"), **kwargs)
+    assert list(wal.replay()) == []
+    return wal
+
+
+def segment_path(wal: WriteAheadLog) -> str:
+    return wal._segment_path(wal.segment_id)
+
+
+def test_replay_returns_appended_records(tmp_path):
+    wal = new_log(tmp_path)
+    wal.append_many(records(3))
+    wal.rotate()
+    wal.append(records(1, start=3)[0])
+    wal.close()
+
+    assert [record["seq"] for record in WriteAheadLog(wal.directory).replay()] == [0, 1, 2, 3]
+
+
+def test_replay_discards_torn_record_and_realigns(tmp_path):
+    wal = new_log(tmp_path)
+    wal.append_many(records(3))
+    path = segment_path(wal)
+    valid_size = os.path.getsize(path)
+    wal.close()
+    # Escritura interrumpida: cabecera completa y la mitad del payload
+    with open(path, "ab") as f:
+        f.write(RECORD_HEADER.pack(100, 0) + b'{"device_id":')
+
+    recovered = WriteAheadLog(wal.directory)
+    assert [record["seq"] for record in recovered.replay()] == [0, 1, 2]
+    assert os.path.getsize(path) == valid_size
+
+    # Lo que se escribe después queda alineado y se recupera en la siguiente vuelta
+    recovered.append(records(1, start=3)[0])
+    recovered.close()
+    assert [record["seq"] for record in WriteAheadLog(wal.directory).replay()] == [0, 1, 2, 3]
+
+
+def test_replay_stops_at_record_with_bad_crc(tmp_path):
+    wal = new_log(tmp_path)
+    wal.append_many(records(3))
+    path = segment_path(wal)
+    wal.close()
+
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    first_length, _ = RECORD_HEADER.unpack_from(data, 0)
+    # Un byte alterado en el payload del segundo registro
+    second_payload = RECORD_HEADER.size + first_length + RECORD_HEADER.size
+    data[second_payload + 2] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(data)
+
+    assert [record["seq"] for record in WriteAheadLog(wal.directory).replay()] == [0]
+    assert os.path.getsize(path) == RECORD_HEADER.size + first_length
+
+
+def test_truncate_removes_confirmed_segments_only(tmp_path):
+    wal = new_log(tmp_path)
+    wal.append_many(records(2))
+    checkpoint = wal.rotate()
+    wal.append_many(records(2, start=2))
+    wal.truncate(checkpoint)
+    wal.close()
+
+    assert [record["seq"] for record in WriteAheadLog(wal.directory).replay()] == [2, 3]
+
+
+def test_always_policy_fsyncs_off_the_event_loop(tmp_path, monkeypatch):
+    wal = new_log(tmp_path, fsync_policy=FSYNC_ALWAYS)
+    threads = []
+    real_fsync = os.fsync
+
+    def recording_fsync(fd):
+        threads.append(threading.get_ident())
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", recording_fsync)
+    wal.append_many(records(2))
+    # append_many no hace fsync en el hilo del llamador
+    assert threads == []
+
+    asyncio.run(wal.commit())
+    assert len(threads) == 1 and threads[0] != threading.get_ident()
+    # Sin escrituras nuevas no hay nada que confirmar
+    asyncio.run(wal.commit())
+    assert len(threads) == 1
+    wal.close()
+
+
+def test_rotation_and_group_sync_fsync_off_the_event_loop(tmp_path, monkeypatch):
+    wal = new_log(tmp_path)
+    threads = []
+    real_fsync = os.fsync
+
+    def recording_fsync(fd):
+        threads.append(threading.get_ident())
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", recording_fsync)
+    wal.append_many(records(2))
+    wal.rotate()
+    wal.append_many(records(2, start=2))
+    # La rotación deja el segmento cerrado pendiente, sin fsync en el llamador
+    assert threads == []
+
+    asyncio.run(wal.sync_async())
+    # El segmento rotado y el activo, ambos fuera del hilo del llamador
+    assert len(threads) == 2 and threading.get_ident() not in threads
+    asyncio.run(wal.sync_async())
+    assert len(threads) == 2
+    wal.close()
+    assert [record["seq"] for record in WriteAheadLog(wal.directory).replay()] == [0, 1, 2, 3]
@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+import pytest
+
+from app.utils import WsManager
+from app.utils.DeviceRegistry import DeviceRegistry
+from app.utils.FrontendConnection import FrontendConnection
+from app.utils.PubSubBroker import InProcessBroker
+
+
+class FakeWebSocket:
+    """WebSocket de frontend que registra los frames de texto enviados."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, message: str):
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+@pytest.fixture
+def manager():
+    """ConnectionManager independiente del singleton, con un broker en proceso."""
+    instance = object.__new__(WsManager.ConnectionManager)
+    instance.esp_connections = {}
+    instance.frontend_connections = {}
+    instance.esp_states = {}
+    instance.user_devices = {}
+    instance.device_subscribers = {}
+    instance.broker = InProcessBroker()
+    instance.registry = DeviceRegistry(instance.broker)
+    instance.forwarded_commands = {}
+    return instance
+
+
+def add_frontend(manager, user_id: str) -> FrontendConnection:
+    connection = FrontendConnection(FakeWebSocket(), user_id, manager.disconnect_frontend)
+    manager.frontend_connections[user_id] = connection
+    return connection
+
+
+@pytest.fixture
+def encode_calls(monkeypatch):
+    calls = []
+
+    def counting_encode(message):
+        calls.append(message)
+        return json.dumps(message)
+
+    monkeypatch.setattr(WsManager, "encode_json", counting_encode)
+    return calls
+
+
+def test_broadcast_serializes_once_and_shares_the_frame(manager, encode_calls):
+    async def scenario():
+        connections = [add_frontend(manager, f"user-{index}") for index in range(3)]
+        for connection in connections:
+            manager.subscribe_to_device(connection.user_id, "ESP")
+
+        await manager.broadcast_esp_data("ESP", {"temperature": 21.5})
+
+        assert len(encode_calls) == 1
+        frames = [connection._queue.get_nowait()[1] for connection in connections]
+        # El mismo objeto str en todas las colas, no una copia por suscriptor
+        assert all(frame is frames[0] for frame in frames)
+        message = json.loads(frames[0])
+        assert (message["type"], message["device_id"]) == ("ESP_DATA", "ESP")
+        assert message["data"]["temperature"] == 21.5
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_without_subscribers_skips_serialization(manager, encode_calls):
+    async def scenario():
+        add_frontend(manager, "user")
+        manager.subscribe_to_device("user", "OTHER")
+
+        await manager.broadcast_esp_data("ESP", {"temperature": 21.5})
+
+        assert encode_calls == []
+        # El estado se guarda igual para quien lo consulte después
+        assert manager.get_esp_state("ESP")["temperature"] == 21.5
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_frame_reaches_the_socket_unchanged(manager):
+    async def scenario():
+        connection = add_frontend(manager, "user")
+        connection.interval = 0
+        connection.start()
+        manager.subscribe_to_device("user", "ESP")
+
+        await manager.broadcast_esp_data("ESP", {"temperature": 21.5}, samples=[{"temperature": 21.5}])
+        await connection._queue.join()
+
+        [frame] = connection.websocket.sent
+        assert json.loads(frame)["samples"] == [{"temperature": 21.5}]
+        connection.stop()
+
+    asyncio.run(scenario())
+
+
+class SharedBroker(InProcessBroker):
+    """Broker en proceso que se comporta como distribuido y cuenta las lecturas por lote."""
+
+    distributed = True
+
+    def __init__(self):
+        super().__init__()
+        self.get_many_calls = []
+
+    async def get_many(self, keys):
+        self.get_many_calls.append(keys)
+        return await super().get_many(keys)
+
+
+def test_fetch_esp_states_reads_unknown_devices_in_one_call(manager):
+    manager.broker = SharedBroker()
+
+    async def scenario():
+        manager.esp_states["LOCAL"] = {"temperature": 1}
+        remote = WsManager.encode_json({"type": "ESP_DATA", "device_id": "REMOTE", "data": {"temperature": 2}})
+        await manager.broker.set(WsManager.ESP_STATE_KEY + "REMOTE", remote)
+
+        states = await manager.fetch_esp_states(["LOCAL", "REMOTE", "MISSING"])
+
+        assert states == {"LOCAL": {"temperature": 1}, "REMOTE": {"temperature": 2}}
+        assert manager.broker.get_many_calls == [[WsManager.ESP_STATE_KEY + "REMOTE", WsManager.ESP_STATE_KEY + "MISSING"]]
+
+    asyncio.run(scenario())
+
+
+def test_subscribe_to_devices_registers_every_device(manager):
+    async def scenario():
+        add_frontend(manager, "user")
+        assert manager.subscribe_to_devices("user", ["A", "B"], interval_ms=0)
+        assert manager.user_devices["user"] == {"A", "B"}
+        assert manager.device_subscribers == {"A": {"user"}, "B": {"user"}}
+        assert manager.frontend_connections["user"].interval == 0
+
+    asyncio.run(scenario())